@@ -3,6 +3,8 @@ Algorithms for manipulating OpenCV videos for use with the Oculus DK2
 """
 
 
+import threading
+
 import numpy as np
 import cv2
 
@@ -49,6 +51,105 @@ def transform(image, matrix, k1=0.22, k2=0.24):
         np.array([k1, k2, 0, 0, 0])
     )
 
+def create_remap(matrix, offset, offset2, crops, k1=0.22, k2=0.24,
+                 scale=1, margin=0, rectify=None):
+    """Compose translate, transform, translate and crop into one map
+
+    Builds the lookup tables for a single `cv2.remap` that produces
+    the same output as running `translate`, `transform`, `translate`
+    and `crop` in sequence, so each frame is resampled once instead
+    of three times. The maps are sized to the cropped output, times
+    `scale`: a reduced scale downsamples the full resolution frame
+    as part of the same remap.
+
+    With a `margin`, the maps extend that many (output) pixels beyond
+    the cropped frame on every side; remapping with a window of them
+    shifts the image, at no extra cost (see `RemapEngine.apply`).
+
+    With `rectify` maps, from a camera calibration, the camera's lens
+    undistortion and stereo rectification are folded in as well: the
+    chain runs on the rectified frame, still in a single remap.
+
+    Args:
+        matrix (np.array): distortion matrix, as from
+            `create_distortion_matrix`
+        offset (tuple): (x, y) of the translation before distortion
+        offset2 (tuple): (x, y) of the translation after distortion
+        crops (tuple): (_xl, _xr, _yl, _yr), as passed to `crop`
+        k1, k2 (float): distortion coefficients, as for `transform`
+        scale (float): size of the output relative to the cropped
+            frame
+        margin (int): extra pixels of map on each side
+        rectify (tuple): (map_x, map_y) from rectified to raw frame
+            coordinates, as from `CalibrationProfile.rectify_maps`
+
+    Returns:
+        (map1, map2): fixed-point maps for `cv2.remap`
+    """
+    width, height = Parameters.width, Parameters.height
+    matrix = np.asarray(matrix, dtype=np.float64)
+    map_x, map_y = cv2.initUndistortRectifyMap(
+        matrix,
+        np.array([k1, k2, 0, 0, 0]),
+        None,
+        matrix,
+        (width, height),
+        cv2.CV_32FC1,
+    )
+
+    # Same slicing as `crop`, applied to pixel indices
+    _xl, _xr, _yl, _yr = crops
+    rows = np.arange(height)[_xl:width - _xr]
+    columns = np.arange(width)[_yl:height - _yr]
+    size = scaled_size((len(columns), len(rows)), scale)
+    if margin and len(rows) and len(columns):
+        pad = int(np.ceil(margin / float(scale)))
+        rows = np.arange(rows[0] - pad, rows[-1] + pad + 1)
+        columns = np.arange(columns[0] - pad, columns[-1] + pad + 1)
+        size = (size[0] + 2 * margin, size[1] + 2 * margin)
+    rows = rows - offset2[1]
+    columns = columns - offset2[0]
+
+    # Pixels that the second translation shifts in from outside the
+    # frame are blank, as are those sampled from outside the first
+    # translation's output.
+    valid = np.logical_and.outer(
+        (rows >= 0) & (rows < height),
+        (columns >= 0) & (columns < width),
+    )
+    rows = np.clip(rows, 0, height - 1)[:, np.newaxis]
+    columns = np.clip(columns, 0, width - 1)[np.newaxis, :]
+    map_x = map_x[rows, columns]
+    map_y = map_y[rows, columns]
+    valid &= (map_x > -1) & (map_x < width)
+    valid &= (map_y > -1) & (map_y < height)
+
+    if size != map_x.shape[1::-1]:
+        map_x = cv2.resize(map_x, size, interpolation=cv2.INTER_LINEAR)
+        map_y = cv2.resize(map_y, size, interpolation=cv2.INTER_LINEAR)
+        valid = cv2.resize(
+            valid.astype(np.uint8), size, interpolation=cv2.INTER_NEAREST
+        ).astype(bool)
+
+    map_x -= offset[0]
+    map_y -= offset[1]
+    if rectify is not None:
+        valid &= (map_x >= 0) & (map_x <= width - 1)
+        valid &= (map_y >= 0) & (map_y <= height - 1)
+        map_x, map_y = [
+            cv2.remap(rectified, map_x, map_y, cv2.INTER_LINEAR,
+                      borderMode=cv2.BORDER_REPLICATE)
+            for rectified in rectify
+        ]
+    map_x[~valid] = -1
+    map_y[~valid] = -1
+
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+def scaled_size(size, scale):
+    """(width, height) of `size` multiplied by `scale`, at least 1x1"""
+    return tuple(max(1, int(round(dimension * scale))) for dimension in size)
+
 def join_images(image_left, image_right):
     """Join two images left-to-right, using Numpy"""
     return np.append(image_left, image_right, axis=1)
@@ -69,6 +170,326 @@ def translate(image, x, y):
         (columns, rows)
     )
 
+class MapRegistry(object):
+    """Distortion maps shared by every RemapEngine, by what they were
+    built from
+
+    Engines whose parameters match (e.g. both eyes, until their
+    calibrations diverge) get the very same maps, built once. The
+    maps are made read-only, since they are shared. Each entry counts
+    the engines using it, and is dropped when the last one releases
+    it.
+    """
+    def __init__(self):
+        self.maps = {}
+        self.users = {}
+        # Reentrant, as engines release their maps when collected
+        self.lock = threading.RLock()
+
+    def acquire(self, values, build):
+        """The maps for `values`, built with `build` if not held yet"""
+        with self.lock:
+            if values not in self.maps:
+                maps = tuple(build())
+                for array in maps:
+                    array.flags.writeable = False
+                self.maps[values] = maps
+                self.users[values] = 0
+            self.users[values] += 1
+            return self.maps[values]
+
+    def release(self, values):
+        """Stop using the maps for `values`"""
+        with self.lock:
+            self.users[values] -= 1
+            if not self.users[values]:
+                del self.maps[values]
+                del self.users[values]
+
+    def __len__(self):
+        return len(self.maps)
+
+
+class RemapEngine(object):
+    """Cached replacement for the per-frame distortion chain
+
+    Holds the maps from `create_remap` and rebuilds them only when
+    one of the Parameters they were built from changes, so the
+    steady-state cost per frame is a single `cv2.remap`.
+
+    Follows the processing mode in the Parameters: `scale` below 1
+    produces a smaller frame (see `CompositeBuffer.scaled`), and
+    `gray` converts the frame to luma first, so only one channel is
+    resampled.
+
+    When `caR` or `caB` is set, the red and blue channels are
+    distorted with their own k1 (offset by those amounts), to correct
+    the lens' chromatic aberration; each channel is remapped with its
+    own cached map, which costs about as much as one `cv2.undistort`.
+
+    Each engine distorts for one eye, with that eye's intrinsics and
+    offset (`fxL` ... `yL`, or `fxR` ... `yR`). Maps come from the
+    shared `registry`, so while both eyes' parameters match they use
+    one set of maps.
+
+    When `RemapEngine.profile` is set to a `CalibrationProfile`, each
+    eye's maps also undistort and rectify its camera.
+
+    When `RemapEngine.cache` is set to a `MapCache`, maps are loaded
+    from it (memory-mapped) instead of rebuilt, for every calibration
+    seen before.
+    """
+    # Shared CalibrationProfile and MapCache, if any, set at startup
+    profile = None
+    cache = None
+    registry = MapRegistry()
+
+    def __init__(self, margin=0, eye='left'):
+        """Maps are built lazily, from the Parameters
+
+        Args:
+            margin (int): largest shift, in pixels, that `apply` can
+                be asked for (see `create_remap`)
+            eye (str): 'left' or 'right', whose parameters to use
+        """
+        self.margin = margin
+        self.eye = eye
+        self.key = None
+        self.held = []
+        self.maps = None
+        self.channel_maps = None
+        self.planes = None
+
+    # The Parameters groups, besides the eye's own, that the maps are
+    # built from
+    groups = ('frame', 'offsets', 'crop', 'mode', 'lens')
+
+    def parameters(self):
+        """Versions of the Parameters (and the eye and margin) that the
+        maps depend on; they are rebuilt when this changes"""
+        return (self.eye, ) + Parameters.versions(self.eye, *self.groups) + (
+            self.margin,
+        )
+
+    def update(self):
+        """Rebuild the maps if any relevant parameter has changed
+
+        Returns the maps for a whole frame (the green channel's, when
+        correcting chromatic aberration), including the margin.
+        """
+        key = self.parameters()
+        if key != self.key:
+            par = Parameters
+            suffix = self.eye[0].upper()
+            fx, cx, fy, cy, x, y = [
+                getattr(par, name + suffix)
+                for name in ['fx', 'cx', 'fy', 'cy', 'x', 'y']
+            ]
+            matrix = create_distortion_matrix(fx, cx, fy, cy)
+            arguments = (
+                (x + par.xo, y + par.yo),
+                (par.xo2, par.yo2),
+                (par.cropXL, par.cropXR, par.cropYL, par.cropYR),
+            )
+            held = self.held
+            self.held = []
+            self.maps = self.build(
+                matrix, arguments, par.k1, par.k2, par.scale
+            )
+            self.channel_maps = None
+            if (par.caB or par.caR) and not par.gray:
+                blue, red = [
+                    self.build(
+                        matrix, arguments, par.k1 + ca, par.k2, par.scale
+                    )
+                    for ca in [par.caB, par.caR]
+                ]
+                self.channel_maps = [blue, self.maps, red]
+            # Released after acquiring the new maps, so any that did
+            # not change are kept rather than rebuilt
+            for values in held:
+                self.registry.release(values)
+            self.key = key
+        return self.maps
+
+    def release(self):
+        """Give the maps back to the registry"""
+        held, self.held = self.held, []
+        for values in held:
+            self.registry.release(values)
+        self.key = self.maps = self.channel_maps = None
+
+    def __del__(self):
+        self.release()
+
+    def build(self, matrix, arguments, k1, k2, scale):
+        """Maps from `create_remap`, shared through the registry, and
+        through the cache if there is one
+
+        Args:
+            matrix (np.array): distortion matrix
+            arguments (tuple): (offset, offset2, crops), as for
+                `create_remap`
+            k1, k2 (float): distortion coefficients
+            scale (float): size of the output relative to the frame
+        """
+        size = (Parameters.width, Parameters.height)
+        profile = self.profile
+        def remap():
+            rectify = None
+            if profile is not None:
+                rectify = profile.rectify_maps(self.eye, size)
+            return create_remap(
+                matrix, *arguments, k1=k1, k2=k2, scale=scale,
+                margin=self.margin, rectify=rectify
+            )
+        values = size + (
+            tuple(np.asarray(matrix, dtype=np.float64).ravel()),
+        ) + tuple(arguments) + (k1, k2, scale, self.margin)
+        if profile is not None:
+            values += profile.values(self.eye)
+        self.held.append(values)
+        if self.cache is None:
+            return self.registry.acquire(values, remap)
+        return self.registry.acquire(
+            values, lambda: self.cache.get(values, remap)
+        )
+
+    def window(self, maps, shift=None):
+        """Views of `maps` without the margin, moved by `shift`
+
+        Args:
+            maps (tuple): (map1, map2), as from `create_remap`
+            shift (tuple): (x, y) in pixels, each clamped to the
+                margin; the image moves by the opposite amount
+        """
+        margin = self.margin
+        if not margin:
+            return maps
+        x, y = shift or (0, 0)
+        x = int(max(-margin, min(margin, x))) + margin
+        y = int(max(-margin, min(margin, y))) + margin
+        rows, columns = maps[0].shape[:2]
+        return tuple(
+            mapped[y:y + rows - 2 * margin, x:x + columns - 2 * margin]
+            for mapped in maps
+        )
+
+    def prepare(self, image):
+        """`image` in the colour mode being processed"""
+        if Parameters.gray and image.ndim == 3:
+            return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        return image
+
+    def shape(self, image):
+        """Shape of the output of `apply` for the raw frame `image`"""
+        rows, columns = self.update()[0].shape[:2]
+        rows -= 2 * self.margin
+        columns -= 2 * self.margin
+        if Parameters.gray:
+            return (rows, columns)
+        return (rows, columns) + image.shape[2:]
+
+    def apply(self, image, dst=None, shift=None):
+        """Translate, distort and crop `image` in a single pass
+
+        Args:
+            image (np.array): the raw camera frame
+            dst (np.array): optional output array, shaped like the
+                cropped frame, to write into instead of allocating
+            shift (tuple): (x, y) to move the sampled window by,
+                within the margin, e.g. for timewarp
+        """
+        map1, map2 = self.window(self.update(), shift)
+        image = self.prepare(image)
+        if self.channel_maps is not None and image.ndim == 3:
+            return self.apply_channels(image, dst, shift)
+        return cv2.remap(
+            image,
+            map1,
+            map2,
+            cv2.INTER_LINEAR,
+            dst=dst,
+            borderMode=cv2.BORDER_CONSTANT,
+        )
+
+    def apply_channels(self, image, dst=None, shift=None):
+        """Remap each colour channel of `image` with its own map"""
+        shape = self.shape(image)[:2]
+        if self.planes is None or self.planes[0].shape != shape:
+            self.planes = [
+                np.empty(shape, dtype=image.dtype) for _ in range(3)
+            ]
+        for plane, output, maps in zip(
+                cv2.split(image), self.planes, self.channel_maps):
+            map1, map2 = self.window(maps, shift)
+            cv2.remap(
+                plane,
+                map1,
+                map2,
+                cv2.INTER_LINEAR,
+                dst=output,
+                borderMode=cv2.BORDER_CONSTANT,
+            )
+        return cv2.merge(self.planes, dst=dst)
+
+class CompositeBuffer(object):
+    """Persistent side-by-side image that both eyes render into
+
+    Each eye writes its processed frame straight into its half of
+    `image` (through the view returned by `half`), so the composite
+    exists without allocating or copying a new array per frame.
+
+    `locks` holds one lock per half; writers hold their half's lock
+    and readers of the whole composite hold both, which lets the two
+    eyes render in parallel when run on separate threads.
+    """
+    def __init__(self):
+        self.image = None
+        self.locks = (threading.Lock(), threading.Lock())
+        self.upscaled = None
+
+    def half(self, index, shape, dtype):
+        """View onto one eye's half of the composite
+
+        Reallocates the composite if the per-eye shape or dtype has
+        changed (e.g. after the crop parameters change).
+
+        Args:
+            index (int): 0 for the left eye, 1 for the right
+            shape (tuple): shape of a single eye's frame
+            dtype (np.dtype): dtype of a single eye's frame
+        """
+        height, width = shape[:2]
+        full = (height, 2 * width) + tuple(shape[2:])
+        if (self.image is None or self.image.shape != full or
+                self.image.dtype != dtype):
+            self.image = np.zeros(full, dtype=dtype)
+        return self.image[:, index * width:(index + 1) * width]
+
+    def contains(self, frame):
+        """Whether `frame` is already a view onto the composite"""
+        return self.image is not None and frame.base is self.image
+
+    def scaled(self, scale):
+        """The composite at full size, when rendered at `scale`
+
+        Eyes processed at reduced resolution are upscaled here, once,
+        into a persistent buffer; at full scale this is `image`.
+        """
+        if scale == 1:
+            return self.image
+        size = scaled_size(self.image.shape[1::-1], 1.0 / scale)
+        shape = size[::-1] + self.image.shape[2:]
+        if self.upscaled is None or self.upscaled.shape != shape:
+            self.upscaled = np.empty(shape, dtype=self.image.dtype)
+        return cv2.resize(
+            self.image,
+            size,
+            dst=self.upscaled,
+            interpolation=cv2.INTER_LINEAR,
+        )
+
 def print_params():
     """Print out all parameters for reference"""
     strings = []
@@ -80,66 +501,210 @@ def print_params():
     string = ', '.join(strings)
     print(string)
 
-class Parameters():
-    """Parameters for the video frame and the like
+def at_least(minimum):
+    """Validator: the value may not be below `minimum`"""
+    def validate(name, value):
+        if value < minimum:
+            raise ValueError('{} cannot be below {}'.format(name, minimum))
+    return validate
+
+def between(low, high):
+    """Validator: the value must be within [`low`, `high`]"""
+    def validate(name, value):
+        if not low <= value <= high:
+            raise ValueError('{} must be between {} and {}'.format(
+                name, low, high
+            ))
+    return validate
 
-    Includes width, height, offsets, warp, and window size, as well
-    as frames-per-second.
+class ParameterStore(object):
+    """Run-time parameters, in versioned groups, with change callbacks
 
-    Also includes a set of key mapping tuples, which are used to
-    increment and decrement (the first and second items in the tuple)
-    each parameter. This could be possibly more elegant, but it's
-    simple and it works ok.
+    Parameters are read and written as attributes, and `dir` lists
+    them, so they can be iterated over and changed with `setattr`.
+    Each group (e.g. 'left', 'crop') has a version that increases
+    whenever one of its parameters changes value, so derived data
+    (such as distortion maps) can be rebuilt only when its inputs
+    change: compare `versions(...)` with those it was built from.
+
+    Values are checked by the parameter's validator, if any, which
+    raises ValueError (leaving the old value) for bad ones. Callbacks
+    registered with `subscribe` are called with the group, name and
+    new value after each change.
     """
+    def __init__(self, groups, validators=None, key_mappings=None):
+        """
+        Args:
+            groups (dict): default values, as {group: {name: value}}
+            validators (dict): functions `(name, value)` that raise
+                ValueError for bad values, by parameter name
+            key_mappings (dict): key bindings (see `InputHandler`)
+        """
+        set_ = object.__setattr__
+        set_(self, '_values', {})
+        set_(self, '_groups', {})
+        set_(self, '_versions', dict((group, 0) for group in groups))
+        set_(self, '_callbacks', [])
+        set_(self, '_validators', validators or {})
+        set_(self, 'key_mappings', key_mappings or {})
+        for group, values in groups.items():
+            for name, value in values.items():
+                self._values[name] = value
+                self._groups[name] = group
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError('No parameter {}'.format(name))
+
+    def __setattr__(self, name, value):
+        if name == 'key_mappings':
+            object.__setattr__(self, name, value)
+        else:
+            self.set(name, value)
+
+    def __dir__(self):
+        return sorted(self._values) + ['key_mappings']
+
+    def set(self, name, value):
+        """Validate and set a parameter; returns whether it changed"""
+        if name not in self._values:
+            raise AttributeError('No parameter {}'.format(name))
+        validate = self._validators.get(name)
+        if validate is not None:
+            validate(name, value)
+        if self._values[name] == value:
+            return False
 
-    cropXL = 0
-    cropXR = 160
-    cropYL = 0
-    cropYR = 0
-    cxL = 330
-    cxR = 330
-    cyL = 250
-    cyR = 250
-    fps = 15
-    fxL = 270
-    fxR = 270
-    fyL = 360
-    fyR = 360
-    height = 480
-    width = 720
-    xL = 0
-    xR = 0
-    xo = 20
-    xo2 = -90
-    yL = 0
-    yR = 0
-    yo = 0
-    yo2 = 30
-    qcropXL = 0
-    cropXR = 160
-    cropYL = 0
-    cropYR = 0
-    cxL = 330
-    cxR = 330
-    cyL = 250
-    cyR = 250
-    fps = 15
-    fxL = 270
-    fxR = 270
-    fyL = 360
-    fyR = 360
-    height = 480
-    width = 720
-    xL = 0
-    xR = 0
-    xo = 20
-    xo2 = -90
-    yL = 0
-    yR = 0
-    yo = 0
-    yo2 = 30
-
-    key_mappings = dict(
+        group = self._groups[name]
+        self._values[name] = value
+        self._versions[group] += 1
+        for callback, groups in self._callbacks:
+            if not groups or group in groups:
+                callback(group, name, value)
+        return True
+
+    def group(self, name):
+        """The group parameter `name` belongs to"""
+        return self._groups[name]
+
+    def version(self, group):
+        """Number of changes to `group` so far"""
+        return self._versions[group]
+
+    def versions(self, *groups):
+        """Versions of several groups, as a tuple to compare"""
+        return tuple(self._versions[group] for group in groups)
+
+    def subscribe(self, callback, *groups):
+        """Call `callback(group, name, value)` on changes to `groups`
+        (any group, if none are given)"""
+        self._callbacks.append((callback, groups))
+
+    def unsubscribe(self, callback):
+        object.__setattr__(self, '_callbacks', [
+            item for item in self._callbacks if item[0] != callback
+        ])
+
+    def values(self):
+        """Snapshot of all parameter values, by name"""
+        return dict(self._values)
+
+
+# Parameters for the video frame and the like: width, height,
+# intrinsics and offsets of each eye, crops and frames-per-second,
+# along with the processing mode, lens, head pose and timewarp
+# settings. The groups are versioned separately.
+#
+# Also includes a set of key mapping tuples, which are used to
+# increment and decrement (the first and second items in the tuple)
+# each parameter, by 10 or by the optional third item. This could be
+# possibly more elegant, but it's simple and it works ok.
+Parameters = ParameterStore(
+    dict(
+        frame=dict(
+            width=720,
+            height=480,
+            fps=15,
+        ),
+        left=dict(
+            fxL=270,
+            fyL=360,
+            cxL=330,
+            cyL=250,
+            xL=0,
+            yL=0,
+        ),
+        right=dict(
+            fxR=270,
+            fyR=360,
+            cxR=330,
+            cyR=250,
+            xR=0,
+            yR=0,
+        ),
+        offsets=dict(
+            xo=20,
+            yo=0,
+            xo2=-90,
+            yo2=30,
+        ),
+        crop=dict(
+            cropXL=0,
+            cropXR=160,
+            cropYL=0,
+            cropYR=0,
+        ),
+        # Processing mode: each eye is processed at `scale` times full
+        # resolution and upscaled once for display; if `gray` is set,
+        # in luma only.
+        mode=dict(
+            scale=1,
+            gray=0,
+        ),
+        # Radial distortion coefficients, and the offsets of the red
+        # and blue channels' k1 from them, which correct chromatic
+        # aberration
+        lens=dict(
+            k1=0.22,
+            k2=0.24,
+            caR=0,
+            caB=0,
+        ),
+        # Head pose filtering (see pose.PoseFilter): the filter's
+        # cutoff when still (Hz), its increase with speed, and the
+        # prediction lead (ms)
+        pose=dict(
+            poseCutoff=1.0,
+            poseBeta=0.5,
+            poseLead=0,
+        ),
+        # Timewarp (see pose.Timewarp): on or off, the servos' lag
+        # (ms), and the size and direction of the image shift
+        warp=dict(
+            warp=0,
+            warpLag=50,
+            warpGain=1,
+        ),
+    ),
+    validators=dict(
+        width=at_least(1),
+        height=at_least(1),
+        fps=at_least(1),
+        cropXL=at_least(0),
+        cropXR=at_least(0),
+        cropYL=at_least(0),
+        cropYR=at_least(0),
+        scale=between(0.1, 1),
+        gray=between(0, 1),
+        poseCutoff=at_least(0.1),
+        poseBeta=at_least(0),
+        poseLead=at_least(0),
+        warp=between(0, 1),
+        warpLag=at_least(0),
+    ),
+    key_mappings=dict(
         fxL=('f', 's'),
         fxR=('f', 's'),
         fyL=('e', 'd'),
@@ -156,4 +721,14 @@ class Parameters():
         cropYL=('w', 'r'),
         cropXR=('c', 'v'),
         cropYR=('a', 'g'),
-    )
+        k1=('2', '1', 0.01),
+        k2=('4', '3', 0.01),
+        caR=('6', '5', 0.002),
+        caB=('8', '7', 0.002),
+        poseCutoff=('=', '-', 0.1),
+        poseBeta=(']', '[', 0.1),
+        poseLead=('0', '9', 5),
+        warpLag=('y', 't', 5),
+        warpGain=('/', "'", 0.1),
+    ),
+)
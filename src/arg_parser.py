@@ -1,21 +1,22 @@
 import argparse
+import os
 
 parser = argparse.ArgumentParser()
 
 parser.add_argument(
     '-l',
     '--left',
-    help='Left video device integer value (e.g. /dev/video1 is "1")',
-    type=int,
-    default=0,
+    help='Left video device integer value (e.g. /dev/video1 is "1"), '
+         'or video file path with --source file',
+    default='0',
 )
 
 parser.add_argument(
     '-r',
     '--right',
-    help='Right video device integer value (e.g. /dev/video1 is "1")',
-    type=int,
-    default=1,
+    help='Right video device integer value (e.g. /dev/video1 is "1"), '
+         'or video file path with --source file',
+    default='1',
 )
 
 parser.add_argument(
@@ -35,8 +36,8 @@ parser.add_argument(
 parser.add_argument(
     '-f',
     '--fps',
-    help='Frames per second (for recording)',
-    default=15,
+    help='Frames per second (for recording); by default, the measured '
+         'capture rate',
     type=float,
 )
 
@@ -46,3 +47,220 @@ parser.add_argument(
     help='Invert servo rotations (for turning device upside-down)',
     action='store_true',
 )
+
+parser.add_argument(
+    '--pose-rate',
+    help='Head pose samples taken per second',
+    type=float,
+    default=250,
+)
+
+parser.add_argument(
+    '-T',
+    '--timewarp',
+    help='Shift the image with head movement the servos have not yet '
+         'followed',
+    action='store_true',
+)
+
+parser.add_argument(
+    '--servo-rate',
+    help='Most servo commands sent per second (0 for no limit)',
+    type=float,
+    default=50,
+)
+
+parser.add_argument(
+    '--servo-step',
+    help='Smallest change in servo angle, in degrees, that is sent',
+    type=int,
+    default=1,
+)
+
+parser.add_argument(
+    '--input-rate',
+    help='Keyboard polls per second',
+    type=float,
+    default=30,
+)
+
+parser.add_argument(
+    '-R',
+    '--runtime',
+    help='Run the camera readers as gevent greenlets (single core), '
+         'on OS threads, or in separate processes (one per eye, in '
+         'parallel)',
+    choices=['gevent', 'threads', 'processes'],
+    default='gevent',
+)
+
+parser.add_argument(
+    '-q',
+    '--queue-depth',
+    help='Frames held per eye before the oldest is dropped (lower is '
+         'fresher; above 1, each frame is rendered into its own buffer and '
+         'copied for display)',
+    default=1,
+    type=int,
+)
+
+parser.add_argument(
+    '-s',
+    '--skew',
+    help='Largest capture time difference, in milliseconds, between '
+         'left and right frames shown together',
+    default=50,
+    type=float,
+)
+
+parser.add_argument(
+    '-g',
+    '--stereo-grab',
+    help='Grab both cameras back to back before retrieving either '
+         'frame, so the two exposures are close together in time',
+    action='store_true',
+)
+
+parser.add_argument(
+    '--buffer-size',
+    help='Frames buffered by the capture driver (1 gives the freshest '
+         'frames)',
+    type=int,
+)
+
+parser.add_argument(
+    '--fourcc',
+    help='Capture pixel format, e.g. MJPG',
+)
+
+parser.add_argument(
+    '--capture-size',
+    help='Capture resolution, as WIDTH HEIGHT',
+    nargs=2,
+    type=int,
+    metavar=('WIDTH', 'HEIGHT'),
+)
+
+parser.add_argument(
+    '--capture-fps',
+    help='Capture frame rate requested from the device',
+    type=float,
+)
+
+parser.add_argument(
+    '-S',
+    '--source',
+    help='Where frames come from: capture devices, video files (looped), '
+         'frame stores recorded with --raw, or a synthetic test pattern',
+    choices=['camera', 'file', 'store', 'synthetic'],
+    default='camera',
+)
+
+parser.add_argument(
+    '--max-speed',
+    help='Deliver file and synthetic frames as fast as possible, rather '
+         'than at their frame rate',
+    action='store_true',
+)
+
+parser.add_argument(
+    '--scale',
+    help='Process each eye at this fraction of full resolution (e.g. 0.5), '
+         'upscaling once for display',
+    type=float,
+    default=1,
+)
+
+parser.add_argument(
+    '--gray',
+    help='Process and display luma only, e.g. for low light',
+    action='store_true',
+)
+
+parser.add_argument(
+    '--raw',
+    help='Record the undistorted frames, losslessly, to the frame stores '
+         'PREFIX-left and PREFIX-right',
+    metavar='PREFIX',
+)
+
+parser.add_argument(
+    '--raw-frames',
+    help='Most frames each raw frame store can hold',
+    type=int,
+    default=9000,
+)
+
+parser.add_argument(
+    '--profile',
+    help='Stereo calibration profile, from calibration.py, to undistort '
+         'and rectify the cameras with',
+)
+
+parser.add_argument(
+    '--map-cache',
+    help='Directory to cache distortion maps in, so known calibrations '
+         'start instantly; empty to disable',
+    default=os.path.join(os.path.expanduser('~'), '.oculus-opencv', 'maps'),
+    metavar='DIR',
+)
+
+parser.add_argument(
+    '--map-cache-size',
+    help='Largest size of the distortion map cache, in megabytes',
+    type=int,
+    default=256,
+)
+
+parser.add_argument(
+    '--timings',
+    help='On exit, write per-stage latency percentiles to this JSON file',
+)
+
+parser.add_argument(
+    '-o',
+    '--output',
+    help='Video file to record to, with --write',
+    default='output.avi',
+)
+
+parser.add_argument(
+    '--codec',
+    help='Four character code of the recording codec, e.g. XVID or MJPG',
+    default='XVID',
+)
+
+parser.add_argument(
+    '--stream',
+    help='Serve the composite as MJPEG over HTTP on this port, e.g. to '
+         'http://HOST:PORT/stream.mjpg',
+    type=int,
+    metavar='PORT',
+)
+
+parser.add_argument(
+    '--stream-raw',
+    help='Serve raw composite frames on this local TCP port',
+    type=int,
+    metavar='PORT',
+)
+
+parser.add_argument(
+    '--stream-eye',
+    help='Stream only this eye, rather than the whole composite',
+    choices=['left', 'right'],
+)
+
+parser.add_argument(
+    '--stream-fps',
+    help='Most frames per second sent to each streaming client',
+    type=float,
+    default=10,
+)
+
+parser.add_argument(
+    '--stream-quality',
+    help='Highest JPEG quality (1-100) streamed',
+    type=int,
+    default=70,
+)
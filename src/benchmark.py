@@ -0,0 +1,307 @@
+"""
+Benchmarks for the distortion hot path and the full pipeline
+
+Times the `algos` operations and the CameraReader -> CameraProcessor
+chain across frame sizes, dtypes and OpenCV thread counts, using
+synthetic frames and a NullSink so no cameras or window are needed.
+The pipeline is also timed in each processing mode, with its cost
+relative to full quality.
+Results are written as JSON; given a baseline from an earlier run,
+any case whose frame time regressed by more than the threshold is
+reported and the exit status is non-zero.
+
+    python src/benchmark.py --output baseline.json
+    python src/benchmark.py --baseline baseline.json
+"""
+
+
+import argparse
+import json
+import multiprocessing
+import platform
+import sys
+from time import sleep, time
+
+import numpy as np
+import cv2
+
+from algos import *
+from camera import CameraReader, CameraProcessor
+from mailbox import Mailbox
+from sinks import NullSink
+from sources import SyntheticSource
+from workers import Worker
+
+
+RESOLUTIONS = {
+    'ntsc': (720, 480),
+    '720p': (1280, 720),
+    '1080p': (1920, 1080),
+}
+
+# Processing modes, as (Parameters.scale, Parameters.gray)
+MODES = {
+    'full': (1, 0),
+    'half': (0.5, 0),
+    'gray': (1, 1),
+    'half-gray': (0.5, 1),
+}
+
+
+def summarize(times):
+    """Summary statistics, in milliseconds, of a list of durations
+
+    `ms` is the figure compared against the baseline.
+    """
+    times = sorted(times)
+    median = 1000 * times[len(times) // 2]
+    return dict(
+        ms=median,
+        median_ms=median,
+        mean_ms=1000 * sum(times) / len(times),
+        max_ms=1000 * times[-1],
+        samples=len(times),
+    )
+
+def timed(function, repeat):
+    """Call `function` `repeat` times and summarize the durations"""
+    times = []
+    for _ in range(repeat):
+        start = time()
+        function()
+        times.append(time() - start)
+    return summarize(times)
+
+def use_resolution(resolution):
+    """Set the Parameters frame size; returns (width, height)"""
+    Parameters.width, Parameters.height = RESOLUTIONS[resolution]
+    return RESOLUTIONS[resolution]
+
+def bench_algos(resolution, dtype, repeat):
+    """Time each hot-path operation on one frame size and dtype"""
+    size = use_resolution(resolution)
+    image = SyntheticSource(size).read()[1].astype(dtype)
+    par = Parameters
+    matrix = create_distortion_matrix(par.fxL, par.cxL, par.fyL, par.cyL)
+    engine = RemapEngine()
+    half = engine.apply(image)
+
+    cases = dict(
+        crop=lambda: crop(
+            image, par.cropXL, par.cropXR, par.cropYL, par.cropYR
+        ),
+        translate=lambda: translate(image, par.xo, par.yo),
+        transform=lambda: transform(image, matrix),
+        join_images=lambda: join_images(half, half),
+        remap=lambda: engine.apply(image),
+    )
+    return dict(
+        (name, timed(case, repeat)) for name, case in cases.items()
+    )
+
+def bench_pipeline(resolution, runtime, frames):
+    """Time `frames` composited frames through the full pipeline
+
+    Args:
+        resolution (str): key into RESOLUTIONS
+        runtime (str): 'gevent' drives both readers and the processor
+            in turn on one thread, as the greenlets would; 'threads'
+            runs each reader on a Worker thread
+        frames (int): number of composited frames to time
+    """
+    size = use_resolution(resolution)
+    sink = NullSink()
+    queues = [Mailbox(), Mailbox()]
+    readers = [
+        CameraReader(
+            SyntheticSource(size, index=index), queues[index], index
+        )
+        for index in range(2)
+    ]
+    processor = CameraProcessor(queues[0], queues[1], tolerance=1.0,
+                                sink=sink)
+    for index, reader in enumerate(readers):
+        processor.attach(reader, index)
+
+    start = time()
+    if runtime == 'threads':
+        workers = [Worker(reader) for reader in readers]
+        for worker in workers:
+            worker.start()
+        while sink.frames < frames:
+            processor.iterate()
+            sleep(0)
+        for worker in workers:
+            worker.kill()
+    else:
+        while sink.frames < frames:
+            for reader in readers:
+                reader.iterate()
+            processor.iterate()
+    elapsed = time() - start
+
+    result = summarize([elapsed / sink.frames])
+    result['fps'] = sink.frames / elapsed
+    return result
+
+def bench_modes(resolution, frames):
+    """Time the pipeline in each processing mode
+
+    Each result has `relative`, its frame time as a fraction of the
+    full quality mode's.
+    """
+    results = {}
+    previous = Parameters.scale, Parameters.gray
+    try:
+        for mode, (scale, gray) in MODES.items():
+            Parameters.scale, Parameters.gray = scale, gray
+            results[mode] = bench_pipeline(resolution, 'gevent', frames)
+    finally:
+        Parameters.scale, Parameters.gray = previous
+    for result in results.values():
+        result['relative'] = result['ms'] / results['full']['ms']
+    return results
+
+def run_benchmarks(resolutions, dtypes, thread_counts, repeat, frames):
+    """Run every case; returns a dict of results keyed by case name"""
+    results = {}
+    for threads in thread_counts:
+        cv2.setNumThreads(threads)
+        for resolution in resolutions:
+            for dtype in dtypes:
+                timings = bench_algos(resolution, dtype, repeat)
+                for name, result in timings.items():
+                    key = 'algos/{}/{}/{}/threads={}'.format(
+                        name, resolution, dtype, threads
+                    )
+                    results[key] = result
+
+            for runtime in ['gevent', 'threads']:
+                key = 'pipeline/{}/{}/threads={}'.format(
+                    runtime, resolution, threads
+                )
+                results[key] = bench_pipeline(resolution, runtime, frames)
+
+            for mode, result in bench_modes(resolution, frames).items():
+                key = 'modes/{}/{}/threads={}'.format(
+                    mode, resolution, threads
+                )
+                results[key] = result
+    return results
+
+def compare(results, baseline, threshold):
+    """Cases slower than the baseline by more than `threshold`
+
+    Returns:
+        list of (name, baseline ms, current ms), for cases present in
+        both
+    """
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        before, after = baseline[name]['ms'], results[name]['ms']
+        if after > before * (1 + threshold):
+            regressions.append((name, before, after))
+    return regressions
+
+def environment():
+    """Description of the machine and libraries, stored with results"""
+    return dict(
+        opencv=cv2.__version__,
+        numpy=np.__version__,
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cpus=multiprocessing.cpu_count(),
+    )
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+parser.add_argument(
+    '--resolutions',
+    nargs='+',
+    choices=sorted(RESOLUTIONS),
+    default=['ntsc', '720p', '1080p'],
+)
+parser.add_argument(
+    '--dtypes',
+    nargs='+',
+    default=['uint8', 'float32'],
+)
+parser.add_argument(
+    '--threads',
+    help='OpenCV thread counts to run with',
+    nargs='+',
+    type=int,
+    default=sorted(set([1, multiprocessing.cpu_count()])),
+)
+parser.add_argument(
+    '--repeat',
+    help='Calls timed per hot-path operation',
+    type=int,
+    default=50,
+)
+parser.add_argument(
+    '--frames',
+    help='Composited frames timed per pipeline run',
+    type=int,
+    default=100,
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    help='Write results to this JSON file',
+)
+parser.add_argument(
+    '-b',
+    '--baseline',
+    help='Compare against results from this JSON file',
+)
+parser.add_argument(
+    '-t',
+    '--threshold',
+    help='Allowed slow-down relative to the baseline (0.2 is 20%%)',
+    type=float,
+    default=0.2,
+)
+
+def main():
+    args = parser.parse_args()
+    results = run_benchmarks(
+        args.resolutions,
+        args.dtypes,
+        args.threads,
+        args.repeat,
+        args.frames,
+    )
+
+    for name in sorted(results):
+        relative = results[name].get('relative')
+        print('{:<50} {:>9.3f} ms{}'.format(
+            name,
+            results[name]['ms'],
+            '' if relative is None else ' ({:.0%} of full)'.format(relative),
+        ))
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(
+                dict(environment=environment(), results=results),
+                output,
+                indent=2,
+                sort_keys=True,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            baseline = json.load(baseline)['results']
+        regressions = compare(results, baseline, args.threshold)
+        for name, before, after in regressions:
+            print('REGRESSION {}: {:.3f} ms -> {:.3f} ms'.format(
+                name, before, after
+            ))
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+Stereo calibration of the camera pair from chessboard images
+
+Finds a chessboard in pairs of left and right images, calibrates each
+camera's lens, then the pair's relative pose, and writes a profile of
+the results. Running `oculus_stream.py --profile PROFILE` bakes the
+profile's lens undistortion and stereo rectification into the
+distortion maps (see `create_remap`), so they cost nothing per frame
+on top of the Rift pre-distortion.
+
+Pairs are read from image files, e.g.
+
+    python src/calibration.py profile.json \\
+        --left 'calib/left-*.png' --right 'calib/right-*.png'
+
+or every few frames from a frame source, e.g. a recording:
+
+    python src/calibration.py profile.json -S store \\
+        -l session-left -r session-right --every 15
+"""
+
+
+import argparse
+import glob
+import json
+
+import numpy as np
+import cv2
+
+from sources import open_source
+
+
+def find_corners(image, pattern):
+    """Chessboard corners in `image`, to subpixel accuracy, or None
+
+    Args:
+        image (np.array): BGR or grayscale image
+        pattern (tuple): inner corners per (row, column) of the board
+    """
+    gray = image
+    if image.ndim == 3:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    found, corners = cv2.findChessboardCorners(gray, pattern)
+    if not found:
+        return None
+    cv2.cornerSubPix(
+        gray, corners, (5, 5), (-1, -1),
+        (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.01),
+    )
+    return corners
+
+def board_points(pattern, square=1.0):
+    """3D positions of the chessboard's inner corners, on z = 0"""
+    points = np.zeros((pattern[0] * pattern[1], 3), np.float32)
+    points[:, :2] = np.mgrid[0:pattern[0], 0:pattern[1]].T.reshape(-1, 2)
+    return points * square
+
+def calibrate(pairs, pattern=(9, 6), square=1.0, alpha=0,
+              flags=cv2.CALIB_FIX_K3):
+    """Calibrate a camera pair from chessboard image pairs
+
+    Pairs in which the board is not found in both images are skipped.
+
+    Args:
+        pairs (list): (left, right) images of the same board
+        pattern (tuple): inner corners per (row, column) of the board
+        square (float): size of a board square; the stereo baseline
+            is in the same units
+        alpha (float): 0 to rectify to only valid pixels, up to 1 to
+            keep every camera pixel
+        flags (int): `cv2.calibrateCamera` flags; by default, the
+            third radial coefficient, which few boards constrain, is
+            left at 0
+
+    Returns:
+        CalibrationProfile
+
+    Raises:
+        ValueError: if the board is found in fewer than 3 pairs
+    """
+    left, right, size = [], [], None
+    for left_image, right_image in pairs:
+        corners = [find_corners(image, pattern)
+                   for image in [left_image, right_image]]
+        if corners[0] is not None and corners[1] is not None:
+            left.append(corners[0])
+            right.append(corners[1])
+            size = (left_image.shape[1], left_image.shape[0])
+    if len(left) < 3:
+        raise ValueError(
+            'Chessboard found in {} pairs, need at least 3'.format(len(left))
+        )
+    points = [board_points(pattern, square)] * len(left)
+
+    cameras = []
+    for corners in [left, right]:
+        rms, matrix, distortion, _, _ = cv2.calibrateCamera(
+            points, corners, size, None, None, flags=flags
+        )
+        cameras.append(dict(rms=rms, matrix=matrix, distortion=distortion))
+
+    stereo = cv2.stereoCalibrate(
+        points, left, right,
+        cameras[0]['matrix'], cameras[0]['distortion'],
+        cameras[1]['matrix'], cameras[1]['distortion'],
+        size, flags=cv2.CALIB_FIX_INTRINSIC,
+    )
+    rms, rotation, translation = stereo[0], stereo[5], stereo[6]
+    rectify = cv2.stereoRectify(
+        cameras[0]['matrix'], cameras[0]['distortion'],
+        cameras[1]['matrix'], cameras[1]['distortion'],
+        size, rotation, translation, alpha=alpha,
+    )
+    for camera, rectification, projection in zip(
+            cameras, rectify[0:2], rectify[2:4]):
+        camera['rectification'] = rectification
+        camera['projection'] = projection
+
+    return CalibrationProfile(
+        size, cameras[0], cameras[1], rotation, translation, rms, len(left)
+    )
+
+
+class CalibrationProfile(object):
+    """Lens and stereo calibration of the camera pair
+
+    Each eye's camera has its `matrix` and `distortion` coefficients,
+    and the `rectification` rotation and `projection` matrix that
+    rectify it; `rotation` and `translation` are the right camera's
+    pose relative to the left.
+    """
+    def __init__(self, size, left, right, rotation, translation, rms=0,
+                 pairs=0):
+        """
+        Args:
+            size (tuple): (width, height) of the calibration images
+            left, right (dict): each camera's matrix, distortion,
+                rectification, projection and reprojection rms error
+            rotation (np.array): 3x3 rotation from left to right camera
+            translation (np.array): right camera position, in board
+                square units
+            rms (float): stereo reprojection error, in pixels
+            pairs (int): image pairs the calibration used
+        """
+        self.size = tuple(size)
+        self.cameras = dict(left=left, right=right)
+        self.rotation = np.asarray(rotation, dtype=np.float64)
+        self.translation = np.asarray(translation, dtype=np.float64)
+        self.rms = rms
+        self.pairs = pairs
+        self.maps = {}
+
+    def camera(self, eye):
+        return self.cameras[eye]
+
+    def rectify_maps(self, eye, size):
+        """(map_x, map_y) from rectified to raw frame coordinates
+
+        For frames of `size`, which may differ from the calibration
+        images' size (e.g. a different capture resolution of the same
+        cameras); the camera matrices are scaled to match.
+        """
+        key = (eye, tuple(size))
+        if key not in self.maps:
+            camera = self.camera(eye)
+            scale = np.array([
+                [size[0] / float(self.size[0])],
+                [size[1] / float(self.size[1])],
+                [1],
+            ])
+            self.maps[key] = cv2.initUndistortRectifyMap(
+                np.asarray(camera['matrix']) * scale,
+                np.asarray(camera['distortion']),
+                np.asarray(camera['rectification']),
+                np.asarray(camera['projection']) * scale,
+                tuple(size),
+                cv2.CV_32FC1,
+            )
+        return self.maps[key]
+
+    def values(self, eye):
+        """Everything `rectify_maps` depends on, as a flat tuple"""
+        camera = self.camera(eye)
+        return self.size + tuple(np.concatenate([
+            np.ravel(camera[name]) for name in
+            ['matrix', 'distortion', 'rectification', 'projection']
+        ]).tolist())
+
+    def baseline(self):
+        """Distance between the cameras, in board square units"""
+        return float(np.linalg.norm(self.translation))
+
+    def save(self, path):
+        def arrays(camera):
+            return dict((name, np.asarray(value).tolist())
+                        for name, value in camera.items())
+        with open(path, 'w') as output:
+            json.dump(
+                dict(
+                    size=list(self.size),
+                    left=arrays(self.cameras['left']),
+                    right=arrays(self.cameras['right']),
+                    rotation=self.rotation.tolist(),
+                    translation=self.translation.tolist(),
+                    rms=self.rms,
+                    pairs=self.pairs,
+                ),
+                output,
+                indent=2,
+                sort_keys=True,
+            )
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as profile:
+            profile = json.load(profile)
+        cameras = [
+            dict((name, np.array(value)) for name, value in
+                 profile[eye].items())
+            for eye in ['left', 'right']
+        ]
+        return cls(
+            profile['size'], cameras[0], cameras[1], profile['rotation'],
+            profile['translation'], profile['rms'], profile['pairs'],
+        )
+
+    def report(self):
+        return ('{} pairs, {:.3f} px stereo rms (left {:.3f}, right '
+                '{:.3f}), baseline {:.2f} squares'.format(
+                    self.pairs,
+                    self.rms,
+                    self.cameras['left']['rms'],
+                    self.cameras['right']['rms'],
+                    self.baseline(),
+                ))
+
+
+def file_pairs(left, right):
+    """(left, right) images from two glob patterns, matched in order"""
+    paths = [sorted(glob.glob(pattern)) for pattern in [left, right]]
+    if len(paths[0]) != len(paths[1]):
+        raise ValueError('{} left images but {} right'.format(
+            len(paths[0]), len(paths[1])
+        ))
+    return [
+        (cv2.imread(left_path), cv2.imread(right_path))
+        for left_path, right_path in zip(*paths)
+    ]
+
+def source_pairs(kind, left, right, every=15, limit=40):
+    """(left, right) frames, every `every`th, from two frame sources"""
+    sources = [
+        open_source(kind, spec, index, realtime=False)
+        for index, spec in enumerate([left, right])
+    ]
+    pairs = []
+    count = 0
+    while len(pairs) < limit:
+        frames = [source.read()[1] for source in sources]
+        if frames[0] is None or frames[1] is None:
+            break
+        if count % every == 0:
+            pairs.append((frames[0].copy(), frames[1].copy()))
+        count += 1
+    for source in sources:
+        source.release()
+    return pairs
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+parser.add_argument(
+    'profile',
+    help='Calibration profile to write, as JSON',
+)
+parser.add_argument(
+    '-l',
+    '--left',
+    help='Left images, as a glob pattern; or the left frame source, '
+         'with --source',
+    required=True,
+)
+parser.add_argument(
+    '-r',
+    '--right',
+    help='Right images, as a glob pattern; or the right frame source, '
+         'with --source',
+    required=True,
+)
+parser.add_argument(
+    '-S',
+    '--source',
+    help='Read frames from this kind of frame source instead of images',
+    choices=['camera', 'file', 'store'],
+)
+parser.add_argument(
+    '--every',
+    help='With --source, use every Nth frame',
+    type=int,
+    default=15,
+)
+parser.add_argument(
+    '--pairs',
+    help='With --source, most pairs to use',
+    type=int,
+    default=40,
+)
+parser.add_argument(
+    '-p',
+    '--pattern',
+    help='Inner corners per row and column of the chessboard',
+    type=int,
+    nargs=2,
+    default=[9, 6],
+)
+parser.add_argument(
+    '--alpha',
+    help='0 to rectify to only valid pixels, up to 1 to keep every pixel',
+    type=float,
+    default=0,
+)
+
+def main():
+    args = parser.parse_args()
+    if args.source:
+        pairs = source_pairs(args.source, args.left, args.right,
+                             args.every, args.pairs)
+    else:
+        pairs = file_pairs(args.left, args.right)
+    profile = calibrate(pairs, tuple(args.pattern), alpha=args.alpha)
+    profile.save(args.profile)
+    print('Calibrated from {}'.format(profile.report()))
+
+if __name__ == '__main__':
+    main()
@@ -8,23 +8,60 @@ from gevent import Greenlet
 from gevent.queue import Empty
 
 from algos import *
+from pairing import Frame, StereoPairer
+from pose import PoseFilter
+from sinks import WindowSink
+from stats import CPU, TIMINGS
+from workers import Ticker
 
-import ovrsdk as ovr
-from time import sleep
+from time import time
 from numpy import interp
 import servo.pololu as po
 
+EYES = ('left', 'right')
+
 
 class OculusDriver(Greenlet):
-    """Drive pan/tilt servos based on Oculus' orientation inputs"""
-    def __init__(self, hmd, invert=False):
-        """Connect to the servo output and save HMD input"""
+    """Drive pan/tilt servos based on Oculus' orientation inputs
+
+    Both servos are set with one Set Multiple Targets command, and
+    only when a target has moved by at least `step` degrees, at most
+    `rate` times a second, so a slow radio link to the Maestro is not
+    flooded with commands. An unchanged target is still re-sent every
+    `refresh` seconds, in case a command was lost on the way.
+
+    The orientation is read from a PoseBuffer (filled by a
+    PoseSampler), then smoothed and predicted ahead by a PoseFilter
+    before it is mapped to servo angles, so sensor noise does not
+    become servo jitter and the servos' latency is compensated.
+    """
+    def __init__(self, poses, invert=False, rate=50, step=1, refresh=1.0):
+        """Connect to the servo output and save the pose input
+
+        Args:
+            poses (PoseBuffer): the head poses to follow
+            invert (boolean): reverse the direction of both servos
+            rate (float): most commands sent per second; unlimited if
+                None
+            step (int): smallest change, in degrees, that is sent
+            refresh (float): seconds after which unchanged targets are
+                sent again
+        """
         Greenlet.__init__(self)
         self.servo = po.open_serial()
-        self.hmd = hmd
+        self.poses = poses
         self.invert = 1
         if invert:
             self.invert = -1
+        self.ticker = Ticker(rate)
+        self.step = step
+        self.refresh = refresh
+        self.filter = PoseFilter()
+        self.targets = None
+        self.sent_at = 0
+        self.sent = 0
+        self.skipped = 0
+        self.written = 0
 
 
     def kill(self):
@@ -40,6 +77,13 @@ class OculusDriver(Greenlet):
 
     def _run(self):
         """Interpolate orientation data and update servo positions"""
+        self.setup()
+        while True:
+            self.iterate()
+            gevent.sleep(0)
+
+    def setup(self):
+        """Build the orientation-to-angle mappings and home the servos"""
         pitch_domain = [-0.3, 0.7]
         yaw_domain = [-0.7, 0.7]
         pitch_range = [0, 180]
@@ -47,49 +91,84 @@ class OculusDriver(Greenlet):
 
         pitch_inversion = 1 * self.invert
         yaw_inversion = -1 * self.invert
-        map_pitch = lambda x: int(interp(
+        self.map_pitch = lambda x: int(interp(
             pitch_inversion * x,
             pitch_domain,
             pitch_range)
         )
-        map_yaw = lambda x: int(interp(
+        self.map_yaw = lambda x: int(interp(
             yaw_inversion * x,
             yaw_domain,
             yaw_range)
         )
 
-        range0 = 90
-        range1 = 45
-
-        po.set_target(self.servo, 1, range0)
-        po.set_target(self.servo, 1, range1)
-
-        while True:
-            state = ovr.ovrHmd_GetSensorState(
-                self.hmd, ovr.ovr_GetTimeInSeconds()
-            )
-            pose = state.Predicted.Pose
-
-            pitch = pose.Orientation.x # -0.3 ~ 0.7
-            #roll = pose.Orientation.z
-            yaw = pose.Orientation.y # -0.7 ~ 0.7
-
-            range0 = map_yaw(yaw)
-            range1 = map_pitch(pitch)
+        self.send([90, 45])
 
-            #print("Servo 0 set to {}, servo 1 set to {}".format(range0, range1))
-            po.set_target(self.servo, 0, range0)
-            po.set_target(self.servo, 1, range1)
+    def iterate(self):
+        """Read the latest HMD orientation and update the servos
 
-            gevent.sleep(0)
+        Waits for the next tick of the driver's Ticker first, so it
+        polls (and sends) `rate` times a second, sleeping in between,
+        and what it sends is as fresh as the rate allows.
+        """
+        self.ticker.wait()
+
+        pose = self.poses.latest()
+        if pose is None:
+            return
+
+        pitch = pose.x # -0.3 ~ 0.7
+        #roll = pose.z
+        yaw = pose.y # -0.7 ~ 0.7
+        yaw, pitch = self.filter(pose.timestamp, [yaw, pitch])
+
+        range0 = self.map_yaw(yaw)
+        range1 = self.map_pitch(pitch)
+
+        #print("Servo 0 set to {}, servo 1 set to {}".format(range0, range1))
+        self.update([range0, range1])
+
+    def update(self, targets):
+        """Send `targets` if they differ enough from the last sent"""
+        targets = [self.step * int(round(float(target) / self.step))
+                   for target in targets]
+        if (targets == self.targets and
+                time() - self.sent_at < self.refresh):
+            self.skipped += 1
+            return
+        self.send(targets)
+
+    def send(self, targets):
+        """Set all servo targets, from channel 0, in one command"""
+        self.written += po.set_targets(self.servo, 0, targets)
+        self.targets = targets
+        self.sent_at = time()
+        self.sent += 1
+
+    def report(self):
+        """Servo command statistics, for printing"""
+        return '{} commands ({} bytes) sent, {} unchanged skipped'.format(
+            self.sent, self.written, self.skipped
+        )
 
 class CameraReader(Greenlet):
-    """Read frames from a camera and apply distortions"""
-    def __init__(self, camera, queue):
+    """Read frames from a camera and apply distortions
+
+    Each reader is for one eye, given by `index` (0 for the left, 1
+    for the right), and distorts with that eye's Parameters.
+    """
+    def __init__(self, camera, queue, index=0):
         """Save the camera (to read from) and queue (to write to)"""
         Greenlet.__init__(self)
         self.camera = camera
         self.queue = queue
+        self.engine = RemapEngine()
+        self.composite = None
+        self.index = index
+        self.timings = TIMINGS
+        self.store = None
+        self.clock = None
+        self.timewarp = None
 
     def _run(self):
         """Iterate and process frames indefinitely
@@ -99,66 +178,180 @@ class CameraReader(Greenlet):
         input).
 
         Reads a frame in from the camera, applies translations and
-        distortions based on the Parameters class, then writes the
-        final image to the output queue.
+        distortions based on the Parameters, then writes the
+        final image, tagged with its capture time, to the output
+        queue. The distortions are applied
+        through a RemapEngine, which only rebuilds its maps when the
+        Parameters change. If the reader is attached to a
+        CameraProcessor, the frame is written straight into its half
+        of the processor's composite.
         """
-        par = Parameters
         while True:
-            _, frame = self.camera.read()
-
-            matrix = create_distortion_matrix(
-                par.fxL, par.cxL, par.fyL, par.cyL
-            )
-            frame = translate(frame, par.xL + par.xo, par.yL + par.yo)
-            frame = transform(frame, matrix)
-            frame = translate(frame, par.xo2, par.yo2)
-
-            frame = crop(
-                frame,
-                par.cropXL,
-                par.cropXR,
-                par.cropYL,
-                par.cropYR,
-            )
-            self.queue.put(frame)
+            self.iterate()
             gevent.sleep(0)
 
+    def iterate(self):
+        """Read, process and enqueue a single frame
+
+        Skips failed reads. While writing into the composite, holds
+        the lock for this reader's half, so a CameraProcessor running
+        on another thread never displays a half-written frame.
+
+        Frames are tagged with the time they were read, unless `clock`
+        is set to a function giving the capture time of the frame just
+        read (e.g. when replaying a recording).
+
+        With a Timewarp (given by the CameraProcessor), the frame is
+        shifted by the head's movement since it was captured, as part
+        of the same remap.
+        """
+        eye = self.eye
+        start = time()
+        _, frame = self.camera.read()
+        if frame is None:
+            return
+        timestamp = time()
+        self.timings.add(eye + '/capture', timestamp - start)
+        if self.clock is not None:
+            timestamp = self.clock()
+
+        if self.store is not None:
+            start = time()
+            self.store.append(timestamp, frame)
+            self.timings.add(eye + '/store', time() - start)
+
+        shift = None
+        if self.timewarp is not None:
+            shift = self.timewarp.shift(timestamp, self.eye)
+
+        if self.composite is None:
+            start = time()
+            frame = self.engine.apply(frame, shift=shift)
+            self.timings.add(eye + '/distort', time() - start)
+        else:
+            with self.composite.locks[self.index]:
+                start = time()
+                frame = self.engine.apply(
+                    frame, dst=self.output(frame), shift=shift
+                )
+                self.timings.add(eye + '/distort', time() - start)
+        self.queue.put(Frame(timestamp, frame))
+
+    @property
+    def index(self):
+        return self._index
+
+    @index.setter
+    def index(self, index):
+        self._index = index
+        self.engine.eye = EYES[index]
+
+    @property
+    def eye(self):
+        """'left' or 'right'"""
+        return EYES[self._index]
+
+    def output(self, frame):
+        """Destination for the processed frame, if any
+
+        Returns this reader's half of the composite buffer when
+        attached to a CameraProcessor, otherwise None (so a new array
+        is allocated).
+        """
+        if self.composite is None:
+            return None
+        return self.composite.half(
+            self.index,
+            self.engine.shape(frame),
+            frame.dtype,
+        )
+
     def __str__(self):
         return 'CameraReader for {}'.format(self.camera)
 
 class CameraProcessor(Greenlet):
     """Parse video frames from two queues and stitch them together.
 
-    Uses algos.join_images to stitch the left and right video frames
-    into one wider image and displays that image via `cv2.imshow`.
-
-    If args.write is set, creates an OpenCV VideoWriter and saves
-    the composited frames on each iteration. NOTE/TODO: frame rate
-    from the USB cameras is pretty low (~15 fps). If you set args.fps
-    too high, the output video will run too fast (sped-up).
+    Owns a CompositeBuffer that attached CameraReaders write into
+    directly, so the left and right video frames form one wider image
+    without a per-frame copy, and displays that image via its sink
+    (by default `cv2.imshow`). Frames that were not written into the
+    composite (e.g. from an unattached reader) are copied into it.
+    Left and right frames are matched by capture time with a
+    StereoPairer, so only frames within `tolerance` seconds of each
+    other are shown together.
+
+    If given a VideoRecorder, hands it each composited frame; the
+    recorder encodes on its own thread, so recording does not cost
+    display frame rate.
+
+    If given a Timewarp, attached readers shift each frame to follow
+    the head between capture and display.
+
+    If given a `ready` event, which the queues set whenever they are
+    given a frame (see `Mailbox`), `iterate` sleeps on it until there
+    is a frame to take, rather than polling the queues; otherwise it
+    returns at once.
     """
-    def __init__(self, left_queue, right_queue, write=False):
-        """Stores queues and whether to write video to file.
+    def __init__(self, left_queue, right_queue, recorder=None,
+                 tolerance=0.05, sink=None, timewarp=None, ready=None,
+                 timeout=0.1):
+        """Stores queues and where to record video to.
 
         Args:
-            left_queue (gevent.queue): queue for left image frames
-            right_queue (gevent.queue): queue for right image frames
-            write (boolean): Whether to write video to file
+            left_queue (Mailbox): queue for left image frames
+            right_queue (Mailbox): queue for right image frames
+            recorder (VideoRecorder): records the composited frames,
+                if given
+            tolerance (float): largest inter-eye skew, in seconds,
+                of frames shown together
+            sink: where composited frames are shown; a WindowSink
+                unless given (e.g. a NullSink, to run headless)
+            timewarp (Timewarp): shifts frames to hide servo lag, if
+                given
+            ready (Event): set when either queue is given a frame
+            timeout (float): longest wait, in seconds, for a frame,
+                so a caller sharing the thread (e.g. an InputHandler)
+                still gets to run
         """
         Greenlet.__init__(self)
+        self.sink = sink or WindowSink()
         self.left = left_queue
         self.right = right_queue
+        self.composite = CompositeBuffer()
+        self.pairer = StereoPairer(tolerance)
+        self.timings = TIMINGS
+
+        self.recorder = recorder
+        self.timewarp = timewarp
+        # Not `ready`, which would hide Greenlet.ready(), and with it
+        # join() and kill()
+        self.frame_ready = ready
+        self.timeout = timeout
+
+    def attach(self, reader, index):
+        """Have `reader` write its frames into the composite
+
+        Only a reader whose queue holds a single frame (a Mailbox of
+        `maxsize` 1) writes into the composite: every frame it renders
+        there is a view of the same half, so frames queued behind one
+        another would overwrite each other. A reader with a deeper
+        queue renders each frame into its own buffer, which is copied
+        into the composite when shown.
+
+        Also hands the reader the Timewarp, if any, and sizes its
+        maps' margin for it.
 
-        self.video_out = False
-        if write:
-            fourcc = cv2.cv.CV_FOURCC(*'XVID')
-            self.video_out = cv2.VideoWriter(
-                'output.avi', # TODO: Use a program argument
-                fourcc,
-                Parameters.fps,
-                (800, 450), # TODO: make this dynamic
-                True # color, not grayscale
-            )
+        Args:
+            reader (CameraReader): the reader to attach
+            index (int): 0 for the left eye, 1 for the right
+        """
+        if getattr(reader.queue, 'maxsize', None) == 1:
+            reader.composite = self.composite
+        reader.index = index
+        if self.timewarp is not None:
+            reader.timewarp = self.timewarp
+            reader.engine.margin = self.timewarp.margin
 
     def _run(self):
         while True:
@@ -168,23 +361,62 @@ class CameraProcessor(Greenlet):
     def iterate(self):
         """Consumes frames from the queues and display
 
-        If the two queues contain frames, read them in and create
-        the composited image, then display to the user. Also handles
-        user input.
-        """
-        frame_left = frame_right = None
-        if not (self.left.empty() and self.right.empty()):
-            frame_left = self.left.get_nowait()
-            frame_right = self.right.get_nowait()
-
-            composite_frame = join_images(
-                frame_left,
-                frame_right,
-            )
-            cv2.imshow('vid', composite_frame)
+        Takes the newest frame from each queue and offers them to the
+        pairer; when the left and right frames match, show the
+        composited image to the user. The composite is locked
+        throughout, so readers on other threads cannot replace a
+        frame between pairing and display.
 
-            if self.video_out:
-                self.video_out.write(composite_frame)
+        When the eyes are processed at reduced scale, the composite
+        is upscaled to full size once, here, before display.
+
+        Records the time spent compositing, upscaling, displaying and
+        recording, and each eye's age (capture to display) in
+        `timings`.
+        """
+        if self.frame_ready is not None:
+            start = time()
+            self.frame_ready.wait(self.timeout)
+            # Cleared before the queues are drained, so a frame put
+            # from here on sets it again and is not missed
+            self.frame_ready.clear()
+            self.timings.add('wait', time() - start)
+        locks = self.composite.locks
+        with locks[0], locks[1]:
+            start = time()
+            for index, queue in enumerate([self.left, self.right]):
+                while not queue.empty():
+                    try:
+                        self.pairer.add(index, queue.get_nowait())
+                    except Empty:
+                        break
+
+            pair = self.pairer.pair()
+            if pair is None:
+                return
+
+            for index, frame in enumerate(pair):
+                if not self.composite.contains(frame.image):
+                    half = self.composite.half(
+                        index, frame.image.shape, frame.image.dtype
+                    )
+                    half[...] = frame.image
+
+            self.timings.add('composite', time() - start)
+            start = time()
+            composite_frame = self.composite.scaled(Parameters.scale)
+            shown = time()
+            if composite_frame is not self.composite.image:
+                self.timings.add('upscale', shown - start)
+            self.sink.show(composite_frame)
+            self.timings.add('display', time() - shown)
+            for eye, frame in zip(EYES, pair):
+                self.timings.add(eye + '/age', shown - frame.timestamp)
+
+            if self.recorder:
+                start = time()
+                self.recorder.record(pair[0].timestamp, composite_frame)
+                self.timings.add('record', time() - start)
 
 class InputHandler(Greenlet):
     """Handle user input
@@ -192,23 +424,26 @@ class InputHandler(Greenlet):
     Handles keyboard input, allowing for `q`uiting the program
     and changing parameters during run-time. Not really related to
     cameras, but subclasses Greenlet, like the CameraReader/Processor.
+    Polls the keyboard `rate` times a second, sleeping in between.
     """
-    def __init__(self, callback):
+    def __init__(self, callback, rate=30):
         """Stores shutdown callback.
 
         Args:
             callback (function): the method to run on application
                shutdown (holds references to objects that this class
                doesn't necessarily know about (e.g. the cv2 cameras)
+            rate (float): keyboard polls per second
         """
         Greenlet.__init__(self)
         self.callback = callback
+        self.ticker = Ticker(rate)
 
     def _run(self):
         """Greenlet method; here we loop indefinitely"""
         while True:
             self.handle_input()
-            gevent.sleep(0)
+            self.ticker.wait()
 
     def handle_input(self):
         """Read user input and react
@@ -216,7 +451,7 @@ class InputHandler(Greenlet):
         Allow for `q`uiting the application and changing run-time
         parameters. We use the `Parameters.key_mappings` and iterate
         over them to increment or decrement the associated parameter
-        (see also the documentation in the Parameters class).
+        (see also the documentation of the Parameters in algos).
         """
         key = cv2.waitKey(1) & 255
         if key == ord('q'):
@@ -225,31 +460,28 @@ class InputHandler(Greenlet):
 
         elif key == ord('p'):
             print_params()
+            print(TIMINGS.report())
+            print(CPU.report())
 
-        for metric, tup in Parameters.key_mappings.iteritems():
+        for metric, tup in Parameters.key_mappings.items():
             _add = tup[0]
             _sub = tup[1]
+            step = tup[2] if len(tup) > 2 else 10
             if key == ord(_add):
-                setattr(
-                    Parameters,
-                    metric,
-                    getattr(Parameters, metric) + 10
-                )
+                self.change(metric, step)
             if key == ord(_sub):
-                setattr(
-                    Parameters,
-                    metric,
-                    getattr(Parameters, metric) - 10
-                )
-
-        # Don't let these go negative
-        for metric in ['cropXL', 'cropYL', 'cropXR', 'cropYR']:
-            p_m = getattr(Parameters, metric)
-            if p_m < 0:
-                print("Attempting to set {} below zero".format(
-                    metric
-                ))
-                setattr(Parameters, metric, 0)
+                self.change(metric, -step)
+
+    def change(self, metric, step):
+        """Add `step` to a parameter, unless that makes it invalid"""
+        try:
+            setattr(
+                Parameters,
+                metric,
+                getattr(Parameters, metric) + step
+            )
+        except ValueError as error:
+            print(error)
 
     def __str__(self):
         return 'InputHandler'
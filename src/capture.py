@@ -0,0 +1,139 @@
+'''
+Capture device set-up and synchronized stereo capture
+'''
+
+
+import threading
+
+import cv2
+
+
+def capture_property(name):
+    """Look up a VideoCapture property id by name (e.g. 'FPS')
+
+    OpenCV 3 names these `cv2.CAP_PROP_*`; OpenCV 2.4 keeps them in
+    `cv2.cv` as `CV_CAP_PROP_*`. Returns None if this build of OpenCV
+    does not know the property.
+    """
+    prop = getattr(cv2, 'CAP_PROP_' + name, None)
+    if prop is None and hasattr(cv2, 'cv'):
+        prop = getattr(cv2.cv, 'CV_CAP_PROP_' + name, None)
+    return prop
+
+def fourcc_code(fourcc):
+    """Four character code (e.g. 'MJPG') as OpenCV's integer"""
+    if hasattr(cv2, 'VideoWriter_fourcc'):
+        return cv2.VideoWriter_fourcc(*fourcc)
+    return cv2.cv.CV_FOURCC(*fourcc)
+
+def configure_capture(camera, buffer_size=None, fourcc=None, size=None,
+                      fps=None):
+    """Set driver-side capture properties on a VideoCapture
+
+    Keeping the driver's buffer small means `read` returns a recent
+    frame rather than one that has been queued for several frame
+    times. Properties left as None are not touched. Warns about any
+    the driver or this OpenCV build rejects.
+
+    Args:
+        camera (cv2.VideoCapture): an opened capture device
+        buffer_size (int): frames buffered by the driver
+        fourcc (str): pixel format, e.g. 'MJPG'
+        size (tuple): capture (width, height)
+        fps (float): capture frame rate
+    """
+    settings = []
+    if fourcc is not None:
+        settings.append(('FOURCC', fourcc_code(fourcc)))
+    if size is not None:
+        settings.append(('FRAME_WIDTH', size[0]))
+        settings.append(('FRAME_HEIGHT', size[1]))
+    if fps is not None:
+        settings.append(('FPS', fps))
+    if buffer_size is not None:
+        settings.append(('BUFFERSIZE', buffer_size))
+
+    for name, value in settings:
+        prop = capture_property(name)
+        if prop is None or not camera.set(prop, value):
+            print('Capture device did not accept {} = {}'.format(
+                name, value
+            ))
+
+
+class StereoCapture(object):
+    """Capture both cameras at (nearly) the same moment
+
+    Calling `read` on each camera separately exposes the two frames
+    at unrelated times. Instead, the first eye to ask for a new frame
+    `grab`s both devices back to back; each eye then `retrieve`s (and
+    decodes) its own frame, in its own reader. A fresh grab waits
+    until both eyes have retrieved the last one.
+
+    `eyes` holds one VideoCapture-like object per camera, which a
+    CameraReader can read from as usual.
+    """
+    def __init__(self, cameras, timeout=1.0):
+        """Store the two cameras
+
+        Args:
+            cameras (list): left and right cv2.VideoCapture devices
+            timeout (float): seconds an eye waits for the other one
+                before giving up on a frame
+        """
+        self.cameras = cameras
+        self.timeout = timeout
+        self.pending = [False, False]
+        self.condition = threading.Condition()
+        self.eyes = [EyeCapture(self, index) for index in range(2)]
+
+    def grab(self):
+        """Latch a frame on both devices, back to back"""
+        for camera in self.cameras:
+            camera.grab()
+        self.pending = [True, True]
+        self.condition.notify_all()
+
+    def read(self, index):
+        """Retrieve eye `index`'s frame from the current grab
+
+        Returns:
+            (boolean, np.array) as from cv2.VideoCapture.read
+        """
+        with self.condition:
+            while not self.pending[index]:
+                if not any(self.pending):
+                    self.grab()
+                    break
+                self.condition.wait(self.timeout)
+                if not self.pending[index] and any(self.pending):
+                    return False, None
+
+        result = self.cameras[index].retrieve()
+        with self.condition:
+            self.pending[index] = False
+            self.condition.notify_all()
+        return result
+
+    def release(self):
+        for camera in self.cameras:
+            camera.release()
+
+
+class EyeCapture(object):
+    """One camera of a StereoCapture, with a VideoCapture-like API"""
+    def __init__(self, stereo, index):
+        self.stereo = stereo
+        self.index = index
+
+    def read(self):
+        return self.stereo.read(self.index)
+
+    def isOpened(self):
+        return self.stereo.cameras[self.index].isOpened()
+
+    def release(self):
+        self.stereo.cameras[self.index].release()
+
+    def __str__(self):
+        return 'EyeCapture {} of {}'.format(self.index, self.stereo)
@@ -0,0 +1,135 @@
+'''
+Lossless raw frame storage in preallocated, memory-mapped files
+
+A store named `base` is three files: `base.json` (frame shape, dtype
+and capacity), `base.frames` (the frames, back to back) and
+`base.index` (each frame's capture timestamp). Appending is a copy
+into the page cache, cheap enough to record two streams without
+dropping frames; the OS writes it out in the background.
+'''
+
+
+import json
+
+import numpy as np
+
+
+class FrameStore(object):
+    """Append-only, randomly accessible store of timestamped frames
+
+    For writing, the files are created on the first `append`, sized
+    from that frame. Index entries are NaN until written, and a
+    frame's timestamp is written after its pixels, so a store that was
+    not closed cleanly still reads back every complete frame.
+    """
+    def __init__(self, base, capacity=9000):
+        """Prepare to record into the store `base`
+
+        Args:
+            base (str): path of the store, without extension
+            capacity (int): most frames the store can hold
+        """
+        self.base = base
+        self.capacity = capacity
+        self.frames = None
+        self.index = None
+        self.count = 0
+        self.dropped = 0
+
+    @classmethod
+    def open(cls, base):
+        """Open an existing store for reading"""
+        with open(base + '.json') as meta:
+            meta = json.load(meta)
+        store = cls(base, meta['capacity'])
+        store.frames = np.memmap(
+            base + '.frames',
+            dtype=meta['dtype'],
+            mode='r',
+            shape=tuple([meta['capacity']] + meta['shape']),
+        )
+        store.index = np.memmap(
+            base + '.index',
+            dtype=np.float64,
+            mode='r',
+            shape=(meta['capacity'], ),
+        )
+        unwritten = np.isnan(store.index)
+        store.count = store.capacity
+        if unwritten.any():
+            store.count = int(np.argmax(unwritten))
+        return store
+
+    def create(self, shape, dtype):
+        """Preallocate the files for frames of `shape` and `dtype`"""
+        with open(self.base + '.json', 'w') as meta:
+            json.dump(dict(
+                shape=list(shape),
+                dtype=np.dtype(dtype).str,
+                capacity=self.capacity,
+            ), meta)
+        self.frames = np.memmap(
+            self.base + '.frames',
+            dtype=dtype,
+            mode='w+',
+            shape=(self.capacity, ) + tuple(shape),
+        )
+        self.index = np.memmap(
+            self.base + '.index',
+            dtype=np.float64,
+            mode='w+',
+            shape=(self.capacity, ),
+        )
+        self.index[:] = np.nan
+
+    def append(self, timestamp, frame):
+        """Store `frame`, captured at `timestamp`
+
+        Frames that arrive once the store is full are counted in
+        `dropped`.
+        """
+        if self.frames is None:
+            self.create(frame.shape, frame.dtype)
+        if self.count >= self.capacity:
+            self.dropped += 1
+            return
+        self.frames[self.count] = frame
+        self.index[self.count] = timestamp
+        self.count += 1
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, number):
+        """(timestamp, frame) of frame `number`; the frame is a view"""
+        if not -self.count <= number < self.count:
+            raise IndexError('Frame {} not in store of {}'.format(
+                number, self.count
+            ))
+        number %= self.count
+        return self.index[number], self.frames[number]
+
+    def timestamps(self):
+        return self.index[:self.count]
+
+    def find(self, timestamp):
+        """Number of the frame captured closest to `timestamp`"""
+        timestamps = self.timestamps()
+        number = int(np.searchsorted(timestamps, timestamp))
+        if number == self.count:
+            return self.count - 1
+        if number > 0 and (
+                timestamp - timestamps[number - 1] <
+                timestamps[number] - timestamp):
+            return number - 1
+        return number
+
+    def at(self, timestamp):
+        """(timestamp, frame) of the frame closest to `timestamp`"""
+        return self[self.find(timestamp)]
+
+    def close(self):
+        """Flush everything written to disk"""
+        for mapped in [self.frames, self.index]:
+            if mapped is not None and mapped.mode != 'r':
+                mapped.flush()
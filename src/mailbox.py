@@ -0,0 +1,186 @@
+'''
+Bounded, latest-frame-wins queues for handing frames between stages
+'''
+
+
+import sys
+import threading
+from collections import deque
+from time import time
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from gevent import monkey
+
+# ThreadMailbox hands items between real OS threads, so it is built
+# on the unpatched lock even when gevent has patched threading
+_thread = '_thread' if sys.version_info[0] >= 3 else 'thread'
+allocate_lock = monkey.get_original(_thread, 'allocate_lock')
+LockError = monkey.get_original(_thread, 'error')
+
+
+class Mailbox(object):
+    """Bounded queue that drops its oldest item when full
+
+    For a head-mounted display the freshest frame matters more than
+    every frame, so `put` never blocks: if the consumer has fallen
+    behind, the oldest waiting item is discarded and counted in
+    `dropped`. Offers the subset of the Queue interface the pipeline
+    uses, and works with both OS threads and (monkey-patched)
+    greenlets.
+
+    A `ready` event, if given, is set by every `put`; several
+    mailboxes can share one, so a consumer of all of them can sleep
+    until any has an item.
+    """
+    def __init__(self, maxsize=1, ready=None):
+        """Create an empty mailbox
+
+        Args:
+            maxsize (int): number of items held before the oldest is
+                dropped
+            ready (Event): set whenever an item is put
+        """
+        if maxsize < 1:
+            raise ValueError('Mailbox needs room for at least one item')
+        self.maxsize = maxsize
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.ready = ready
+        self.dropped = 0
+
+    def put(self, item):
+        """Add `item`, dropping the oldest item if the mailbox is full"""
+        with self.condition:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify()
+        if self.ready is not None:
+            self.ready.set()
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the oldest item
+
+        Args:
+            block (boolean): wait for an item if the mailbox is empty
+            timeout (float): seconds to wait, if blocking
+
+        Raises:
+            Empty: if no item is available
+        """
+        with self.condition:
+            if block and not self.items:
+                self.condition.wait(timeout)
+            if not self.items:
+                raise Empty
+            return self.items.popleft()
+
+    def get_nowait(self):
+        """Remove and return the oldest item without waiting"""
+        return self.get(block=False)
+
+    def empty(self):
+        return not self.items
+
+    def qsize(self):
+        return len(self.items)
+
+
+class ThreadMailbox(object):
+    """Mailbox for handing items to and from real OS threads
+
+    Like a Mailbox, `put` never blocks, and drops the oldest item when
+    full. Under gevent's monkey patching, `threading`'s primitives are
+    greenlet ones that must not be shared between OS threads, so this
+    is built on unpatched locks instead; one of them, held while there
+    is nothing new, is what `get` blocks on. Use it between threads
+    started with the original `start_new_thread` (see `recorder.py`),
+    or from such a thread to the display loop; the display loop itself
+    must only `put`, never `get`.
+
+    `close` wakes every consumer; `get` then returns what is still
+    queued, followed by None.
+    """
+    def __init__(self, maxsize=1):
+        """Create an empty mailbox
+
+        Args:
+            maxsize (int): number of items held before the oldest is
+                dropped
+        """
+        if maxsize < 1:
+            raise ValueError('Mailbox needs room for at least one item')
+        self.maxsize = maxsize
+        self.items = deque()
+        self.lock = allocate_lock()
+        self.signal = allocate_lock()
+        self.signal.acquire()
+        self.closed = False
+        self.dropped = 0
+
+    def wake(self):
+        """Let one waiting `get` through (the signal is not counted)"""
+        try:
+            self.signal.release()
+        except LockError:
+            pass
+
+    def put(self, item):
+        """Add `item`, dropping the oldest item if the mailbox is full"""
+        with self.lock:
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.wake()
+
+    def get(self, timeout=None):
+        """Remove and return the oldest item, waiting for one
+
+        Args:
+            timeout (float): seconds to wait; Python 2's locks cannot
+                time out, so there it waits for as long as it takes
+
+        Returns:
+            None once closed and empty
+
+        Raises:
+            Empty: if no item arrived within `timeout`
+        """
+        deadline = None if timeout is None else time() + timeout
+        while True:
+            with self.lock:
+                if self.items:
+                    item = self.items.popleft()
+                    if self.items or self.closed:
+                        self.wake()
+                    return item
+                if self.closed:
+                    self.wake()
+                    return None
+            if deadline is None:
+                self.signal.acquire()
+                continue
+            remaining = deadline - time()
+            if remaining <= 0:
+                raise Empty
+            try:
+                self.signal.acquire(True, remaining)
+            except TypeError:
+                self.signal.acquire()
+
+    def close(self):
+        """Have every `get`, once the mailbox is empty, return None"""
+        with self.lock:
+            self.closed = True
+            self.wake()
+
+    def empty(self):
+        return not self.items
+
+    def qsize(self):
+        return len(self.items)
@@ -0,0 +1,139 @@
+'''
+Persistent on-disk cache of distortion maps
+
+Building the remap tables for both eyes takes a noticeable time at
+startup and whenever the calibration changes. Maps are saved as `.npy`
+files named by a hash of everything they were built from, and loaded
+memory-mapped, so known calibrations are back on screen at once. The
+least recently used maps are evicted to keep the cache under a size
+cap.
+'''
+
+
+import hashlib
+import os
+
+import numpy as np
+
+# Bump when the map format or construction changes, so stale maps
+# are never loaded
+VERSION = 1
+
+
+def cache_key(values):
+    """Hex digest identifying a map built from `values`"""
+    text = repr((VERSION, ) + tuple(values)).encode('utf-8')
+    return hashlib.sha1(text).hexdigest()
+
+
+class MapCache(object):
+    """Directory of cached maps with LRU eviction
+
+    Each entry is a tuple of arrays, saved as `<key>-<n>.npy`. Reading
+    an entry updates its files' modification times, which order the
+    eviction.
+    """
+    def __init__(self, directory, limit=256 * 2 ** 20):
+        """
+        Args:
+            directory (str): where the maps are kept; created if needed
+            limit (int): largest total size of the cache, in bytes
+        """
+        self.directory = directory
+        self.limit = limit
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def paths(self, key, count):
+        return [
+            os.path.join(self.directory, '{}-{}.npy'.format(key, index))
+            for index in range(count)
+        ]
+
+    def load(self, key, count):
+        """The `count` arrays cached under `key`, or None
+
+        An entry evicted while it is being read, e.g. by the other
+        eye's process, is a miss.
+        """
+        paths = self.paths(key, count)
+        try:
+            arrays = tuple(np.load(path, mmap_mode='r') for path in paths)
+            for path in paths:
+                os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            return None
+        return arrays
+
+    def save(self, key, arrays):
+        """Cache `arrays` under `key`, then evict down to the limit
+
+        Files are written under a temporary name and renamed, so a
+        concurrent reader (e.g. the other eye's process) never loads
+        a partial map.
+        """
+        for path, array in zip(self.paths(key, len(arrays)), arrays):
+            partial = '{}.{}.partial'.format(path, os.getpid())
+            with open(partial, 'wb') as output:
+                np.save(output, array)
+            try:
+                os.rename(partial, path)
+            except OSError:
+                os.remove(partial)
+        self.evict(keep=key)
+
+    def get(self, values, build, count=2):
+        """The arrays built from `values`, from the cache if possible
+
+        Args:
+            values (tuple): everything the arrays depend on
+            build (function): builds the arrays, on a miss
+            count (int): number of arrays `build` returns
+        """
+        key = cache_key(values)
+        arrays = self.load(key, count)
+        if arrays is not None:
+            self.hits += 1
+            return arrays
+        self.misses += 1
+        arrays = build()
+        self.save(key, arrays)
+        return arrays
+
+    def entries(self):
+        """(last used, size, paths) of each cached entry"""
+        entries = {}
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            used, size, paths = entries.get(name.split('-')[0], (0, 0, []))
+            entries[name.split('-')[0]] = (
+                max(used, stat.st_mtime), size + stat.st_size, paths + [path]
+            )
+        return list(entries.items())
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries beyond the limit"""
+        entries = sorted(self.entries(), key=lambda entry: entry[1][0])
+        total = sum(size for _, (_, size, _) in entries)
+        for key, (_, size, paths) in entries:
+            if total <= self.limit:
+                break
+            if key == keep:
+                continue
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def report(self):
+        return '{} hits, {} misses'.format(self.hits, self.misses)
@@ -15,23 +15,38 @@ import ovrsdk as ovr
 import gevent
 from gevent import (
     monkey,
-    queue,
     Greenlet,
 )
 
+import multiprocessing
 import signal
+import threading
 
-from algos import print_params, Parameters
+from algos import print_params, Parameters, RemapEngine
 from camera import (
     CameraReader,
     CameraProcessor,
     InputHandler,
     OculusDriver,
 )
+from calibration import CalibrationProfile
+from capture import configure_capture, StereoCapture
+from frame_store import FrameStore
+from mailbox import Mailbox
+from map_cache import MapCache
+from pose import PoseBuffer, PoseSampler, Timewarp
+from recorder import VideoRecorder
+from sinks import TeeSink, WindowSink
+from sources import open_source
+from streaming import StreamServer
+from stats import CPU, TIMINGS
+from workers import Worker
+from processes import EyeProcess, SharedFrameRing
 from arg_parser import parser
 
-monkey.patch_all()
 args = parser.parse_args()
+if args.runtime == 'gevent':
+    monkey.patch_all()
 
 def oculus():
     """initializes ovrsdk and starts tracking oculus"""
@@ -72,15 +87,37 @@ def oculus():
 def run():
     """Set up both Oculus tracking and Camera feeds, then iterate
 
-    We use Gevent queues and greenlets to let the camera readers
-    (left and right feeds) and the camera processor run
-    asynchronously. The intent is that the I/O activities are not
+    We use greenlets and latest-frame-wins mailboxes to let the
+    camera readers (left and right feeds) and the camera processor
+    run asynchronously. The intent is that the I/O activities are not
     blocking and we can achieve higher throughput, though in the end,
     we may be limited by USB camera frame rates anyway.
+
+    With `--runtime threads`, the camera readers (and pose sampler
+    and servo driver) instead run on OS threads, so both eyes are
+    processed in parallel on separate cores, while the processor and
+    input handler run in the main thread (which OpenCV's windowing
+    requires). With `--runtime processes`, each eye is captured and
+    distorted in its own process and handed over through shared
+    memory.
+
+    Nothing polls: the processor sleeps until either eye's queue is
+    given a frame, and the periodic stages (pose sampler, servo
+    driver, input handler) sleep between ticks at their own rates, so
+    an idle pipeline leaves the CPU idle too.
     """
     if args.oculus:
         hmd = oculus()
 
+    Parameters.scale = args.scale
+    Parameters.gray = int(args.gray)
+    if args.profile:
+        RemapEngine.profile = CalibrationProfile.load(args.profile)
+    if args.map_cache:
+        RemapEngine.cache = MapCache(
+            args.map_cache, args.map_cache_size * 2 ** 20
+        )
+
     cv2.namedWindow('vid', 16 | cv2.WND_PROP_FULLSCREEN)
     cv2.setWindowProperty(
         "vid",
@@ -88,59 +125,210 @@ def run():
         cv2.cv.CV_WINDOW_FULLSCREEN
     )
 
-    left_queue = queue.Queue()
-    right_queue = queue.Queue()
+    settings = dict(
+        buffer_size=args.buffer_size,
+        fourcc=args.fourcc,
+        size=args.capture_size,
+        fps=args.capture_fps,
+    )
+
+    sources = [
+        dict(
+            kind=args.source,
+            spec=spec,
+            index=index,
+            size=args.capture_size,
+            fps=args.capture_fps,
+            realtime=not args.max_speed,
+        )
+        for index, spec in enumerate([args.left, args.right])
+    ]
+
+    stores = [None, None]
+    if args.raw:
+        stores = [
+            FrameStore('{}-{}'.format(args.raw, eye), args.raw_frames)
+            for eye in ['left', 'right']
+        ]
+
+    cameras = []
+    if args.runtime == 'processes':
+        if args.stereo_grab:
+            print('Stereo grab needs both cameras in one process; ignoring')
+        capacity = Parameters.height * Parameters.width * 3
+        ready = multiprocessing.Event()
+        left_queue = SharedFrameRing(capacity, ready=ready)
+        right_queue = SharedFrameRing(capacity, ready=ready)
+        left = EyeProcess(sources[0], left_queue, 0, settings, stores[0])
+        right = EyeProcess(sources[1], right_queue, 1, settings, stores[1])
+    else:
+        ready = threading.Event()
+        left_queue = Mailbox(args.queue_depth, ready)
+        right_queue = Mailbox(args.queue_depth, ready)
+
+        cameras = [open_source(**source) for source in sources]
+        if not all(camera.isOpened() for camera in cameras):
+            print('Failed to find two cameras. Are they connected?')
+            sys.exit()
+
+        if args.source == 'camera':
+            for camera in cameras:
+                configure_capture(camera, **settings)
+        inputs = cameras
+        if args.stereo_grab:
+            inputs = StereoCapture(cameras).eyes
 
-    camera_left = cv2.VideoCapture(args.left)
-    camera_right = cv2.VideoCapture(args.right)
+        left = CameraReader(inputs[0], left_queue)
+        right = CameraReader(inputs[1], right_queue, 1)
+        left.store, right.store = stores
+
+    recorder = None
+    if args.write:
+        recorder = VideoRecorder(args.output, args.codec, args.fps)
+
+    timewarp = None
+    if args.oculus:
+        poses = PoseBuffer()
+        sampler = PoseSampler(hmd, poses, args.pose_rate)
+        if args.timewarp and args.runtime == 'processes':
+            print('Timewarp needs the poses in the eye processes; ignoring')
+        elif args.timewarp:
+            Parameters.warp = 1
+            timewarp = Timewarp(poses)
 
-    if not (camera_left.isOpened() and camera_right.isOpened()):
-        print('Failed to find two cameras. Are they connected?')
-        sys.exit()
+    sink = WindowSink()
+    streamer = None
+    if args.stream is not None or args.stream_raw is not None:
+        streamer = StreamServer(
+            args.stream,
+            args.stream_raw,
+            eye=args.stream_eye,
+            fps=args.stream_fps,
+            quality=args.stream_quality,
+        )
+        sink = TeeSink(sink, streamer)
 
-    left = CameraReader(camera_left, left_queue)
-    right = CameraReader(camera_right, right_queue)
     processor = CameraProcessor(
         left_queue,
         right_queue,
-        args.write,
+        recorder,
+        args.skew / 1000.0,
+        sink,
+        timewarp=timewarp,
+        ready=ready,
     )
+    if args.runtime != 'processes':
+        processor.attach(left, 0)
+        processor.attach(right, 1)
 
     if args.oculus:
-        driver = OculusDriver(hmd, invert=args.invert)
+        driver = OculusDriver(
+            poses,
+            invert=args.invert,
+            rate=args.servo_rate,
+            step=args.servo_step,
+        )
     else:
         driver = None
 
+    threaded = args.runtime in ['threads', 'processes']
+    if args.runtime == 'threads':
+        background = [Worker(left), Worker(right)]
+    else:
+        background = [left, right]
+    if args.oculus:
+        background.append(Worker(sampler) if threaded else sampler)
+        background.append(Worker(driver) if threaded else driver)
+
+    stopped = threading.Event()
+
     def close_callback():
-        left.kill()
-        right.kill()
+        stopped.set()
+        for stage in background:
+            stage.kill()
 
-        if args.oculus:
+        if args.oculus and threaded:
             driver.kill()
+        if args.oculus:
+            print('Servos: {}'.format(driver.report()))
+            print('Pose samples: {}, {} late'.format(
+                poses.count, sampler.ticker.late
+            ))
 
-        camera_left.release()
-        camera_right.release()
+        for camera in cameras:
+            camera.release()
 
         if args.write:
-            processor.video_out.release()
+            recorder.close()
+            print('Recorded {}'.format(recorder.report()))
+        if streamer is not None:
+            print('Streaming: {}'.format(streamer.report()))
+            streamer.close()
+        if args.raw and args.runtime != 'processes':
+            for store in stores:
+                store.close()
+                print('Raw frames in {}: {}, dropped {}'.format(
+                    store.base, len(store), store.dropped
+                ))
         cv2.destroyAllWindows()
+        if RemapEngine.cache is not None and args.runtime != 'processes':
+            print('Map cache: {}'.format(RemapEngine.cache.report()))
 
         print_params()
+        print(TIMINGS.report())
+        print(CPU.report())
+        if args.timings:
+            TIMINGS.dump(args.timings)
+        print('Stereo pairing: {}'.format(processor.pairer.report()))
+        if args.runtime == 'processes':
+            print('Left overruns: {}'.format(left_queue.report()))
+            print('Right overruns: {}'.format(right_queue.report()))
+        else:
+            print('Dropped frames: left = {}, right = {}'.format(
+                left_queue.dropped,
+                right_queue.dropped,
+            ))
 
-    input_handler = InputHandler(close_callback)
+    input_handler = InputHandler(close_callback, args.input_rate)
+    CPU.reset()
 
-    left.start()
-    right.start()
-    if args.oculus:
-        driver.start()
-    processor.start()
+    if threaded:
+        if args.oculus:
+            driver.setup()
+        for stage in background:
+            stage.start()
+
+        if args.runtime == 'processes':
+            def forward(group, name, value):
+                """Send each Parameters change to the eye processes"""
+                left.update({name: value})
+                right.update({name: value})
+            Parameters.subscribe(forward)
+
+        while not stopped.is_set():
+            processor.iterate()
+            input_handler.handle_input()
+            if args.runtime == 'processes' and (left.failed or right.failed):
+                print('An eye process has failed; exiting')
+                close_callback()
+                sys.exit(1)
+        return
+
+    def display():
+        """Handle input after every frame, as the threads loop does,
+        so HighGUI paints it at once rather than at the next poll"""
+        while not stopped.is_set():
+            processor.iterate()
+            input_handler.handle_input()
+            gevent.sleep(0)
+
+    for stage in background:
+        stage.start()
+    # Still polls the keyboard while no frames arrive
     input_handler.start()
 
     gevent.signal(signal.SIGQUIT, gevent.kill)
-    if args.oculus:
-        gevent.joinall([left, right, processor, input_handler, driver])
-    else:
-        gevent.joinall([left, right, processor, input_handler])
+    gevent.joinall(background + [gevent.spawn(display), input_handler])
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,72 @@
+'''
+Timestamped frames and stereo pairing by capture time
+'''
+
+
+from collections import namedtuple
+
+
+class Frame(namedtuple('Frame', ['timestamp', 'image'])):
+    """A camera frame and its capture time, in seconds"""
+    __slots__ = ()
+
+
+class StereoPairer(object):
+    """Match left and right frames whose capture times are close
+
+    Holds the newest frame from each eye. A pair is released when the
+    two are within `tolerance` seconds of each other; otherwise the
+    older of the two is dropped as a stale orphan, since later frames
+    from the other eye can only be further from it. A pending frame
+    replaced by a newer one from the same eye is dropped too.
+
+    Attributes:
+        skew (float): left minus right capture time of the last pair
+        pairs (int): number of pairs released
+        orphans (int): number of frames dropped unpaired
+    """
+    def __init__(self, tolerance=0.05):
+        """
+        Args:
+            tolerance (float): largest inter-eye skew, in seconds,
+                that still counts as a pair
+        """
+        self.tolerance = tolerance
+        self.pending = [None, None]
+        self.skew = None
+        self.pairs = 0
+        self.orphans = 0
+
+    def add(self, index, frame):
+        """Offer a new frame for eye `index` (0 left, 1 right)"""
+        if self.pending[index] is not None:
+            self.orphans += 1
+        self.pending[index] = frame
+
+    def pair(self):
+        """Return a matched (left, right) pair of frames, or None"""
+        left, right = self.pending
+        if left is None or right is None:
+            return None
+
+        skew = left.timestamp - right.timestamp
+        if abs(skew) > self.tolerance:
+            self.pending[0 if skew < 0 else 1] = None
+            self.orphans += 1
+            return None
+
+        self.pending = [None, None]
+        self.skew = skew
+        self.pairs += 1
+        return left, right
+
+    def report(self):
+        """Pairing statistics, for printing"""
+        skew = 'n/a'
+        if self.skew is not None:
+            skew = '{:.1f} ms'.format(self.skew * 1000)
+        return 'pairs = {}, orphans = {}, last skew = {}'.format(
+            self.pairs,
+            self.orphans,
+            skew,
+        )
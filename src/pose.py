@@ -0,0 +1,279 @@
+'''
+Sampling, filtering and prediction of the head pose
+
+A PoseSampler polls the HMD at a fixed rate into a PoseBuffer, which
+any stage can read the latest pose, or the pose at a given time, from
+without calling into ovrsdk.
+
+A Timewarp turns the head's movement since a frame was captured into
+an image shift, to hide the servos' lag.
+
+The HMD orientation is noisy, and the servos and radio link take time
+to act on it. A One-Euro filter [1] smooths each axis: heavily when
+the head is still, removing jitter, and lightly when it moves fast,
+keeping lag low. The filtered pose is then extrapolated by the
+actuation latency, so the servos head for where the head will be.
+
+[1]: Casiez, Roussel and Vogel, "1 Euro Filter: A Simple Speed-based
+     Low-pass Filter for Noisy Input in Interactive Systems", CHI 2012
+'''
+
+
+import math
+from collections import namedtuple
+from time import time
+
+import numpy as np
+import gevent
+from gevent import Greenlet
+import ovrsdk as ovr
+
+from algos import Parameters
+from workers import Ticker
+
+
+class Pose(namedtuple('Pose', ['timestamp', 'x', 'y', 'z', 'w'])):
+    """Head orientation quaternion, and the time it was sampled
+
+    `x` is the pitch axis and `y` the yaw axis, as the OculusDriver
+    maps them to servo angles.
+    """
+    __slots__ = ()
+
+
+def angle(component):
+    """Rotation angle, in radians, of a quaternion component"""
+    return 2 * math.asin(max(-1.0, min(1.0, component)))
+
+def smoothing(cutoff, elapsed):
+    """Exponential smoothing factor for a `cutoff` Hz low-pass"""
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / elapsed)
+
+
+class OneEuroFilter(object):
+    """Adaptive low-pass filter for one noisy signal
+
+    The cutoff frequency rises with the signal's speed:
+    `min_cutoff + beta * |speed|`. Lower `min_cutoff` removes more
+    jitter when still; higher `beta` removes more lag when moving.
+    """
+    def __init__(self, min_cutoff=1.0, beta=0.5, d_cutoff=1.0):
+        """
+        Args:
+            min_cutoff (float): cutoff, in Hz, when the signal is still
+            beta (float): increase in cutoff per unit of speed
+            d_cutoff (float): cutoff, in Hz, for the speed estimate
+        """
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self.value = None
+        self.raw = None
+        self.speed = 0.0
+        self.timestamp = None
+
+    def __call__(self, timestamp, value):
+        """Filter `value`, sampled at `timestamp` (in seconds)"""
+        if self.value is None:
+            self.value = self.raw = value
+            self.timestamp = timestamp
+            return value
+
+        elapsed = timestamp - self.timestamp
+        if elapsed <= 0:
+            return self.value
+        self.timestamp = timestamp
+
+        # From the raw samples, so the speed (also used for
+        # prediction) does not overshoot while the value catches up
+        speed = (value - self.raw) / elapsed
+        self.raw = value
+        alpha = smoothing(self.d_cutoff, elapsed)
+        self.speed += alpha * (speed - self.speed)
+
+        cutoff = self.min_cutoff + self.beta * abs(self.speed)
+        alpha = smoothing(cutoff, elapsed)
+        self.value += alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = self.raw = None
+        self.speed = 0.0
+
+
+class PoseFilter(object):
+    """Filter and predict several pose axes (e.g. yaw and pitch)
+
+    Reads its settings from the Parameters on every sample, so they
+    can be tuned while running: `poseCutoff` (Hz) and `poseBeta` for
+    the filters, and `poseLead` (milliseconds), how far ahead to
+    predict, which should match the measured servo and link latency.
+    """
+    def __init__(self, axes=2):
+        self.filters = [OneEuroFilter() for _ in range(axes)]
+
+    def __call__(self, timestamp, values):
+        """Filtered values of a pose sampled at `timestamp`, predicted
+        `poseLead` milliseconds ahead"""
+        lead = Parameters.poseLead / 1000.0
+        results = []
+        for axis, value in zip(self.filters, values):
+            axis.min_cutoff = Parameters.poseCutoff
+            axis.beta = Parameters.poseBeta
+            filtered = axis(timestamp, value)
+            results.append(filtered + axis.speed * lead)
+        return results
+
+
+class PoseBuffer(object):
+    """Ring buffer of the most recent timestamped poses
+
+    Written by a single PoseSampler and read by any number of stages,
+    on any thread, without locks: a pose is written into its row
+    before `count` is advanced to publish it, and readers copy the
+    rows they need before using them.
+    """
+    def __init__(self, size=256):
+        """
+        Args:
+            size (int): poses kept; at 250 Hz, 256 is about a second
+        """
+        self.poses = np.zeros((size, len(Pose._fields)))
+        self.count = 0
+
+    def add(self, pose):
+        self.poses[self.count % len(self.poses)] = pose
+        self.count += 1
+
+    def latest(self):
+        """The newest pose, or None if there is none yet"""
+        count = self.count
+        if not count:
+            return None
+        return Pose(*self.poses[(count - 1) % len(self.poses)])
+
+    def history(self):
+        """Copy of the stored poses, oldest first, one row per pose
+
+        Leaves out the oldest row, which the sampler may be
+        overwriting while it is copied.
+        """
+        count = self.count
+        first = max(0, count - len(self.poses) + 1)
+        return self.poses[np.arange(first, count) % len(self.poses)]
+
+    def at(self, timestamp):
+        """Pose at `timestamp`, interpolated between the nearest two
+
+        Times outside the history get the oldest or newest pose.
+        Returns None if there are no poses yet.
+        """
+        history = self.history()
+        if not len(history):
+            return None
+        times = history[:, 0]
+        index = int(np.searchsorted(times, timestamp))
+        if index == 0:
+            return Pose(*history[0])
+        if index == len(history):
+            return Pose(*history[-1])
+
+        before, after = history[index - 1], history[index]
+        fraction = (timestamp - before[0]) / (after[0] - before[0])
+        quaternion = before[1:] + fraction * (after[1:] - before[1:])
+        quaternion /= np.linalg.norm(quaternion) or 1
+        return Pose(timestamp, *quaternion)
+
+
+class PoseSampler(Greenlet):
+    """Poll the HMD orientation at a fixed rate into a PoseBuffer
+
+    Poses are timestamped with `time()`, the clock frames are tagged
+    with, so a frame's pose can be looked up from its timestamp.
+    """
+    def __init__(self, hmd, poses, rate=250):
+        """
+        Args:
+            hmd: the Oculus HMD to read orientation from
+            poses (PoseBuffer): where poses are written
+            rate (float): samples per second
+        """
+        Greenlet.__init__(self)
+        self.hmd = hmd
+        self.poses = poses
+        self.ticker = Ticker(rate)
+
+    def _run(self):
+        """Sample until killed, yielding to other greenlets each time"""
+        while True:
+            self.iterate()
+            gevent.sleep(0)
+
+    def iterate(self):
+        """Wait for the next sample time, then sample the pose
+
+        The wait is a Ticker's, which sleeps through `time.sleep` looked
+        up at call time, so under gevent it yields rather than blocks.
+        """
+        self.ticker.wait()
+        state = ovr.ovrHmd_GetSensorState(
+            self.hmd, ovr.ovr_GetTimeInSeconds()
+        )
+        orientation = state.Predicted.Pose.Orientation
+        self.poses.add(Pose(
+            time(),
+            orientation.x,
+            orientation.y,
+            orientation.z,
+            orientation.w,
+        ))
+
+    def __str__(self):
+        return 'PoseSampler at {:.0f} Hz'.format(self.ticker.rate)
+
+
+class Timewarp(object):
+    """Image shift that makes up for the servos lagging the head
+
+    The cameras point where the head was `warpLag` milliseconds
+    before each frame was captured; the frame is shifted by the
+    head's rotation since then, through the RemapEngine's margin, so
+    the view follows the head before the servos do. Enabled by the
+    `warp` parameter; `warpGain` scales (or, if negative, reverses)
+    the shift.
+    """
+    def __init__(self, poses, margin=32):
+        """
+        Args:
+            poses (PoseBuffer): the head poses
+            margin (int): largest shift, in pixels
+        """
+        self.poses = poses
+        self.margin = margin
+
+    def shift(self, timestamp, eye='left'):
+        """(x, y) shift, in pixels, for a frame captured at `timestamp`
+
+        Returns None when disabled or before any pose is sampled.
+
+        Args:
+            timestamp (float): when the frame was captured
+            eye (str): 'left' or 'right', whose focal lengths convert
+                the rotation to pixels
+        """
+        if not Parameters.warp:
+            return None
+        now = self.poses.latest()
+        if now is None:
+            return None
+        then = self.poses.at(timestamp - Parameters.warpLag / 1000.0)
+
+        gain = Parameters.warpGain * Parameters.scale
+        suffix = eye[0].upper()
+        return (
+            gain * getattr(Parameters, 'fx' + suffix) *
+            (angle(now.y) - angle(then.y)),
+            gain * getattr(Parameters, 'fy' + suffix) *
+            (angle(now.x) - angle(then.x)),
+        )
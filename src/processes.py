@@ -0,0 +1,263 @@
+'''
+Process-per-eye pipeline, handing frames over through shared memory
+
+Each EyeProcess captures and distorts one camera's frames with a
+regular CameraReader, rendering them straight into a SharedFrameRing.
+The CameraProcessor in the main process reads the rings as it would
+its queues, so frames are never pickled between processes; each one
+is copied once, out of its slot.
+'''
+
+
+import multiprocessing
+import sys
+import threading
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+
+from algos import Parameters
+from camera import CameraReader
+from capture import configure_capture
+from sources import open_source
+from pairing import Frame
+
+
+class SharedFrameRing(object):
+    """Ring of frame slots in shared memory, for one writer process
+
+    The writer (a CameraReader in an EyeProcess) renders each frame
+    into the next slot; the reader (a CameraProcessor) takes the most
+    recent complete one. Implements the parts of the CompositeBuffer
+    interface (`half`, `locks`) that CameraReader writes through, and
+    the parts of the queue interface (`put`, `empty`, `get_nowait`)
+    that both classes use.
+
+    Each slot's state counter is odd while the slot is being written,
+    and changes whenever it is rewritten, so the reader can tell that
+    its copy of a slot is intact. `overruns` counts, per slot, the
+    frames that were overwritten before the reader took them.
+
+    Like a Mailbox, sets its `ready` event, if any (a
+    `multiprocessing.Event`, to work across processes), whenever a
+    frame is published.
+    """
+    def __init__(self, capacity, slots=4, dtype=np.uint8, ready=None):
+        """Allocate the shared slots
+
+        Args:
+            capacity (int): the largest frame, in elements, that a
+                slot can hold
+            slots (int): number of frames in the ring
+            dtype (np.dtype): dtype of the frames
+            ready (multiprocessing.Event): set whenever a frame is put
+        """
+        self.capacity = capacity
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.buffer = multiprocessing.RawArray(
+            'b', slots * capacity * self.dtype.itemsize
+        )
+        self.shapes = multiprocessing.RawArray('l', slots * 3)
+        self.states = multiprocessing.RawArray('l', slots)
+        self.taken = multiprocessing.RawArray('b', slots)
+        self.overruns = multiprocessing.RawArray('l', slots)
+        self.timestamps = multiprocessing.RawArray('d', slots)
+        self.head = multiprocessing.RawValue('l', -1)
+        self.ready = ready
+
+        # Process-local state: the writer's next sequence number, the
+        # last sequence number the reader took, and the reader's
+        # copies discarded as torn
+        self.written = 0
+        self.read = -1
+        self.torn = 0
+        self.locks = (threading.Lock(), threading.Lock())
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['locks']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.locks = (threading.Lock(), threading.Lock())
+
+    def slot(self, index, shape):
+        """View onto the start of slot `index`, with the given shape"""
+        count = int(np.prod(shape))
+        if count > self.capacity:
+            raise ValueError('Frame of shape {} does not fit in a slot'.format(
+                shape
+            ))
+        offset = index * self.capacity * self.dtype.itemsize
+        return np.frombuffer(
+            self.buffer, self.dtype, count, offset
+        ).reshape(shape)
+
+    def half(self, index, shape, dtype):
+        """Start writing the next frame; returns the slot to write to
+
+        Called by CameraReader in place of CompositeBuffer.half; the
+        write is completed by `put`.
+        """
+        if np.dtype(dtype) != self.dtype:
+            raise ValueError('Expected {} frames, not {}'.format(
+                self.dtype, dtype
+            ))
+        slot = self.written % self.slots
+        if self.states[slot] and not self.taken[slot]:
+            self.overruns[slot] += 1
+        self.states[slot] += 1
+        padded = tuple(shape) + (0, ) * (3 - len(shape))
+        self.shapes[slot * 3:slot * 3 + 3] = padded
+        return self.slot(slot, shape)
+
+    def put(self, frame):
+        """Publish the Frame started by the last call to `half`"""
+        slot = self.written % self.slots
+        self.timestamps[slot] = frame.timestamp
+        self.taken[slot] = 0
+        self.states[slot] += 1
+        self.head.value = self.written
+        self.written += 1
+        if self.ready is not None:
+            self.ready.set()
+
+    def empty(self):
+        """Whether there is no frame newer than the last one taken"""
+        return self.head.value <= self.read
+
+    def get_nowait(self):
+        """Take a copy of the most recent complete Frame
+
+        The slot is copied, then its state counter checked again: if
+        the writer came round the ring and rewrote the slot during the
+        copy, the copy may be torn, so it is thrown away (and counted
+        in `torn`) and the newest frame taken instead. The copy
+        belongs to the caller, so it can be held (e.g. pending a
+        partner frame) for as long as needed.
+
+        Raises:
+            Empty: if there is no new complete frame
+        """
+        for _ in range(self.slots):
+            head = self.head.value
+            if head <= self.read:
+                raise Empty
+            slot = head % self.slots
+            state = self.states[slot]
+            if state % 2:
+                continue
+            shape = self.shapes[slot * 3:slot * 3 + 3]
+            shape = tuple(dim for dim in shape if dim)
+            timestamp = self.timestamps[slot]
+            image = self.slot(slot, shape).copy()
+            if self.states[slot] == state:
+                self.read = head
+                self.taken[slot] = 1
+                return Frame(timestamp, image)
+            self.torn += 1
+        raise Empty
+
+    def report(self):
+        """Per-slot overrun counts and torn copies, for printing"""
+        return '{}; {} torn'.format(
+            ', '.join(
+                'slot {} = {}'.format(index, count)
+                for index, count in enumerate(self.overruns)
+            ),
+            self.torn,
+        )
+
+
+def parameter_values():
+    """Snapshot of the run-time Parameters, as print_params lists them"""
+    return Parameters.values()
+
+
+class EyeProcess(multiprocessing.Process):
+    """Capture and distort one eye's frames in a separate process
+
+    Runs a CameraReader whose composite and queue are both the
+    shared ring. Parameters changed in the main process (e.g. through
+    the InputHandler) are forwarded with `update`. If the source
+    cannot be opened, the process exits with an error code, which the
+    main process sees as `failed`.
+    """
+    def __init__(self, source, ring, index, settings=None, store=None):
+        """Store the source to open and ring to write to
+
+        Args:
+            source (dict): keyword arguments for `open_source`; the
+                source is opened in the child process
+            ring (SharedFrameRing): where processed frames go
+            index (int): 0 for the left eye, 1 for the right
+            settings (dict): keyword arguments for
+                `configure_capture`, for live cameras
+            store (FrameStore): where raw frames are recorded, if
+                anywhere; its files are created in the child process
+        """
+        multiprocessing.Process.__init__(self)
+        self.daemon = True
+        self.source = source
+        self.ring = ring
+        self.index = index
+        self.settings = settings or {}
+        self.store = store
+        self.updates = multiprocessing.Queue()
+        self.stopped = multiprocessing.Event()
+
+    def run(self):
+        """Process method; read and distort frames until killed"""
+        camera = open_source(**self.source)
+        if not camera.isOpened():
+            print('Failed to open {}'.format(self.source['spec']))
+            sys.exit(1)
+        if self.source['kind'] == 'camera':
+            configure_capture(camera, **self.settings)
+
+        reader = CameraReader(camera, self.ring, self.index)
+        reader.composite = self.ring
+        reader.store = self.store
+        while not self.stopped.is_set():
+            self.apply_updates()
+            reader.iterate()
+        camera.release()
+        if self.store is not None:
+            self.store.close()
+            print('Raw frames: {}, dropped {}'.format(
+                len(self.store), self.store.dropped
+            ))
+        print(reader.timings.report())
+
+    def update(self, values):
+        """Send changed Parameters values to the child process"""
+        self.updates.put(values)
+
+    def apply_updates(self):
+        """Apply any Parameters values sent with `update`"""
+        while True:
+            try:
+                values = self.updates.get_nowait()
+            except Empty:
+                return
+            for name, value in values.items():
+                setattr(Parameters, name, value)
+
+    @property
+    def failed(self):
+        """Whether the process has ended with an error"""
+        return bool(self.exitcode)
+
+    def kill(self, block=True, timeout=None):
+        """Stop the process after its current frame"""
+        self.stopped.set()
+        if block:
+            self.join(timeout)
+
+    def __str__(self):
+        return 'EyeProcess for {}'.format(self.source['spec'])
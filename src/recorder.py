@@ -0,0 +1,176 @@
+'''
+Background video recording of the composited frames
+'''
+
+
+import sys
+from collections import deque
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import numpy as np
+import cv2
+from gevent import monkey
+
+from capture import fourcc_code
+from mailbox import ThreadMailbox
+from stats import TIMINGS
+
+# Encoding must run on a real OS thread even when gevent has patched
+# threading, or it would stall the display loop; these are always the
+# unpatched versions.
+_thread = '_thread' if sys.version_info[0] >= 3 else 'thread'
+start_new_thread = monkey.get_original(_thread, 'start_new_thread')
+time = monkey.get_original('time', 'time')
+
+
+class VideoRecorder(object):
+    """Encode composited frames to a file on a background thread
+
+    `record` copies the frame into one of `depth` preallocated buffers
+    and returns at once; if all buffers are waiting to be encoded, the
+    frame is dropped and counted instead of stalling the display. The
+    writer thread sleeps on a ThreadMailbox until a frame arrives.
+
+    The writer is created from the first frames: its size is the real
+    composite size and, unless `fps` is given, its frame rate is the
+    capture rate measured over the first `warmup` frames. Frames are
+    then duplicated or dropped by capture timestamp, so playback runs
+    in real time even if the capture rate drifts.
+    """
+    def __init__(self, path='output.avi', codec='XVID', fps=None, depth=32,
+                 warmup=10):
+        """Start the writer thread
+
+        Args:
+            path (str): output video file
+            codec (str): four character code, e.g. 'XVID' or 'MJPG'
+            fps (float): output frame rate; measured if None
+            depth (int): frames that can wait to be encoded
+            warmup (int): frames used to measure the capture rate
+        """
+        self.path = path
+        self.codec = codec
+        self.fps = fps
+        self.depth = depth
+        self.warmup = min(warmup, depth)
+        self.timings = TIMINGS
+
+        self.pending = ThreadMailbox(depth)
+        self.free = deque()
+        self.buffers = 0
+        self.writer = None
+        self.size = None
+        self.start = None
+        self.written = 0
+        self.dropped = 0
+        self.duplicated = 0
+        self.skipped = 0
+        # Closed by the writer thread when it is done
+        self.finished = ThreadMailbox()
+        start_new_thread(self._run, ())
+
+    def record(self, timestamp, image):
+        """Queue a copy of `image`, captured at `timestamp`, for writing"""
+        try:
+            buffer = self.free.popleft()
+        except IndexError:
+            if self.buffers >= self.depth:
+                self.dropped += 1
+                return
+            buffer = np.empty_like(image)
+            self.buffers += 1
+        if buffer.shape != image.shape or buffer.dtype != image.dtype:
+            buffer = np.empty_like(image)
+        np.copyto(buffer, image)
+        self.pending.put((timestamp, buffer))
+
+    def _run(self):
+        """Thread function: encode frames until closed"""
+        held = []
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            timestamp, image = item
+
+            if self.writer is None:
+                held.append((timestamp, image))
+                if len(held) < self.warmup:
+                    continue
+                self.open(held)
+                for item in held:
+                    self.write(*item)
+                held = []
+            else:
+                self.write(timestamp, image)
+
+        if held:
+            self.open(held)
+            for item in held:
+                self.write(*item)
+        if self.writer is not None:
+            self.writer.release()
+        self.finished.close()
+
+    def open(self, frames):
+        """Create the writer, sized and timed from the first frames"""
+        timestamp, image = frames[0]
+        if self.fps is None:
+            elapsed = frames[-1][0] - timestamp
+            self.fps = 15.0
+            if len(frames) > 1 and elapsed > 0:
+                self.fps = (len(frames) - 1) / elapsed
+        self.size = (image.shape[1], image.shape[0])
+        self.start = timestamp
+        self.writer = cv2.VideoWriter(
+            self.path,
+            fourcc_code(self.codec),
+            self.fps,
+            self.size,
+            image.ndim == 3,
+        )
+
+    def write(self, timestamp, buffer):
+        """Write `buffer` as many times as real time calls for"""
+        start = time()
+        image = buffer
+        if (image.shape[1], image.shape[0]) != self.size:
+            image = cv2.resize(image, self.size)
+        index = int(round((timestamp - self.start) * self.fps))
+        copies = index - self.written + 1
+        if copies < 1:
+            self.skipped += 1
+        for _ in range(copies):
+            self.writer.write(image)
+        if copies > 1:
+            self.duplicated += copies - 1
+        self.written += max(copies, 0)
+        self.timings.add('encode', time() - start)
+        self.free.append(buffer)
+
+    def close(self, timeout=10):
+        """Encode what is still queued, then release the file
+
+        Args:
+            timeout (float): most seconds to wait for the encoding
+        """
+        self.pending.close()
+        try:
+            self.finished.get(timeout)
+        except Empty:
+            pass
+
+    def report(self):
+        """Recording statistics, for printing"""
+        return ('{} at {:.2f} fps: {} frames written, {} duplicated, '
+                '{} skipped, {} dropped'.format(
+                    self.path,
+                    self.fps or 0,
+                    self.written,
+                    self.duplicated,
+                    self.skipped,
+                    self.dropped,
+                ))
@@ -0,0 +1,199 @@
+"""
+Replay a recorded session through the processing pipeline
+
+Feeds frame stores recorded with `oculus_stream.py --raw PREFIX`
+through the same CameraReader -> CameraProcessor pipeline as live
+capture, either as fast as possible or at the recorded pace, with any
+Parameters overridden. Both eyes are read in turn on one thread, so a
+replay always pairs and processes the same frames. Composited frames
+go to a NullSink, and optionally to a video file; the throughput is
+reported, so distortion settings and pipeline versions can be compared
+on the same workload.
+
+    python src/replay.py session --param xo=20 --output session.avi
+"""
+
+
+import argparse
+import json
+from time import time
+
+from algos import *
+from camera import CameraReader, CameraProcessor, EYES
+from frame_store import FrameStore
+from mailbox import Mailbox
+from processes import parameter_values
+from recorder import VideoRecorder
+from sinks import NullSink
+from sources import StoreSource
+from stats import TIMINGS
+
+
+def parse_parameter(setting):
+    """(name, value) of a NAME=VALUE Parameters override"""
+    name, _, value = setting.partition('=')
+    if name not in parameter_values():
+        raise argparse.ArgumentTypeError(
+            'No parameter {}'.format(name)
+        )
+    for kind in [int, float]:
+        try:
+            return name, kind(value)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(
+        'Not a number: {}'.format(setting)
+    )
+
+def replay(prefix, realtime=False, parameters=None, recorder=None,
+           tolerance=0.05):
+    """Run the recording `prefix` through the pipeline once
+
+    Args:
+        prefix (str): the recording; its frame stores are
+            `prefix-left` and `prefix-right`
+        realtime (boolean): deliver frames at the recorded pace,
+            rather than as fast as possible
+        parameters (dict): Parameters values to use instead of the
+            current ones, restored afterwards
+        recorder (VideoRecorder): records the composited frames, if
+            given
+        tolerance (float): largest inter-eye skew, in seconds, of
+            frames shown together
+
+    Returns:
+        dict of the frames read and composited, the elapsed time and
+        the composited frame rate
+    """
+    stores = [FrameStore.open('{}-{}'.format(prefix, eye)) for eye in EYES]
+    origin = min([store[0][0] for store in stores if len(store)] or [0])
+    sources = [StoreSource(store, realtime, origin) for store in stores]
+
+    queues = [Mailbox(), Mailbox()]
+    sink = NullSink()
+    processor = CameraProcessor(queues[0], queues[1], recorder, tolerance,
+                                sink)
+    readers = []
+    for index, source in enumerate(sources):
+        reader = CameraReader(source, queues[index], index)
+        reader.clock = source.captured
+        processor.attach(reader, index)
+        readers.append(reader)
+
+    previous = parameter_values()
+    for name, value in (parameters or {}).items():
+        setattr(Parameters, name, value)
+    try:
+        start = time()
+        for source in sources:
+            source.started = start
+        while not all(source.finished() for source in sources):
+            for reader in readers:
+                reader.iterate()
+            processor.iterate()
+        elapsed = time() - start
+    finally:
+        for name, value in previous.items():
+            setattr(Parameters, name, value)
+
+    return dict(
+        read=[len(store) for store in stores],
+        frames=sink.frames,
+        orphans=processor.pairer.orphans,
+        elapsed=elapsed,
+        fps=sink.frames / elapsed if elapsed else 0,
+    )
+
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+parser.add_argument(
+    'prefix',
+    help='Recording to replay, as given to --raw',
+)
+parser.add_argument(
+    '-p',
+    '--param',
+    help='Override a Parameters value, e.g. xo=20; may be repeated',
+    type=parse_parameter,
+    action='append',
+    default=[],
+    metavar='NAME=VALUE',
+)
+parser.add_argument(
+    '--realtime',
+    help='Deliver frames at the recorded pace, not as fast as possible',
+    action='store_true',
+)
+parser.add_argument(
+    '-s',
+    '--skew',
+    help='Largest inter-eye skew, in milliseconds, of frames shown '
+         'together',
+    type=float,
+    default=50,
+)
+parser.add_argument(
+    '-o',
+    '--output',
+    help='Record the composited frames to this video file',
+)
+parser.add_argument(
+    '--codec',
+    help='Four character code of the recording codec, e.g. XVID or MJPG',
+    default='XVID',
+)
+parser.add_argument(
+    '-j',
+    '--json',
+    help='Write the results, parameters and stage timings to this file',
+)
+
+def main():
+    args = parser.parse_args()
+    recorder = None
+    if args.output:
+        recorder = VideoRecorder(args.output, args.codec)
+
+    parameters = dict(args.param)
+    results = replay(
+        args.prefix,
+        args.realtime,
+        parameters,
+        recorder,
+        args.skew / 1000.0,
+    )
+    if recorder is not None:
+        recorder.close()
+        print('Recorded {}'.format(recorder.report()))
+
+    if not args.realtime:
+        # Capture-to-display age is only meaningful at the recorded pace
+        for eye in EYES:
+            TIMINGS.histograms.pop(eye + '/age', None)
+
+    print(TIMINGS.report())
+    print('Replayed {} + {} frames: {} composited, {} orphaned, '
+          'in {:.2f}s ({:.1f} fps)'.format(
+              results['read'][0],
+              results['read'][1],
+              results['frames'],
+              results['orphans'],
+              results['elapsed'],
+              results['fps'],
+          ))
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(
+                dict(
+                    results=results,
+                    parameters=parameters,
+                    timings=TIMINGS.summary(),
+                ),
+                output,
+                indent=2,
+                sort_keys=True,
+            )
+
+if __name__ == '__main__':
+    main()
@@ -80,14 +80,36 @@ def constrain_ranges():
         if target > high:
             RANGES[idx] = high
 
-def set_target(controller, channel, target):
-    """Set servo target angles, within pre-set bounds"""
-    constrain_ranges()
+def encode_target(target):
+    """Target angle as the Maestro's two 7-bit bytes"""
     target = transform(target)
     lsb = target & 0x7f #7 bits for least significant byte
     msb = (target >> 7) & 0x7f #shift 7 and take next 7 bits for msb
-    cmd = chr(0x84) + chr(channel) + chr(lsb) + chr(msb)
+    return chr(lsb) + chr(msb)
+
+def set_target(controller, channel, target):
+    """Set servo target angles, within pre-set bounds"""
+    constrain_ranges()
+    cmd = chr(0x84) + chr(channel) + encode_target(target)
+    controller.write(cmd)
+
+def set_targets(controller, channel, targets):
+    """Set the targets of consecutive channels in a single write
+
+    Uses the Maestro's Set Multiple Targets command, so all servos
+    move together and the serial link carries 3 + 2 * len(targets)
+    bytes, rather than 4 per servo.
+
+    Args:
+        controller (serial.Serial): the Maestro connection
+        channel (int): the first channel to set
+        targets (list): target angles, for `channel` onwards
+    """
+    constrain_ranges()
+    cmd = chr(0x9F) + chr(len(targets)) + chr(channel)
+    cmd += ''.join(encode_target(target) for target in targets)
     controller.write(cmd)
+    return len(cmd)
 
 def go_home(controller):
     """Move servos to home position"""
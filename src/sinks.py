@@ -0,0 +1,34 @@
+'''
+Display sinks for the composited frames
+'''
+
+
+import cv2
+
+
+class WindowSink(object):
+    """Show frames in an OpenCV window (the HMD display)"""
+    def __init__(self, name='vid'):
+        self.name = name
+
+    def show(self, image):
+        cv2.imshow(self.name, image)
+
+
+class NullSink(object):
+    """Discard frames, counting them; for headless runs and benchmarks"""
+    def __init__(self):
+        self.frames = 0
+
+    def show(self, image):
+        self.frames += 1
+
+
+class TeeSink(object):
+    """Show frames on several sinks, e.g. a window and a StreamServer"""
+    def __init__(self, *sinks):
+        self.sinks = sinks
+
+    def show(self, image):
+        for sink in self.sinks:
+            sink.show(image)
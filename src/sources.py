@@ -0,0 +1,243 @@
+'''
+Frame sources for CameraReader: live cameras, video files, recorded
+frame stores and a synthetic pattern generator
+
+All sources offer the parts of the cv2.VideoCapture interface the
+pipeline uses (`read`, `grab`, `retrieve`, `isOpened`, `release`,
+`set`), so they can stand in for a capture device anywhere, which
+lets the full pipeline run and be benchmarked without cameras.
+'''
+
+
+import time
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+import cv2
+
+from algos import Parameters
+from capture import capture_property
+from frame_store import FrameStore
+
+
+def device(spec):
+    """Device index for a numeric spec (e.g. '1'), otherwise the spec"""
+    try:
+        return int(spec)
+    except ValueError:
+        return spec
+
+def open_source(kind, spec, index=0, size=None, fps=None, realtime=True):
+    """Open a frame source
+
+    Args:
+        kind (str): 'camera', 'file', 'store' or 'synthetic'
+        spec (str): device index, path or frame store (ignored for
+            'synthetic')
+        index (int): 0 for the left eye, 1 for the right
+        size (tuple): (width, height) of synthetic frames, defaulting
+            to the Parameters frame size
+        fps (float): frame rate of synthetic frames
+        realtime (boolean): pace files, stores and synthetic frames at
+            their frame rate, rather than delivering them as fast as
+            possible
+    """
+    if kind == 'file':
+        return VideoFileSource(spec, realtime=realtime)
+    if kind == 'store':
+        return StoreSource(FrameStore.open(spec), realtime=realtime)
+    if kind == 'synthetic':
+        return SyntheticSource(
+            size or (Parameters.width, Parameters.height),
+            fps=(fps or 30) if realtime else None,
+            index=index,
+        )
+    return cv2.VideoCapture(device(spec))
+
+
+# Abstract base class for both Python 2 and 3
+ABC = ABCMeta('ABC', (object, ), {})
+
+
+class FrameSource(ABC):
+    """Base for VideoCapture-like frame sources
+
+    Subclasses implement `next_frame`. If `fps` is set, `grab` sleeps
+    as needed so frames are delivered no faster than that rate; the
+    sleep is `time.sleep` looked up at call time, so under gevent's
+    monkey patching it yields to the other greenlets.
+    """
+    def __init__(self, fps=None):
+        self.fps = fps
+        self.due = None
+        self.frame = None
+
+    def wait(self):
+        """Sleep until the next frame is due, when paced"""
+        if not self.fps:
+            return
+        now = time.time()
+        if self.due is None:
+            self.due = now
+        if self.due > now:
+            time.sleep(self.due - now)
+        self.due = max(self.due + 1.0 / self.fps, now)
+
+    def grab(self):
+        self.wait()
+        self.frame = self.next_frame()
+        return self.frame is not None
+
+    def retrieve(self):
+        return self.frame is not None, self.frame
+
+    def read(self):
+        self.grab()
+        return self.retrieve()
+
+    def isOpened(self):
+        return True
+
+    def release(self):
+        pass
+
+    def set(self, prop, value):
+        return False
+
+    @abstractmethod
+    def next_frame(self):
+        """The next frame, or None when there are no more"""
+
+
+class VideoFileSource(FrameSource):
+    """Frames from a video file, looped when it runs out"""
+    def __init__(self, path, loop=True, realtime=True):
+        """Open the file
+
+        Args:
+            path (str): the video file
+            loop (boolean): restart from the beginning at the end
+            realtime (boolean): pace frames at the file's frame rate
+        """
+        self.capture = cv2.VideoCapture(path)
+        fps = None
+        if realtime:
+            fps = self.capture.get(capture_property('FPS')) or 30
+        FrameSource.__init__(self, fps)
+        self.path = path
+        self.loop = loop
+
+    def next_frame(self):
+        ok, frame = self.capture.read()
+        if not ok and self.loop:
+            self.capture.set(capture_property('POS_FRAMES'), 0)
+            ok, frame = self.capture.read()
+        return frame if ok else None
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+    def __str__(self):
+        return 'VideoFileSource for {}'.format(self.path)
+
+
+class StoreSource(FrameSource):
+    """Frames recorded in a FrameStore, played back once
+
+    When paced, frames are delivered with the spacing they were
+    captured with. `captured` gives the capture time of the frame just
+    read, moved onto the playback clock, so the recorded inter-frame
+    and inter-eye timing is preserved.
+    """
+    def __init__(self, store, realtime=True, origin=None):
+        """
+        Args:
+            store (FrameStore): the recording
+            realtime (boolean): pace frames as they were captured
+            origin (float): capture time at which playback starts;
+                the first frame's, unless given (use the same origin
+                for both eyes of a recording)
+        """
+        FrameSource.__init__(self)
+        self.store = store
+        self.realtime = realtime
+        self.position = 0
+        self.timestamp = None
+        self.origin = origin
+        if origin is None:
+            self.origin = store[0][0] if len(store) else 0
+        self.started = None
+
+    def wait(self):
+        """Sleep until the next frame is due, when paced"""
+        if self.started is None:
+            self.started = time.time()
+        if not self.realtime or self.finished():
+            return
+        delay = self.playback(self.store[self.position][0]) - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def playback(self, timestamp):
+        """Playback time of a frame captured at `timestamp`"""
+        return self.started + timestamp - self.origin
+
+    def next_frame(self):
+        if self.finished():
+            return None
+        timestamp, frame = self.store[self.position]
+        self.position += 1
+        self.timestamp = self.playback(timestamp)
+        return frame
+
+    def captured(self):
+        return self.timestamp
+
+    def finished(self):
+        return self.position >= len(self.store)
+
+    def __str__(self):
+        return 'StoreSource for {}'.format(self.store.base)
+
+
+class SyntheticSource(FrameSource):
+    """Deterministic, moving test pattern at any resolution
+
+    Frame `n` is a colour gradient and checkerboard scrolled `step`
+    pixels per frame, offset between the eyes to mimic parallax. The
+    pattern is rendered once; each frame is a view onto it.
+    """
+    def __init__(self, size, fps=None, index=0, step=4):
+        """Render the pattern
+
+        Args:
+            size (tuple): (width, height) of the frames
+            fps (float): pace frames at this rate; as fast as
+                possible if None
+            index (int): 0 for the left eye, 1 for the right
+            step (int): horizontal scroll, in pixels per frame
+        """
+        FrameSource.__init__(self, fps)
+        width, height = size
+        self.size = size
+        self.step = step
+        self.count = index * 8
+
+        rows, columns = np.mgrid[0:height, 0:width]
+        image = np.empty((height, width, 3), dtype=np.uint8)
+        image[..., 0] = columns * 255 // max(width - 1, 1)
+        image[..., 1] = rows * 255 // max(height - 1, 1)
+        image[..., 2] = ((rows // 32 + columns // 32) % 2) * 255
+        self.pattern = np.concatenate([image, image], axis=1)
+
+    def next_frame(self):
+        width = self.size[0]
+        offset = (self.count * self.step) % width
+        self.count += 1
+        return self.pattern[:, offset:offset + width]
+
+    def __str__(self):
+        return 'SyntheticSource {}x{}'.format(*self.size)
@@ -0,0 +1,144 @@
+'''
+Low-overhead per-stage latency statistics, and CPU utilisation
+
+Pipeline stages record how long each step took with `Timings.add`;
+the durations are kept in rolling windows so percentiles reflect
+recent behaviour under the current load.
+'''
+
+
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class LatencyHistogram(object):
+    """Rolling window of durations, summarized as percentiles"""
+    def __init__(self, size=512):
+        """
+        Args:
+            size (int): number of most recent samples kept
+        """
+        self.samples = deque(maxlen=size)
+        self.count = 0
+
+    def add(self, seconds):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self):
+        """p50/p95/p99/max of the window, in milliseconds"""
+        samples = sorted(self.samples)
+        if not samples:
+            return dict(count=0)
+
+        def percentile(fraction):
+            index = int(round(fraction * (len(samples) - 1)))
+            return 1000 * samples[index]
+
+        return dict(
+            count=self.count,
+            p50=percentile(0.5),
+            p95=percentile(0.95),
+            p99=percentile(0.99),
+            max=1000 * samples[-1],
+        )
+
+
+class Timings(object):
+    """Latency histograms for each named stage, e.g. 'left/capture'
+
+    `add` is cheap enough to call for every frame; the work of sorting
+    is only done when a report is asked for.
+    """
+    def __init__(self, size=512):
+        self.size = size
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        """Record that `stage` took `seconds`"""
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(
+                    stage, LatencyHistogram(self.size)
+                )
+        histogram.add(seconds)
+
+    def summary(self):
+        """Summaries of every stage, keyed by stage name"""
+        return dict(
+            (stage, histogram.summary())
+            for stage, histogram in list(self.histograms.items())
+        )
+
+    def report(self):
+        """The summary as a printable table"""
+        lines = ['{:<20} {:>7} {:>8} {:>8} {:>8} {:>8}'.format(
+            'stage (ms)', 'count', 'p50', 'p95', 'p99', 'max'
+        )]
+        for stage, summary in sorted(self.summary().items()):
+            if not summary['count']:
+                continue
+            lines.append(
+                '{:<20} {count:>7} {p50:>8.2f} {p95:>8.2f} {p99:>8.2f} '
+                '{max:>8.2f}'.format(stage, **summary)
+            )
+        return '\n'.join(lines)
+
+    def dump(self, path):
+        """Write the summary to `path` as JSON"""
+        with open(path, 'w') as output:
+            json.dump(self.summary(), output, indent=2, sort_keys=True)
+
+
+class CpuUsage(object):
+    """Processor time this process has used, relative to wall time
+
+    Utilisation is a fraction of one core, so it can exceed 1 when
+    several threads run in parallel. Child processes (e.g. the eye
+    processes) are only counted once they have exited.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Measure from now on"""
+        self.times = os.times()
+        self.started = time.time()
+
+    def summary(self):
+        """Elapsed seconds, and user, system, children's and total
+        utilisation since `reset`"""
+        times = os.times()
+        elapsed = max(time.time() - self.started, 1e-9)
+        user, system, child_user, child_system = [
+            (now - then) / elapsed
+            for now, then in zip(times[:4], self.times[:4])
+        ]
+        return dict(
+            elapsed=elapsed,
+            user=user,
+            system=system,
+            children=child_user + child_system,
+            total=user + system + child_user + child_system,
+        )
+
+    def report(self):
+        summary = self.summary()
+        return ('CPU over {:.1f}s: {:.0f}% of a core ({:.0f}% user, '
+                '{:.0f}% system, {:.0f}% children)'.format(
+                    summary['elapsed'],
+                    100 * summary['total'],
+                    100 * summary['user'],
+                    100 * summary['system'],
+                    100 * summary['children'],
+                ))
+
+
+# Shared by all stages of the pipeline in this process
+TIMINGS = Timings()
+CPU = CpuUsage()
@@ -0,0 +1,494 @@
+'''
+Streaming of the composited frames to viewers on the network
+
+A StreamServer is a display sink (see `sinks.py`) that serves the
+composite, or one eye of it, to any number of clients: as MJPEG over
+HTTP, for browsers and video players, e.g.
+
+    http://hmd-laptop:8080/stream.mjpg?fps=5&quality=50
+
+and as raw frames over a TCP socket, read with `read_frame`.
+
+The display path only copies the frame, into a pooled buffer, and only
+when a client is due one; a pool of workers encodes it, once per quality, and offers it to
+each client's latest-frame-wins ThreadMailbox. Every client is sent
+from its own thread, so a slow viewer only misses frames, and can
+never stall the HMD display. All of these are real OS threads, even
+under gevent, like the VideoRecorder's writer.
+'''
+
+
+import socket
+import struct
+import sys
+from collections import deque
+from time import time
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler
+    from SocketServer import StreamRequestHandler
+    from urlparse import parse_qs, urlparse
+    from Queue import Empty
+except ImportError:
+    from http.server import BaseHTTPRequestHandler
+    from socketserver import StreamRequestHandler
+    from urllib.parse import parse_qs, urlparse
+    from queue import Empty
+
+import numpy as np
+import cv2
+from gevent import monkey
+
+from mailbox import ThreadMailbox
+from stats import TIMINGS
+
+# Encoding and sending must run on real OS threads, with blocking
+# sockets, even when gevent has patched threading and socket, or they
+# would run on the display loop's hub; these are always the unpatched
+# versions.
+_thread = '_thread' if sys.version_info[0] >= 3 else 'thread'
+start_new_thread = monkey.get_original(_thread, 'start_new_thread')
+allocate_lock = monkey.get_original(_thread, 'allocate_lock')
+Socket = monkey.get_original('socket', 'socket')
+
+# Header of each raw frame: capture timestamp, then the height, width
+# and channels of the uint8 pixels that follow
+RAW_HEADER = struct.Struct('!dIII')
+BOUNDARY = 'frame'
+
+
+def read_frame(stream):
+    """(timestamp, image) of the next raw frame from `stream`
+
+    Args:
+        stream: file-like object of a raw frame socket, e.g. from
+            `socket.makefile('rb')`
+
+    Returns:
+        None when the stream has ended
+    """
+    header = stream.read(RAW_HEADER.size)
+    if len(header) < RAW_HEADER.size:
+        return None
+    timestamp, height, width, channels = RAW_HEADER.unpack(header)
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    data = stream.read(int(np.prod(shape)))
+    if len(data) < np.prod(shape):
+        return None
+    return timestamp, np.frombuffer(data, np.uint8).reshape(shape)
+
+def accept(listener):
+    """accept() on an unpatched socket, returning an unpatched socket
+
+    Python 3's `socket.accept` wraps the connection in whatever
+    `socket.socket` is at the time, i.e. gevent's socket once it is
+    patched.
+    """
+    if not hasattr(listener, '_accept'):
+        return listener.accept()
+    fd, address = listener._accept()
+    connection = Socket(listener.family, listener.type, listener.proto,
+                        fileno=fd)
+    connection.settimeout(None)
+    return connection, address
+
+
+class StreamClient(object):
+    """One viewer: its frame-rate and quality cap, and its mailbox of
+    encoded frames waiting to be sent"""
+    def __init__(self, fps, quality=None):
+        """
+        Args:
+            fps (float): most frames per second sent to the client
+            quality (int): JPEG quality, or None for raw frames
+        """
+        self.interval = 1.0 / fps
+        self.quality = quality
+        self.mailbox = ThreadMailbox()
+        self.due = time()
+        self.timestamp = 0
+        self.sent = 0
+        self.lock = allocate_lock()
+
+    def offer(self, timestamp, data):
+        """Queue `data`, unless a newer frame was already queued
+
+        The check and the put are one step, so of two encoders
+        offering at once, the older frame can never be queued last.
+        """
+        with self.lock:
+            if timestamp <= self.timestamp:
+                return
+            self.timestamp = timestamp
+            self.mailbox.put(data)
+
+    def next(self):
+        """The next frame's data, waiting for it; None once closed"""
+        data = self.mailbox.get()
+        if data is not None:
+            self.sent += 1
+        return data
+
+    def close(self):
+        self.mailbox.close()
+
+    @property
+    def dropped(self):
+        return self.mailbox.dropped
+
+
+class Listener(object):
+    """TCP server that handles each connection on a real OS thread
+
+    Stands in for a threading `socketserver`, whose sockets and
+    threads gevent's monkey patching would turn into greenlets on the
+    display loop's hub. Handlers get the listener as their `server`.
+    """
+    def __init__(self, stream, address, handler):
+        """Listen on `address`, and start accepting connections
+
+        Args:
+            stream (StreamServer): the server the handlers stream from
+            address (tuple): (host, port); port 0 picks a free one
+            handler: `socketserver` request handler class
+        """
+        self.stream = stream
+        self.handler = handler
+        self.socket = Socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(address)
+        self.socket.listen(5)
+        # Wake up now and then to notice being closed
+        self.socket.settimeout(0.1)
+        self.server_address = self.socket.getsockname()
+        self.connections = set()
+        self.lock = allocate_lock()
+        self.closed = False
+        start_new_thread(self.serve, ())
+
+    def serve(self):
+        """Thread function: accept connections until closed"""
+        while not self.closed:
+            try:
+                connection, address = accept(self.socket)
+            except socket.timeout:
+                continue
+            except (IOError, OSError, socket.error):
+                break
+            with self.lock:
+                self.connections.add(connection)
+            start_new_thread(self.handle, (connection, address))
+        self.socket.close()
+
+    def handle(self, connection, address):
+        """Thread function: serve one connection, then close it"""
+        try:
+            self.handler(connection, address, self)
+        except (IOError, OSError, socket.error):
+            pass
+        finally:
+            with self.lock:
+                self.connections.discard(connection)
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError, socket.error):
+                pass
+            connection.close()
+
+    def close(self):
+        """Stop accepting, and cut off every connection, so no sending
+        thread stays blocked on a client that stopped reading"""
+        self.closed = True
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except (IOError, OSError, socket.error):
+                pass
+
+
+class MjpegHandler(BaseHTTPRequestHandler):
+    """Serve `/stream.mjpg` (or `/`) as MJPEG, and `/frame.jpg` as one
+    JPEG; `fps` and `quality` query parameters lower the caps"""
+    def do_GET(self):
+        stream = self.server.stream
+        url = urlparse(self.path)
+        if url.path not in ('/', '/stream.mjpg', '/frame.jpg'):
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        try:
+            fps = min(float(query.get('fps', [stream.fps])[0]), stream.fps)
+            quality = min(int(query.get('quality', [stream.quality])[0]),
+                          stream.quality)
+        except ValueError:
+            self.send_error(400)
+            return
+        if fps <= 0 or quality < 1:
+            self.send_error(400)
+            return
+
+        client = StreamClient(fps, quality)
+        stream.add(client)
+        try:
+            if url.path == '/frame.jpg':
+                self.send_image(client.next())
+            else:
+                self.send_stream(client)
+        except (IOError, OSError, socket.error):
+            pass
+        finally:
+            stream.remove(client)
+
+    def send_image(self, data):
+        if data is None:
+            self.send_error(503)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/jpeg')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, client):
+        self.send_response(200)
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header(
+            'Content-Type',
+            'multipart/x-mixed-replace; boundary={}'.format(BOUNDARY),
+        )
+        self.end_headers()
+        while True:
+            data = client.next()
+            if data is None:
+                break
+            self.wfile.write('--{}\r\nContent-Type: image/jpeg\r\n'
+                             'Content-Length: {}\r\n\r\n'.format(
+                                 BOUNDARY, len(data)
+                             ).encode('ascii'))
+            self.wfile.write(data)
+            self.wfile.write(b'\r\n')
+
+    def log_message(self, *args):
+        """Quiet; the display loop's console is for its own reports"""
+
+
+class RawHandler(StreamRequestHandler):
+    """Send raw frames (see `read_frame`) until the client goes away"""
+    def handle(self):
+        stream = self.server.stream
+        client = StreamClient(stream.fps)
+        stream.add(client)
+        try:
+            while True:
+                data = client.next()
+                if data is None:
+                    break
+                self.wfile.write(data)
+        except (IOError, OSError, socket.error):
+            pass
+        finally:
+            stream.remove(client)
+
+
+class StreamServer(object):
+    """Display sink that streams the frames it is shown to viewers
+
+    Serves MJPEG over HTTP on `port` and raw frames on `raw_port`,
+    either or both. `fps` and `quality` cap every client; HTTP
+    clients can ask for less. `show` copies the frame into one of
+    `depth` buffers, so the encoders never see the composite being
+    written to; while all of them are in use, the frame is dropped
+    and counted. Encoding runs on `workers` threads, and
+    each client is served on its own thread. Like the VideoRecorder's
+    writer, these are real OS threads with unpatched sockets, even
+    under gevent's monkey patching, so neither the encoding nor a
+    blocked send ever runs on the display loop's hub; frames are
+    handed to them through ThreadMailboxes.
+    """
+    def __init__(self, port=None, raw_port=None, host='',
+                 raw_host='127.0.0.1', eye=None, fps=10, quality=70,
+                 workers=2, depth=4):
+        """Start serving
+
+        Args:
+            port (int): HTTP port for MJPEG; 0 picks a free one
+            raw_port (int): TCP port for raw frames; 0 picks a free one
+            host (str): interface the HTTP server listens on; '' for
+                all of them
+            raw_host (str): interface the raw server listens on
+            eye (str): 'left' or 'right' to stream only that half of
+                the composite
+            fps (float): most frames per second sent to any client
+            quality (int): highest JPEG quality sent
+            workers (int): encoding threads
+            depth (int): frames that can wait to be, or be, encoded
+        """
+        self.eye = eye
+        self.fps = fps
+        self.quality = quality
+        self.timings = TIMINGS
+        self.clients = []
+        self.lock = allocate_lock()
+        # Never drops: there are no more buffers than it holds
+        self.depth = depth
+        self.frames = ThreadMailbox(depth)
+        self.free = deque()
+        self.buffers = 0
+        self.dropped = 0
+        self.shown = 0
+        self.encoded = 0
+        # Each encoding thread puts to it as it finishes
+        self.workers = workers
+        self.finished = ThreadMailbox(workers)
+
+        self.servers = []
+        self.http = self.raw = None
+        if port is not None:
+            self.http = self.serve(host, port, MjpegHandler)
+        if raw_port is not None:
+            self.raw = self.serve(raw_host, raw_port, RawHandler)
+        for _ in range(workers):
+            start_new_thread(self.run, ())
+
+    def serve(self, host, port, handler):
+        """Start a server, on its own thread; returns it"""
+        server = Listener(self, (host, port), handler)
+        self.servers.append(server)
+        return server
+
+    def run(self):
+        """Encoding thread: encode frames until closed"""
+        while self.iterate():
+            pass
+        self.finished.put(True)
+
+    @property
+    def port(self):
+        return self.http.server_address[1]
+
+    @property
+    def raw_port(self):
+        return self.raw.server_address[1]
+
+    def add(self, client):
+        with self.lock:
+            self.clients.append(client)
+
+    def remove(self, client):
+        with self.lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def select(self, image):
+        """The part of the composite being streamed"""
+        if self.eye is None:
+            return image
+        half = image.shape[1] // 2
+        if self.eye == 'left':
+            return image[:, :half]
+        return image[:, half:]
+
+    def show(self, image):
+        """Hand `image` to the clients that are due a frame
+
+        Called from the display path, so does no more than copy the
+        frame for the encoders, and nothing at all while no client
+        is due one. The copy is made before returning, while the
+        caller still holds the composite's locks, so no frame is
+        encoded half-overwritten by the next one.
+        """
+        now = time()
+        with self.lock:
+            due = [client for client in self.clients if now >= client.due]
+            for client in due:
+                client.due = max(client.due + client.interval, now)
+        if not due:
+            return
+        image = self.select(image)
+        try:
+            buffer = self.free.popleft()
+        except IndexError:
+            if self.buffers >= self.depth:
+                self.dropped += 1
+                return
+            buffer = np.empty(image.shape, image.dtype)
+            self.buffers += 1
+        if buffer.shape != image.shape or buffer.dtype != image.dtype:
+            buffer = np.empty(image.shape, image.dtype)
+        np.copyto(buffer, image)
+        self.frames.put((now, buffer, due))
+        self.shown += 1
+        self.timings.add('stream', time() - now)
+
+    def encode(self, timestamp, image, quality):
+        """Bytes to send for `image`: a JPEG, or with no quality, a raw
+        frame"""
+        if quality is None:
+            channels = image.shape[2] if image.ndim == 3 else 1
+            return RAW_HEADER.pack(
+                timestamp, image.shape[0], image.shape[1], channels
+            ) + image.tobytes()
+        _, data = cv2.imencode(
+            '.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, quality]
+        )
+        return data.tobytes()
+
+    def iterate(self):
+        """Encode the next frame for its clients; False once closed
+
+        Encodes once for each quality asked for, whatever the number
+        of clients.
+        """
+        item = self.frames.get()
+        if item is None:
+            return False
+        timestamp, image, clients = item
+        encoded = {}
+        for client in clients:
+            if client.quality not in encoded:
+                start = time()
+                encoded[client.quality] = self.encode(
+                    timestamp, image, client.quality
+                )
+                self.timings.add('stream/encode', time() - start)
+                self.encoded += 1
+            client.offer(timestamp, encoded[client.quality])
+        self.free.append(image)
+        return True
+
+    def close(self, timeout=1):
+        """Disconnect every client and stop serving
+
+        Args:
+            timeout (float): most seconds to wait for each encoding
+                thread to finish its frame
+        """
+        self.frames.close()
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            client.close()
+        for server in self.servers:
+            server.close()
+        for _ in range(self.workers):
+            try:
+                self.finished.get(timeout)
+            except Empty:
+                break
+
+    def report(self):
+        """Streaming statistics, for printing"""
+        with self.lock:
+            clients = list(self.clients)
+        return ('{} frames streamed, {} encoded, {} dropped; '
+                '{} clients{}').format(
+            self.shown,
+            self.encoded,
+            self.dropped,
+            len(clients),
+            ''.join(
+                ', {} sent {} dropped'.format(client.sent, client.dropped)
+                for client in clients
+            ),
+        )
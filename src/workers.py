@@ -0,0 +1,85 @@
+'''
+Worker threads for running pipeline stages on real OS threads, and
+timers for pacing periodic stages
+
+OpenCV releases the GIL during capture and resampling, so running
+each CameraReader on its own thread lets the two eyes process in
+parallel on separate cores, which greenlets cannot do.
+'''
+
+
+import threading
+import time
+
+
+class Worker(threading.Thread):
+    """Call a stage's `iterate` method repeatedly on an OS thread
+
+    The stage is any object with an `iterate` method, such as a
+    CameraReader or OculusDriver. Mirrors the Greenlet interface
+    (`start`, `kill`) so it can stand in for a greenlet.
+    """
+    def __init__(self, stage):
+        """Store the stage to drive
+
+        Args:
+            stage: object whose `iterate` method does one unit of work
+        """
+        threading.Thread.__init__(self, name=str(stage))
+        self.daemon = True
+        self.stage = stage
+        self.stopped = threading.Event()
+
+    def run(self):
+        """Thread method; loop until killed"""
+        while not self.stopped.is_set():
+            self.stage.iterate()
+
+    def kill(self, block=True, timeout=None):
+        """Stop the thread after its current iteration
+
+        Args:
+            block (boolean): wait for the thread to finish, as
+                Greenlet.kill does
+            timeout (float): seconds to wait, if blocking
+        """
+        self.stopped.set()
+        if block and threading.current_thread() is not self:
+            self.join(timeout)
+
+    def __str__(self):
+        return 'Worker for {}'.format(self.stage)
+
+
+class Ticker(object):
+    """Pace a periodic task at a fixed rate, sleeping between ticks
+
+    Sleeps through `time.sleep`, looked up on every call, so under
+    gevent's monkey patching the wait yields to other greenlets rather
+    than blocking them. A tick that comes more than an interval late
+    is counted in `late`, and the schedule restarts from it rather
+    than bursting to catch up.
+    """
+    def __init__(self, rate):
+        """
+        Args:
+            rate (float): ticks per second; unpaced if None or 0
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self.due = None
+        self.late = 0
+
+    def wait(self):
+        """Sleep until the next tick is due"""
+        now = time.time()
+        if self.due is None:
+            self.due = now
+        if self.due > now:
+            time.sleep(self.due - now)
+        elif now - self.due > self.interval:
+            self.late += 1
+        self.due = max(self.due + self.interval, now - self.interval)
+
+    @property
+    def rate(self):
+        return 1.0 / self.interval if self.interval else 0
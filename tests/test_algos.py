@@ -1,6 +1,10 @@
 from unittest import TestCase
 import numpy as np
-from StringIO import StringIO
+import cv2
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
 import sys
 
 from src.algos import *
@@ -55,6 +59,189 @@ class TestAlgos(TestCase):
         )
 
 
+    def test_create_remap(self):
+        Parameters.width, Parameters.height = 120, 80
+        input = np.random.randint(0, 255, (80, 120, 3)).astype(np.uint8)
+        input = cv2.GaussianBlur(input, (7, 7), 3)
+        mat = create_distortion_matrix(60, 55, 80, 45)
+        crops = 5, 10, 3, 7
+
+        expected = translate(input, 4, -6)
+        expected = transform(expected, mat)
+        expected = translate(expected, -8, 2)
+        expected = crop(expected, *crops)
+
+        map1, map2 = create_remap(mat, (4, -6), (-8, 2), crops)
+        result = cv2.remap(input, map1, map2, cv2.INTER_LINEAR)
+
+        self.assertEqual(result.shape, expected.shape)
+        difference = np.abs(result.astype(int) - expected)
+        self.assertTrue((difference > 2).mean() < 0.01)
+
+    def test_create_remap_scaled(self):
+        Parameters.width, Parameters.height = 120, 80
+        input = np.random.randint(0, 255, (80, 120, 3)).astype(np.uint8)
+        input = cv2.GaussianBlur(input, (15, 15), 5)
+        mat = create_distortion_matrix(60, 55, 80, 45)
+        crops = 0, 0, 0, 0
+
+        full = cv2.remap(input, *create_remap(mat, (0, 0), (0, 0), crops),
+                         interpolation=cv2.INTER_LINEAR)
+        maps = create_remap(mat, (0, 0), (0, 0), crops, scale=0.5)
+        result = cv2.remap(input, *maps, interpolation=cv2.INTER_LINEAR)
+
+        rows, columns = full.shape[:2]
+        self.assertEqual(result.shape, (rows // 2, columns // 2, 3))
+        expected = cv2.resize(full, result.shape[1::-1],
+                              interpolation=cv2.INTER_AREA)
+        difference = np.abs(result.astype(int) - expected)
+        self.assertTrue((difference > 8).mean() < 0.05)
+
+    def test_remap_engine(self):
+        Parameters.width, Parameters.height = 120, 80
+        input = np.zeros((80, 120, 3), dtype=np.uint8)
+        engine = RemapEngine()
+
+        result = engine.apply(input)
+        maps = engine.maps
+        self.assertEqual(result.ndim, 3)
+
+        engine.apply(input)
+        self.assertTrue(engine.maps is maps)
+
+        Parameters.xo2 += 10
+        engine.apply(input)
+        self.assertFalse(engine.maps is maps)
+        Parameters.xo2 -= 10
+
+    def test_remap_engine_eyes(self):
+        Parameters.width, Parameters.height = 720, 480
+        input = np.random.randint(0, 255, (480, 720, 3)).astype(np.uint8)
+        left, right = RemapEngine(), RemapEngine(eye='right')
+        left.registry = right.registry = registry = MapRegistry()
+
+        self.assertTrue(np.array_equal(left.apply(input), right.apply(input)))
+        self.assertTrue(left.maps is right.maps)
+        self.assertFalse(left.maps[0].flags.writeable)
+        self.assertEqual(len(registry), 1)
+
+        Parameters.xR += 10
+        try:
+            shifted = right.apply(input)
+            self.assertFalse(left.maps is right.maps)
+            self.assertEqual(len(registry), 2)
+            self.assertFalse(np.array_equal(shifted, left.apply(input)))
+        finally:
+            Parameters.xR -= 10
+        right.apply(input)
+        self.assertTrue(left.maps is right.maps)
+        self.assertEqual(len(registry), 1)
+
+        left.release()
+        right.release()
+        self.assertEqual(len(registry), 0)
+
+    def test_remap_engine_modes(self):
+        Parameters.width, Parameters.height = 120, 80
+        input = np.zeros((80, 120, 3), dtype=np.uint8)
+        engine = RemapEngine()
+        full = engine.apply(input)
+
+        Parameters.scale, Parameters.gray = 0.5, 1
+        try:
+            result = engine.apply(input)
+            self.assertEqual(engine.shape(input), result.shape)
+        finally:
+            Parameters.scale, Parameters.gray = 1, 0
+        self.assertEqual(
+            result.shape,
+            (full.shape[0] // 2, full.shape[1] // 2),
+        )
+
+    def test_remap_engine_cache(self):
+        import shutil
+        import tempfile
+        from src.map_cache import MapCache
+        Parameters.width, Parameters.height = 720, 480
+        input = np.random.randint(0, 255, (480, 720, 3)).astype(np.uint8)
+        plain = RemapEngine(margin=8).apply(input, shift=(2, 1))
+
+        directory = tempfile.mkdtemp()
+        try:
+            cache = MapCache(directory)
+            for _ in range(2):
+                # A new registry, as after a restart
+                engine = RemapEngine(margin=8)
+                engine.registry = MapRegistry()
+                engine.cache = cache
+                result = engine.apply(input, shift=(2, 1))
+                self.assertTrue(np.array_equal(result, plain))
+            self.assertEqual((cache.hits, cache.misses), (1, 1))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_remap_engine_shift(self):
+        Parameters.width, Parameters.height = 720, 480
+        input = np.random.randint(0, 255, (480, 720, 3)).astype(np.uint8)
+        plain = RemapEngine().apply(input)
+        engine = RemapEngine(margin=8)
+
+        self.assertTrue(np.array_equal(engine.apply(input), plain))
+        shifted = engine.apply(input, shift=(5, -3))
+        self.assertEqual(shifted.shape, plain.shape)
+        self.assertTrue(np.array_equal(shifted[13:-13, 13:-13],
+                                       plain[10:-16, 18:-8]))
+
+        clamped = engine.apply(input, shift=(50, 0))
+        self.assertTrue(np.array_equal(clamped, engine.apply(
+            input, shift=(8, 0)
+        )))
+
+    def test_remap_engine_chromatic(self):
+        Parameters.width, Parameters.height = 720, 480
+        input = np.random.randint(0, 255, (480, 720, 3)).astype(np.uint8)
+        engine = RemapEngine()
+        plain = engine.apply(input)
+        self.assertTrue(engine.channel_maps is None)
+
+        Parameters.caR, Parameters.caB = 0.05, -0.05
+        try:
+            output = np.zeros((plain.shape[0], 2 * plain.shape[1], 3),
+                              dtype=np.uint8)
+            half = output[:, :plain.shape[1]]
+            result = engine.apply(input, dst=half)
+        finally:
+            Parameters.caR, Parameters.caB = 0, 0
+
+        self.assertEqual(len(engine.channel_maps), 3)
+        self.assertEqual(result.shape, plain.shape)
+        self.assertTrue(np.array_equal(half, result))
+        self.assertTrue(np.array_equal(result[..., 1], plain[..., 1]))
+        self.assertFalse(np.array_equal(result[..., 2], plain[..., 2]))
+        self.assertFalse(np.array_equal(result[..., 0], plain[..., 0]))
+
+    def test_composite_buffer(self):
+        composite = CompositeBuffer()
+        left = composite.half(0, (10, 20, 3), np.uint8)
+        right = composite.half(1, (10, 20, 3), np.uint8)
+        right[...] = 1
+
+        self.assertEqual(composite.image.shape, (10, 40, 3))
+        self.assertTrue(composite.contains(left))
+        self.assertEqual(composite.image[:, 20:].min(), 1)
+        self.assertEqual(composite.image[:, :20].max(), 0)
+        self.assertFalse(composite.contains(np.zeros((10, 20, 3))))
+
+    def test_composite_buffer_scaled(self):
+        composite = CompositeBuffer()
+        composite.half(0, (10, 20), np.uint8)[...] = 7
+
+        self.assertTrue(composite.scaled(1) is composite.image)
+        full = composite.scaled(0.5)
+        self.assertEqual(full.shape, (20, 80))
+        self.assertTrue(full is composite.upscaled)
+        self.assertEqual(full[:, :38].min(), 7)
+
     def test_join_images(self):
         l_part = [1, 2]
         r_part = [3, 4]
@@ -113,3 +300,37 @@ class TestAlgos(TestCase):
             self.assertTrue(
                 getattr(Parameters, parameter)
             )
+
+    def test_parameter_store(self):
+        store = ParameterStore(
+            dict(crop=dict(cropXL=0), offsets=dict(xo=20)),
+            validators=dict(cropXL=at_least(0)),
+            key_mappings=dict(xo=('.', ',')),
+        )
+        changes = []
+        store.subscribe(lambda *change: changes.append(change), 'offsets')
+
+        self.assertEqual(dir(store), ['cropXL', 'key_mappings', 'xo'])
+        self.assertEqual(store.versions('crop', 'offsets'), (0, 0))
+
+        store.xo = 30
+        store.xo = 30
+        store.cropXL = 10
+        self.assertEqual(store.xo, 30)
+        self.assertEqual(store.versions('crop', 'offsets'), (1, 1))
+        self.assertEqual(changes, [('offsets', 'xo', 30)])
+        self.assertEqual(store.values(), dict(cropXL=10, xo=30))
+
+    def test_parameter_store_validation(self):
+        store = ParameterStore(
+            dict(crop=dict(cropXL=0)),
+            validators=dict(cropXL=at_least(0)),
+        )
+        with self.assertRaises(ValueError):
+            store.cropXL = -10
+        self.assertEqual(store.cropXL, 0)
+        self.assertEqual(store.version('crop'), 0)
+        with self.assertRaises(AttributeError):
+            store.nothing = 1
+        with self.assertRaises(AttributeError):
+            store.nothing
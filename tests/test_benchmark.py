@@ -0,0 +1,31 @@
+from unittest import TestCase
+
+from src.benchmark import compare, summarize, bench_modes, bench_pipeline
+
+class TestBenchmark(TestCase):
+
+    def test_summarize(self):
+        result = summarize([0.003, 0.001, 0.002])
+        self.assertAlmostEqual(result['ms'], 2)
+        self.assertAlmostEqual(result['max_ms'], 3)
+        self.assertEqual(result['samples'], 3)
+
+    def test_compare(self):
+        baseline = dict(fast=dict(ms=1.0), slow=dict(ms=1.0))
+        results = dict(
+            fast=dict(ms=1.1),
+            slow=dict(ms=1.5),
+            new=dict(ms=9.0),
+        )
+
+        regressions = compare(results, baseline, 0.2)
+        self.assertEqual(regressions, [('slow', 1.0, 1.5)])
+
+    def test_bench_pipeline(self):
+        result = bench_pipeline('ntsc', 'gevent', 3)
+        self.assertTrue(result['fps'] > 0)
+
+    def test_bench_modes(self):
+        results = bench_modes('ntsc', 2)
+        self.assertEqual(results['full']['relative'], 1)
+        self.assertTrue(results['half-gray']['fps'] > 0)
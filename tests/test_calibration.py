@@ -0,0 +1,178 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+import cv2
+
+from src.algos import (
+    create_distortion_matrix,
+    create_remap,
+    MapRegistry,
+    Parameters,
+    RemapEngine,
+)
+from src.calibration import (
+    CalibrationProfile,
+    calibrate,
+    file_pairs,
+    find_corners,
+)
+
+SIZE = (640, 480)
+MATRIX = np.array([[500.0, 0, 320], [0, 500, 240], [0, 0, 1]])
+PATTERN = (9, 6)
+# Pixels per board square in the board texture
+SQUARE = 40
+BASELINE = 2.0
+
+def board():
+    """Chessboard texture with PATTERN inner corners and a white border"""
+    columns, rows = PATTERN[0] + 3, PATTERN[1] + 3
+    texture = np.full((rows * SQUARE, columns * SQUARE), 255, np.uint8)
+    for row in range(1, rows - 1):
+        for column in range(1, columns - 1):
+            if (row + column) % 2:
+                texture[row * SQUARE:(row + 1) * SQUARE,
+                        column * SQUARE:(column + 1) * SQUARE] = 0
+    return texture
+
+def render(texture, rotation, translation):
+    """The board as seen by a camera, with the board at a pose"""
+    rotation = cv2.Rodrigues(np.array(rotation, dtype=np.float64))[0]
+    extrinsic = np.column_stack([
+        rotation[:, 0], rotation[:, 1], translation
+    ])
+    homography = MATRIX.dot(extrinsic).dot(
+        np.diag([1.0 / SQUARE, 1.0 / SQUARE, 1])
+    )
+    return cv2.warpPerspective(texture, homography, SIZE, borderValue=255)
+
+def pairs():
+    """Left and right views of the board at several poses"""
+    texture = board()
+    center = np.array([PATTERN[0] + 3, PATTERN[1] + 3, 0]) / 2.0
+    result = []
+    for rotation in [
+            (0, 0, 0), (0.3, 0, 0), (-0.3, 0, 0), (0, 0.3, 0),
+            (0, -0.3, 0), (0.2, 0.2, 0.1), (-0.2, 0.25, -0.1),
+            (0.25, -0.2, 0.2)]:
+        matrix = cv2.Rodrigues(np.array(rotation, dtype=np.float64))[0]
+        translation = np.array([0, 0, 22.0]) - matrix.dot(center)
+        result.append(tuple(
+            cv2.cvtColor(render(texture, rotation, translation + offset),
+                         cv2.COLOR_GRAY2BGR)
+            for offset in [np.zeros(3), np.array([-BASELINE, 0, 0])]
+        ))
+    return result
+
+class TestCalibration(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pairs = pairs()
+        cls.profile = calibrate(cls.pairs, PATTERN)
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_find_corners(self):
+        corners = find_corners(self.pairs[0][0], PATTERN)
+        self.assertEqual(len(corners), PATTERN[0] * PATTERN[1])
+        self.assertTrue(find_corners(np.zeros((480, 640), np.uint8),
+                                     PATTERN) is None)
+
+    def test_calibrate(self):
+        profile = self.profile
+        self.assertEqual(profile.pairs, len(self.pairs))
+        self.assertLess(profile.rms, 0.5)
+        for eye in ['left', 'right']:
+            matrix = profile.camera(eye)['matrix']
+            self.assertAlmostEqual(matrix[0, 0] / 500.0, 1, places=1)
+            self.assertAlmostEqual(matrix[0, 2] / 320.0, 1, places=1)
+        self.assertAlmostEqual(profile.baseline(), BASELINE, places=1)
+
+    def test_too_few(self):
+        blank = np.zeros((480, 640, 3), np.uint8)
+        with self.assertRaises(ValueError):
+            calibrate([(blank, blank)] * 3, PATTERN)
+
+    def test_save_load(self):
+        path = os.path.join(self.directory, 'profile.json')
+        self.profile.save(path)
+        profile = CalibrationProfile.load(path)
+        self.assertEqual(profile.size, SIZE)
+        self.assertEqual(profile.values('right'),
+                         self.profile.values('right'))
+        self.assertNotEqual(profile.values('left'), profile.values('right'))
+
+    def test_rectify_maps(self):
+        map_x, _ = self.profile.rectify_maps('left', SIZE)
+        self.assertEqual(map_x.shape, (480, 640))
+        half_x, _ = self.profile.rectify_maps('left', (320, 240))
+        self.assertEqual(half_x.shape, (240, 320))
+        self.assertAlmostEqual(half_x[120, 160] * 2, map_x[240, 320],
+                               places=0)
+
+    def test_rectified_rows_match(self):
+        """Rectified, the board's corners are on the same rows in both
+        eyes"""
+        rows = []
+        for eye, image in zip(['left', 'right'], self.pairs[5]):
+            map_x, map_y = self.profile.rectify_maps(eye, SIZE)
+            rectified = cv2.remap(image, map_x, map_y, cv2.INTER_LINEAR)
+            rows.append(find_corners(rectified, PATTERN).reshape(-1, 2)[:, 1])
+        self.assertLess(np.abs(rows[0] - rows[1]).max(), 1.0)
+
+    def test_combined_remap(self):
+        """The rectification is folded into the runtime map"""
+        Parameters.width, Parameters.height = SIZE
+        matrix = create_distortion_matrix(270, 330, 360, 250)
+        arguments = matrix, (20, 0), (-90, 30), (0, 160, 0, 0)
+        plain = create_remap(*arguments)
+
+        identity = np.float32(np.mgrid[0:480, 0:640])
+        combined = create_remap(*arguments, rectify=(identity[1],
+                                                     identity[0]))
+        # Identical but for the pixels on the edge of the frame
+        difference = np.abs(combined[0].astype(int) - plain[0]).max(2)
+        self.assertLess((difference > 1).mean(), 0.02)
+
+        rectify = self.profile.rectify_maps('left', SIZE)
+        image = self.pairs[0][0]
+        expected = cv2.remap(
+            cv2.remap(image, rectify[0], rectify[1], cv2.INTER_LINEAR),
+            plain[0], plain[1], cv2.INTER_LINEAR,
+        )
+        maps = create_remap(*arguments, rectify=rectify)
+        result = cv2.remap(image, maps[0], maps[1], cv2.INTER_LINEAR)
+        self.assertEqual(result.shape, expected.shape)
+        self.assertLess(
+            np.abs(result.astype(int) - expected).mean(), 4
+        )
+
+    def test_engine_profile(self):
+        Parameters.width, Parameters.height = SIZE
+        engines = [RemapEngine(eye=eye) for eye in ['left', 'right']]
+        registry = MapRegistry()
+        for engine in engines:
+            engine.registry = registry
+            engine.profile = self.profile
+            self.assertEqual(engine.apply(self.pairs[0][0]).ndim, 3)
+        self.assertEqual(len(registry), 2)
+        self.assertFalse(np.array_equal(engines[0].maps[0],
+                                        engines[1].maps[0]))
+
+    def test_file_pairs(self):
+        for index, pair in enumerate(self.pairs[:3]):
+            for eye, image in zip(['left', 'right'], pair):
+                cv2.imwrite(os.path.join(
+                    self.directory, '{}-{}.png'.format(eye, index)
+                ), image)
+        result = file_pairs(os.path.join(self.directory, 'left-*.png'),
+                            os.path.join(self.directory, 'right-*.png'))
+        self.assertEqual(len(result), 3)
+        self.assertTrue(np.array_equal(result[2][1], self.pairs[2][1]))
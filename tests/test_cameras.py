@@ -1,8 +1,21 @@
 from unittest import TestCase
+import gevent
 from gevent import queue
-from src.camera import CameraReader, CameraProcessor
+from src.camera import (
+    CameraReader,
+    CameraProcessor,
+    InputHandler,
+    OculusDriver,
+    Parameters,
+)
+from src.mailbox import Mailbox
+from src.pairing import Frame
+from src.pose import Pose, PoseBuffer, Timewarp
+from src.sinks import NullSink
 from mock import Mock, patch
 import numpy as np
+import threading
+import time
 
 class TestCameras(TestCase):
 
@@ -32,21 +45,225 @@ class TestCameras(TestCase):
         self.assertFalse(self.left_queue.empty())
         result = self.left_queue.get()
         self.assertIsInstance(
-            result,
+            result.image,
             np.ndarray,
         )
+        self.assertTrue(result.timestamp > 0)
+
+    def test_camera_reader_store(self):
+        camera_reader = CameraReader(Mock(), self.left_queue)
+        camera_reader.store = Mock()
+        frame = np.random.rand(100, 100, 3)
+        camera_reader.camera.read = Mock(return_value=(True, frame))
+
+        camera_reader.iterate()
+
+        result = self.left_queue.get()
+        camera_reader.store.append.assert_called_once_with(
+            result.timestamp, frame
+        )
+
+    def test_camera_reader_eye(self):
+        camera_reader = CameraReader(Mock(), self.right_queue, 1)
+        self.assertEqual(camera_reader.eye, 'right')
+        self.assertEqual(camera_reader.engine.eye, 'right')
+
+        self.camera_processor.attach(camera_reader, 0)
+        self.assertEqual(camera_reader.engine.eye, 'left')
 
     def test_camera_processor_initialize(self):
-        self.assertFalse(self.camera_processor.video_out)
+        self.assertFalse(self.camera_processor.recorder)
 
     @patch('cv2.imshow')
     def test_camera_processor_iterate(self, imshow_mock):
 
         left_frame = np.random.rand(100, 100, 3)
         right_frame = np.random.rand(100, 100, 3)
-        self.left_queue.put(left_frame)
-        self.right_queue.put(right_frame)
+        self.left_queue.put(Frame(1.0, left_frame))
+        self.right_queue.put(Frame(1.01, right_frame))
 
         self.camera_processor.iterate()
 
         imshow_mock.assert_called_once
+        self.assertTrue(self.left_queue.empty())
+        self.assertAlmostEqual(self.camera_processor.pairer.skew, -0.01)
+
+    @patch('cv2.imshow')
+    def test_camera_processor_unpaired(self, imshow_mock):
+        self.left_queue.put(Frame(1.0, np.random.rand(100, 100, 3)))
+
+        self.camera_processor.iterate()
+
+        self.assertFalse(imshow_mock.called)
+
+    @patch('cv2.imshow')
+    def test_camera_processor_composite(self, imshow_mock):
+        camera_reader = CameraReader(Mock(), Mailbox())
+        self.camera_processor.attach(camera_reader, 1)
+
+        frame = np.random.rand(100, 100, 3)
+        returns = [(None, frame), IOError]
+        camera_reader.camera.read = Mock(side_effect=returns)
+
+        with self.assertRaises(IOError):
+            camera_reader._run()
+
+        result = camera_reader.queue.get()
+        self.assertTrue(
+            self.camera_processor.composite.contains(result.image)
+        )
+
+    def test_camera_processor_deep_queue(self):
+        """Frames queued behind one another have their own buffers"""
+        camera_reader = CameraReader(Mock(), Mailbox(2))
+        self.camera_processor.attach(camera_reader, 0)
+        camera_reader.camera.read = Mock(side_effect=[
+            (None, np.full((100, 100, 3), value, np.uint8))
+            for value in [1, 2]
+        ])
+        camera_reader.iterate()
+        camera_reader.iterate()
+
+        first, second = camera_reader.queue.get(), camera_reader.queue.get()
+        self.assertFalse(
+            self.camera_processor.composite.contains(first.image)
+        )
+        self.assertFalse(np.shares_memory(first.image, second.image))
+
+    def test_camera_processor_sink(self):
+        sink = NullSink()
+        processor = CameraProcessor(
+            self.left_queue,
+            self.right_queue,
+            sink=sink,
+        )
+        self.left_queue.put(Frame(1.0, np.random.rand(100, 100, 3)))
+        self.right_queue.put(Frame(1.0, np.random.rand(100, 100, 3)))
+
+        processor.iterate()
+
+        self.assertEqual(sink.frames, 1)
+        self.assertTrue('display' in processor.timings.summary())
+
+    @patch('src.camera.po')
+    def test_oculus_driver_changes_only(self, pololu):
+        pololu.set_targets.return_value = 7
+        driver = OculusDriver(Mock(), rate=None, step=2, refresh=60)
+
+        driver.update([90, 44])
+        driver.update([90.4, 44.6])
+        driver.update([90, 48])
+
+        self.assertEqual(pololu.set_targets.call_count, 2)
+        pololu.set_targets.assert_called_with(driver.servo, 0, [90, 48])
+        self.assertEqual(driver.skipped, 1)
+        self.assertEqual(driver.written, 14)
+
+    @patch('src.camera.po')
+    def test_oculus_driver_refresh(self, pololu):
+        driver = OculusDriver(Mock(), rate=None, refresh=0)
+        driver.update([90, 45])
+        driver.update([90, 45])
+        self.assertEqual(driver.sent, 2)
+
+    @patch('src.camera.po')
+    def test_oculus_driver_follows_poses(self, pololu):
+        poses = PoseBuffer()
+        driver = OculusDriver(poses, rate=None)
+        driver.setup()
+        driver.iterate()
+        self.assertEqual(driver.sent, 1)
+
+        poses.add(Pose(1.0, 0.7, -0.7, 0, 0.2))
+        driver.iterate()
+        pololu.set_targets.assert_called_with(driver.servo, 0, [165, 180])
+
+    @patch('src.camera.po')
+    def test_oculus_driver_sleeps_cooperatively(self, pololu):
+        """The pacing sleep is `time.sleep` as patched after import, as
+        gevent's monkey patching does, so it yields to other greenlets"""
+        driver = OculusDriver(PoseBuffer(), rate=10)
+        driver.setup()
+        with patch('time.sleep') as sleep:
+            driver.iterate()
+            driver.iterate()
+        self.assertEqual(sleep.call_count, 1)
+        self.assertGreater(sleep.call_args[0][0], 0)
+
+    def test_camera_processor_timewarp(self):
+        timewarp = Timewarp(PoseBuffer(), margin=16)
+        processor = CameraProcessor(self.left_queue, self.right_queue,
+                                    timewarp=timewarp, sink=NullSink())
+        camera_reader = CameraReader(Mock(), self.left_queue)
+        processor.attach(camera_reader, 0)
+        self.assertTrue(camera_reader.timewarp is timewarp)
+        self.assertEqual(camera_reader.engine.margin, 16)
+
+    def test_camera_processor_greenlet(self):
+        """A running processor can be killed and joined, with or
+        without a ready event"""
+        for ready in [None, threading.Event()]:
+            processor = CameraProcessor(Mailbox(ready=ready),
+                                        Mailbox(ready=ready),
+                                        sink=NullSink(), ready=ready,
+                                        timeout=0.01)
+            processor.start()
+            gevent.sleep(0.02)
+            self.assertFalse(processor.ready())
+            processor.kill()
+            gevent.joinall([processor], timeout=1)
+            self.assertTrue(processor.dead)
+
+    def test_camera_processor_waits(self):
+        ready = threading.Event()
+        left, right = Mailbox(ready=ready), Mailbox(ready=ready)
+        sink = NullSink()
+        processor = CameraProcessor(left, right, sink=sink, ready=ready,
+                                    timeout=0.05)
+        start = time.time()
+        processor.iterate()
+        self.assertGreater(time.time() - start, 0.04)
+        self.assertEqual(sink.frames, 0)
+
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        left.put(Frame(1.0, image))
+        right.put(Frame(1.0, image))
+        start = time.time()
+        processor.iterate()
+        self.assertLess(time.time() - start, 0.04)
+        self.assertEqual(sink.frames, 1)
+        self.assertFalse(ready.is_set())
+
+    def test_input_handler_paced(self):
+        handler = InputHandler(Mock(), rate=100)
+        handler.handle_input = Mock(side_effect=[None, None, None, IOError])
+        start = time.time()
+        with self.assertRaises(IOError):
+            handler._run()
+        self.assertGreater(time.time() - start, 0.015)
+
+    @patch('cv2.waitKey')
+    def test_input_handler_key(self, wait_key):
+        """A mapped key changes every parameter bound to it"""
+        handler = InputHandler(Mock())
+        values = Parameters.fxL, Parameters.fxR
+        wait_key.return_value = ord('f')
+        try:
+            handler.handle_input()
+            self.assertEqual(Parameters.fxL, values[0] + 10)
+            self.assertEqual(Parameters.fxR, values[1] + 10)
+        finally:
+            Parameters.fxL, Parameters.fxR = values
+        self.assertFalse(handler.callback.called)
+
+    def test_input_handler_change(self):
+        handler = InputHandler(Mock())
+        crop = Parameters.cropXL
+        Parameters.cropXL = 5
+        try:
+            handler.change('cropXL', -10)
+            self.assertEqual(Parameters.cropXL, 5)
+            handler.change('cropXL', 10)
+            self.assertEqual(Parameters.cropXL, 15)
+        finally:
+            Parameters.cropXL = crop
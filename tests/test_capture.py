@@ -0,0 +1,43 @@
+from unittest import TestCase
+from mock import Mock
+
+from src.capture import (
+    capture_property,
+    configure_capture,
+    StereoCapture,
+)
+
+class TestCapture(TestCase):
+
+    def setUp(self):
+        self.cameras = [Mock(), Mock()]
+        for index, camera in enumerate(self.cameras):
+            camera.retrieve.return_value = (True, index)
+        self.stereo = StereoCapture(self.cameras, timeout=0.01)
+
+    def test_configure_capture(self):
+        camera = Mock()
+        camera.set.return_value = True
+
+        configure_capture(camera, buffer_size=1, size=(640, 480))
+
+        camera.set.assert_any_call(capture_property('FRAME_WIDTH'), 640)
+        camera.set.assert_any_call(capture_property('FRAME_HEIGHT'), 480)
+
+    def test_stereo_capture(self):
+        left, right = self.stereo.eyes
+
+        self.assertEqual(left.read(), (True, 0))
+        self.assertEqual(right.read(), (True, 1))
+        self.assertEqual(left.read(), (True, 0))
+
+        for camera in self.cameras:
+            self.assertEqual(camera.grab.call_count, 2)
+        self.assertEqual(self.cameras[0].retrieve.call_count, 2)
+        self.assertEqual(self.cameras[1].retrieve.call_count, 1)
+
+    def test_stereo_capture_timeout(self):
+        left, _ = self.stereo.eyes
+
+        left.read()
+        self.assertEqual(left.read(), (False, None))
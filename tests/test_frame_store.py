@@ -0,0 +1,59 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from src.frame_store import FrameStore
+
+class TestFrameStore(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.base = os.path.join(self.directory, 'left')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def record(self, count, capacity=8):
+        store = FrameStore(self.base, capacity)
+        for index in range(count):
+            frame = np.full((6, 10, 3), index, dtype=np.uint8)
+            store.append(index / 10.0, frame)
+        return store
+
+    def test_append(self):
+        store = self.record(3)
+        self.assertEqual(len(store), 3)
+        timestamp, frame = store[1]
+        self.assertAlmostEqual(timestamp, 0.1)
+        self.assertTrue((frame == 1).all())
+        self.assertTrue((store[-1][1] == 2).all())
+        with self.assertRaises(IndexError):
+            store[3]
+
+    def test_full(self):
+        store = self.record(10, capacity=8)
+        self.assertEqual(len(store), 8)
+        self.assertEqual(store.dropped, 2)
+
+    def test_open(self):
+        store = self.record(5)
+        store.close()
+        del store
+
+        store = FrameStore.open(self.base)
+        self.assertEqual(len(store), 5)
+        self.assertEqual(store.frames.shape[1:], (6, 10, 3))
+        self.assertEqual(store.frames.dtype, np.uint8)
+        self.assertTrue((store[4][1] == 4).all())
+
+    def test_at(self):
+        store = self.record(5)
+        self.assertEqual(store.find(-1), 0)
+        self.assertEqual(store.find(0.12), 1)
+        self.assertEqual(store.find(0.18), 2)
+        self.assertEqual(store.find(9), 4)
+        timestamp, frame = store.at(0.31)
+        self.assertAlmostEqual(timestamp, 0.3)
+        self.assertTrue((frame == 3).all())
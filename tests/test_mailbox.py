@@ -0,0 +1,80 @@
+from unittest import TestCase
+import threading
+import time
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+from src.mailbox import Mailbox, ThreadMailbox
+from src.recorder import start_new_thread
+
+class TestMailbox(TestCase):
+
+    def test_latest_wins(self):
+        mailbox = Mailbox()
+        mailbox.put(1)
+        mailbox.put(2)
+
+        self.assertEqual(mailbox.qsize(), 1)
+        self.assertEqual(mailbox.dropped, 1)
+        self.assertEqual(mailbox.get_nowait(), 2)
+        self.assertTrue(mailbox.empty())
+
+    def test_depth(self):
+        mailbox = Mailbox(3)
+        for item in range(5):
+            mailbox.put(item)
+
+        self.assertEqual(mailbox.dropped, 2)
+        self.assertEqual(
+            [mailbox.get_nowait() for _ in range(3)],
+            [2, 3, 4],
+        )
+
+    def test_empty(self):
+        mailbox = Mailbox()
+        with self.assertRaises(Empty):
+            mailbox.get_nowait()
+        with self.assertRaises(Empty):
+            mailbox.get(timeout=0.01)
+
+    def test_ready(self):
+        ready = threading.Event()
+        left, right = Mailbox(ready=ready), Mailbox(ready=ready)
+        left.put(1)
+        self.assertTrue(ready.is_set())
+        ready.clear()
+        right.put(2)
+        self.assertTrue(ready.wait(0))
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            Mailbox(0)
+
+    def test_thread_mailbox(self):
+        mailbox = ThreadMailbox()
+        mailbox.put(1)
+        mailbox.put(2)
+        self.assertEqual(mailbox.dropped, 1)
+        self.assertEqual(mailbox.get(), 2)
+        with self.assertRaises(Empty):
+            mailbox.get(timeout=0.01)
+
+    def test_thread_mailbox_wakes_threads(self):
+        """Consumers on real OS threads block until an item or close"""
+        mailbox = ThreadMailbox()
+        results = ThreadMailbox(4)
+
+        def consume():
+            results.put(mailbox.get())
+        for _ in range(3):
+            start_new_thread(consume, ())
+        time.sleep(0.05)
+        self.assertTrue(results.empty())
+
+        mailbox.put(1)
+        self.assertEqual(results.get(timeout=5), 1)
+        mailbox.close()
+        self.assertEqual([results.get(timeout=5) for _ in range(2)],
+                         [None, None])
@@ -0,0 +1,77 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+from mock import Mock, patch
+
+from src.map_cache import MapCache, cache_key
+
+class TestMapCache(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def maps(self, value):
+        return (
+            np.full((4, 5, 2), value, dtype=np.int16),
+            np.full((4, 5), value, dtype=np.uint16),
+        )
+
+    def test_key(self):
+        self.assertEqual(cache_key((1, 2.5)), cache_key((1, 2.5)))
+        self.assertNotEqual(cache_key((1, 2.5)), cache_key((1, 2.6)))
+
+    def test_miss_then_hit(self):
+        cache = MapCache(self.directory)
+        build = Mock(return_value=self.maps(3))
+        first = cache.get((720, 480, 0.22), build)
+        self.assertTrue((first[0] == 3).all())
+
+        # A new cache (e.g. after a restart) maps the saved arrays in
+        cache = MapCache(self.directory)
+        second = cache.get((720, 480, 0.22), build)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+        self.assertIsInstance(second[0], np.memmap)
+        self.assertTrue((second[0] == first[0]).all())
+        self.assertEqual(second[1].dtype, np.uint16)
+
+    def test_corrupt(self):
+        cache = MapCache(self.directory)
+        cache.get((1, ), lambda: self.maps(1))
+        path = cache.paths(cache_key((1, )), 2)[0]
+        with open(path, 'wb') as output:
+            output.write(b'not a map')
+        maps = cache.get((1, ), lambda: self.maps(2))
+        self.assertTrue((maps[0] == 2).all())
+        self.assertEqual(cache.misses, 2)
+
+    def test_evicted_while_loading(self):
+        """The other eye's process evicting an entry mid-load is a miss"""
+        cache = MapCache(self.directory)
+        cache.get((1, ), lambda: self.maps(1))
+        with patch('os.utime', Mock(side_effect=OSError)):
+            maps = cache.get((1, ), lambda: self.maps(2))
+        self.assertTrue((maps[0] == 2).all())
+        self.assertEqual(cache.misses, 2)
+
+    def test_evicts_least_recently_used(self):
+        cache = MapCache(self.directory)
+        for value in range(3):
+            cache.get((value, ), lambda: self.maps(value))
+        size = sum(entry[1][1] for entry in cache.entries())
+        for index, value in enumerate([1, 0, 2]):
+            for path in cache.paths(cache_key((value, )), 2):
+                os.utime(path, (index, index))
+
+        cache.limit = size * 2 // 3
+        cache.evict()
+        build = Mock(return_value=self.maps(1))
+        cache.get((1, ), build)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(len(cache.entries()), 2)
+        self.assertEqual(len(os.listdir(self.directory)), 4)
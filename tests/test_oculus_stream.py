@@ -13,9 +13,58 @@ class TestOculusStream(TestCase):
     @patch('src.oculus_stream.CameraProcessor')
     @patch('src.oculus_stream.CameraReader')
     @patch('src.oculus_stream.cv2')
-    def test_run(self, opencv, camera, processor, parser, handler, gevent):
+    @patch('src.oculus_stream.open_source')
+    def test_run(self, source, opencv, camera, processor, parser, handler,
+                 gevent):
         camera.isOpened.return_value = True
         parser.oculus = False
+        parser.queue_depth = 1
+        parser.fourcc = None
+        parser.raw = None
+        parser.scale = 1
+        parser.gray = False
+        parser.map_cache = None
+        parser.profile = None
+        parser.stream = parser.stream_raw = None
         gevent.joinall.side_effect = IOError
         with self.assertRaises(IOError):
             run()
+
+    @patch('src.oculus_stream.gevent')
+    @patch('src.oculus_stream.InputHandler')
+    @patch('src.oculus_stream.args')
+    @patch('src.oculus_stream.CameraProcessor')
+    @patch('src.oculus_stream.CameraReader')
+    @patch('src.oculus_stream.cv2')
+    @patch('src.oculus_stream.open_source')
+    def test_run_input_per_frame(self, source, opencv, camera, processor,
+                                 parser, handler, gevent):
+        """Under gevent, input is handled (and HighGUI painted) after
+        every displayed frame until the application is closed"""
+        camera.isOpened.return_value = True
+        parser.oculus = False
+        parser.queue_depth = 1
+        parser.fourcc = None
+        parser.raw = None
+        parser.scale = 1
+        parser.gray = False
+        parser.map_cache = None
+        parser.profile = None
+        parser.timings = None
+        parser.write = None
+        parser.stream = parser.stream_raw = None
+        run()
+
+        calls = []
+        processor.return_value.iterate.side_effect = \
+            lambda: calls.append('iterate')
+
+        def handle_input():
+            calls.append('input')
+            if len(calls) == 4:
+                handler.call_args[0][0]()
+        handler.return_value.handle_input.side_effect = handle_input
+
+        display = gevent.spawn.call_args[0][0]
+        display()
+        self.assertEqual(calls, ['iterate', 'input'] * 2)
@@ -0,0 +1,35 @@
+from unittest import TestCase
+
+from src.pairing import Frame, StereoPairer
+
+class TestPairing(TestCase):
+
+    def setUp(self):
+        self.pairer = StereoPairer(tolerance=0.01)
+
+    def test_pair(self):
+        self.pairer.add(0, Frame(1.0, 'left'))
+        self.assertEqual(self.pairer.pair(), None)
+
+        self.pairer.add(1, Frame(1.005, 'right'))
+        left, right = self.pairer.pair()
+
+        self.assertEqual((left.image, right.image), ('left', 'right'))
+        self.assertAlmostEqual(self.pairer.skew, -0.005)
+        self.assertEqual(self.pairer.pair(), None)
+
+    def test_stale_orphan(self):
+        self.pairer.add(0, Frame(1.0, 'old left'))
+        self.pairer.add(1, Frame(1.1, 'right'))
+        self.assertEqual(self.pairer.pair(), None)
+        self.assertEqual(self.pairer.orphans, 1)
+
+        self.pairer.add(0, Frame(1.1, 'new left'))
+        left, _ = self.pairer.pair()
+        self.assertEqual(left.image, 'new left')
+
+    def test_replaced(self):
+        self.pairer.add(1, Frame(1.0, 'right'))
+        self.pairer.add(1, Frame(1.1, 'right'))
+        self.assertEqual(self.pairer.orphans, 1)
+        self.assertTrue('orphans = 1' in self.pairer.report())
@@ -0,0 +1,26 @@
+from unittest import TestCase
+from mock import Mock
+
+from src.servo.pololu import encode_target, set_target, set_targets
+
+class TestPololu(TestCase):
+
+    def test_set_targets(self):
+        controller = Mock()
+        written = set_targets(controller, 0, [90, 45])
+
+        cmd = controller.write.call_args[0][0]
+        self.assertEqual(written, 7)
+        self.assertEqual(cmd[:3], chr(0x9F) + chr(2) + chr(0))
+        self.assertEqual(cmd[3:5], encode_target(90))
+        self.assertEqual(cmd[5:], encode_target(45))
+
+    def test_set_target_matches(self):
+        controller = Mock()
+        set_target(controller, 1, 45)
+        cmd = controller.write.call_args[0][0]
+        self.assertEqual(cmd, chr(0x84) + chr(1) + encode_target(45))
+
+    def test_encode_target(self):
+        # 90 degrees is 5750 quarter-microseconds
+        self.assertEqual(encode_target(90), chr(5750 & 0x7f) + chr(5750 >> 7))
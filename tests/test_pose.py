@@ -0,0 +1,124 @@
+from unittest import TestCase
+from mock import Mock, patch
+import numpy as np
+
+from src.pose import (
+    OneEuroFilter,
+    Parameters,
+    Pose,
+    PoseBuffer,
+    PoseFilter,
+    PoseSampler,
+    Timewarp,
+)
+
+class TestPose(TestCase):
+
+    def test_one_euro_constant(self):
+        smooth = OneEuroFilter()
+        for step in range(10):
+            self.assertAlmostEqual(smooth(step / 100.0, 0.3), 0.3)
+        self.assertAlmostEqual(smooth.speed, 0)
+
+    def test_one_euro_smooths_noise(self):
+        noise = np.random.RandomState(1).normal(0, 0.01, 500)
+        smooth = OneEuroFilter(min_cutoff=1.0, beta=0.1)
+        filtered = [smooth(step / 100.0, value)
+                    for step, value in enumerate(noise)]
+        self.assertTrue(np.std(filtered[100:]) < np.std(noise) / 3)
+
+    def test_one_euro_follows_motion(self):
+        smooth = OneEuroFilter(min_cutoff=1.0, beta=10)
+        for step in range(100):
+            value = smooth(step / 100.0, step / 100.0)
+        self.assertAlmostEqual(value, 0.99, places=1)
+        self.assertAlmostEqual(smooth.speed, 1, places=1)
+
+    def test_pose_filter_lead(self):
+        lead = Parameters.poseLead
+        lagging, leading = PoseFilter(axes=1), PoseFilter(axes=1)
+        try:
+            for step in range(200):
+                Parameters.poseLead = 0
+                filtered, = lagging(step / 100.0, [step / 100.0])
+                Parameters.poseLead = 100
+                predicted, = leading(step / 100.0, [step / 100.0])
+        finally:
+            Parameters.poseLead = lead
+        # 100 ms ahead, at 1 unit per second
+        self.assertAlmostEqual(predicted - filtered, 0.1, places=4)
+
+    def test_pose_buffer(self):
+        poses = PoseBuffer(size=4)
+        self.assertTrue(poses.latest() is None)
+        self.assertTrue(poses.at(1.0) is None)
+
+        for step in range(6):
+            poses.add(Pose(float(step), 0, 0.1 * step, 0, 1))
+        self.assertEqual(poses.latest().timestamp, 5)
+        self.assertEqual(len(poses.history()), 3)
+
+        pose = poses.at(4.5)
+        self.assertAlmostEqual(pose.timestamp, 4.5)
+        self.assertTrue(0.4 < pose.y < 0.5)
+        self.assertAlmostEqual(np.linalg.norm(pose[1:]), 1)
+        self.assertEqual(poses.at(0).timestamp, 3)
+        self.assertEqual(poses.at(9).timestamp, 5)
+
+    @patch('src.pose.ovr')
+    def test_pose_sampler(self, ovr):
+        orientation = ovr.ovrHmd_GetSensorState.return_value.Predicted.Pose\
+            .Orientation
+        orientation.x, orientation.y, orientation.z, orientation.w = \
+            0.1, 0.2, 0.3, 0.9
+        poses = PoseBuffer()
+        sampler = PoseSampler(Mock(), poses, rate=1000)
+        for _ in range(3):
+            sampler.iterate()
+
+        self.assertEqual(poses.count, 3)
+        self.assertEqual(poses.latest()[1:], (0.1, 0.2, 0.3, 0.9))
+        times = poses.history()[:, 0]
+        self.assertTrue(times[2] - times[0] > 0.0015)
+
+    @patch('src.pose.ovr')
+    def test_pose_sampler_yields(self, ovr):
+        """The sampler's loop never blocks the gevent hub"""
+        orientation = ovr.ovrHmd_GetSensorState.return_value.Predicted.Pose\
+            .Orientation
+        orientation.x = orientation.y = orientation.z = orientation.w = 0
+        sampler = PoseSampler(Mock(), PoseBuffer(), rate=10)
+        sampler.iterate = Mock(side_effect=[None, None, StopIteration])
+        with patch('time.sleep') as sleep, \
+                patch('src.pose.gevent.sleep') as yield_:
+            with self.assertRaises(StopIteration):
+                sampler._run()
+            sampler.ticker.due = None
+            PoseSampler.iterate(sampler)
+            PoseSampler.iterate(sampler)
+        self.assertEqual(yield_.call_count, 2)
+        self.assertEqual(sleep.call_count, 1)
+
+    def test_timewarp(self):
+        poses = PoseBuffer()
+        timewarp = Timewarp(poses)
+        self.assertTrue(timewarp.shift(1.0) is None)
+
+        warp, fx = Parameters.warp, Parameters.fxR
+        Parameters.warp = 1
+        try:
+            self.assertTrue(timewarp.shift(1.0) is None)
+            poses.add(Pose(0.9, 0, 0, 0, 1))
+            poses.add(Pose(1.0, 0, 0.01, 0, 1))
+            x, y = timewarp.shift(0.9 + Parameters.warpLag / 1000.0)
+            Parameters.fxR = Parameters.fxL * 2
+            right, _ = timewarp.shift(0.9 + Parameters.warpLag / 1000.0,
+                                      'right')
+        finally:
+            Parameters.warp = warp
+            Parameters.fxR = fx
+        self.assertEqual(y, 0)
+        self.assertAlmostEqual(
+            x, Parameters.fxL * Parameters.scale * 0.02, places=3
+        )
+        self.assertAlmostEqual(right, x * 2, places=3)
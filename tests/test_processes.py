@@ -0,0 +1,103 @@
+from unittest import TestCase
+import multiprocessing
+import numpy as np
+
+from src.processes import EyeProcess, SharedFrameRing, parameter_values
+from src.pairing import Frame
+
+def write_frames(ring, count, start=0):
+    for value in range(start, start + count):
+        frame = ring.half(0, (4, 6, 3), np.uint8)
+        frame[...] = value
+        ring.put(Frame(value, frame))
+
+class TestProcesses(TestCase):
+
+    def setUp(self):
+        self.ring = SharedFrameRing(4 * 6 * 3, slots=3)
+
+    def test_ring(self):
+        self.assertTrue(self.ring.empty())
+
+        write_frames(self.ring, 2)
+        self.assertFalse(self.ring.empty())
+
+        result = self.ring.get_nowait()
+        self.assertEqual(result.timestamp, 1)
+        self.assertEqual(result.image.shape, (4, 6, 3))
+        self.assertEqual(result.image.max(), 1)
+        self.assertTrue(self.ring.empty())
+
+    def test_ring_copies(self):
+        write_frames(self.ring, 1)
+        result = self.ring.get_nowait()
+        write_frames(self.ring, 3, start=5)
+        self.assertEqual(result.image.max(), 0)
+
+    def test_ring_torn(self):
+        """A slot rewritten while it is being copied is not returned"""
+        write_frames(self.ring, 2)
+        slot = self.ring.slot
+        laps = []
+
+        def lapped(index, shape):
+            view = slot(index, shape)
+            if not laps:
+                laps.append(index)
+                self.ring.slot = slot
+                write_frames(self.ring, 3, start=7)
+            return view
+        self.ring.slot = lapped
+
+        result = self.ring.get_nowait()
+        self.assertEqual(self.ring.torn, 1)
+        self.assertEqual(result.timestamp, 9)
+        self.assertEqual(result.image.max(), 9)
+        self.assertTrue('1 torn' in self.ring.report())
+
+    def test_ring_ready(self):
+        ready = multiprocessing.Event()
+        ring = SharedFrameRing(4 * 6 * 3, slots=3, ready=ready)
+        process = multiprocessing.Process(
+            target=write_frames,
+            args=(ring, 1),
+        )
+        process.start()
+        self.assertTrue(ready.wait(5))
+        process.join()
+
+    def test_ring_overruns(self):
+        write_frames(self.ring, 5)
+        self.assertEqual(list(self.ring.overruns), [1, 1, 0])
+        self.assertTrue('slot 0 = 1' in self.ring.report())
+
+    def test_ring_too_small(self):
+        with self.assertRaises(ValueError):
+            self.ring.half(0, (10, 10, 3), np.uint8)
+
+    def test_ring_across_processes(self):
+        process = multiprocessing.Process(
+            target=write_frames,
+            args=(self.ring, 3),
+        )
+        process.start()
+        process.join()
+
+        result = self.ring.get_nowait()
+        self.assertEqual(result.image.min(), 2)
+
+    def test_eye_process_failed(self):
+        """A source that cannot be opened fails the process"""
+        process = EyeProcess(
+            dict(kind='file', spec='/nonexistent.avi', realtime=False),
+            self.ring, 0,
+        )
+        self.assertFalse(process.failed)
+        process.start()
+        process.join(10)
+        self.assertTrue(process.failed)
+
+    def test_parameter_values(self):
+        values = parameter_values()
+        self.assertTrue('width' in values)
+        self.assertFalse('key_mappings' in values)
@@ -0,0 +1,54 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+import cv2
+
+from src.recorder import VideoRecorder
+
+class TestRecorder(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'output.avi')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_record(self):
+        recorder = VideoRecorder(self.path, codec='MJPG', warmup=5)
+        image = np.zeros((48, 128, 3), dtype=np.uint8)
+        for index in range(10):
+            image[...] = index * 20
+            recorder.record(index / 10.0, image)
+        recorder.close()
+
+        self.assertAlmostEqual(recorder.fps, 10)
+        self.assertEqual(recorder.written, 10)
+        self.assertEqual(recorder.size, (128, 48))
+
+        video = cv2.VideoCapture(self.path)
+        ok, frame = video.read()
+        self.assertTrue(ok)
+        self.assertEqual(frame.shape, (48, 128, 3))
+
+    def test_real_time(self):
+        recorder = VideoRecorder(self.path, codec='MJPG', fps=10)
+        image = np.zeros((48, 128, 3), dtype=np.uint8)
+        for timestamp in [0, 0.3, 0.31, 0.4]:
+            recorder.record(timestamp, image)
+        recorder.close()
+
+        self.assertEqual(recorder.written, 5)
+        self.assertEqual(recorder.duplicated, 2)
+        self.assertEqual(recorder.skipped, 1)
+
+    def test_dropped(self):
+        recorder = VideoRecorder(self.path, codec='MJPG', depth=2, warmup=2)
+        recorder.close()
+        image = np.zeros((48, 128, 3), dtype=np.uint8)
+        for timestamp in range(3):
+            recorder.record(timestamp, image)
+
+        self.assertEqual(recorder.dropped, 1)
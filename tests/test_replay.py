@@ -0,0 +1,55 @@
+from unittest import TestCase
+import argparse
+import os
+import shutil
+import tempfile
+
+from src.algos import Parameters
+from src.frame_store import FrameStore
+from src.replay import parse_parameter, replay
+from src.sources import SyntheticSource
+
+class TestReplay(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.directory, 'session')
+        size = (Parameters.width, Parameters.height)
+        for index, eye in enumerate(['left', 'right']):
+            store = FrameStore('{}-{}'.format(self.prefix, eye), 8)
+            source = SyntheticSource(size, index=index)
+            for frame in range(5):
+                store.append(10 + frame / 30.0 + index / 1000.0,
+                             source.read()[1])
+            store.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_parameter(self):
+        self.assertEqual(parse_parameter('xo=20'), ('xo', 20))
+        self.assertEqual(parse_parameter('xo=2.5'), ('xo', 2.5))
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_parameter('nothing=1')
+        with self.assertRaises(argparse.ArgumentTypeError):
+            parse_parameter('xo=left')
+
+    def test_replay(self):
+        first = replay(self.prefix)
+        self.assertEqual(first['read'], [5, 5])
+        self.assertEqual(first['frames'], 5)
+        self.assertEqual(first['orphans'], 0)
+        self.assertTrue(first['fps'] > 0)
+
+        second = replay(self.prefix, parameters=dict(xo=Parameters.xo + 10))
+        self.assertEqual(second['frames'], first['frames'])
+
+    def test_replay_restores_parameters(self):
+        xo = Parameters.xo
+        replay(self.prefix, parameters=dict(xo=xo + 10))
+        self.assertEqual(Parameters.xo, xo)
+
+    def test_replay_realtime(self):
+        result = replay(self.prefix, realtime=True)
+        self.assertEqual(result['frames'], 5)
+        self.assertTrue(result['elapsed'] >= 4 / 30.0)
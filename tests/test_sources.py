@@ -0,0 +1,91 @@
+from unittest import TestCase
+import os
+import shutil
+import tempfile
+import numpy as np
+import cv2
+
+from src.capture import fourcc_code
+from src.frame_store import FrameStore
+from src.sources import (
+    device,
+    FrameSource,
+    open_source,
+    SyntheticSource,
+    VideoFileSource,
+)
+
+class TestSources(TestCase):
+
+    def test_abstract(self):
+        with self.assertRaises(TypeError):
+            FrameSource()
+
+    def test_device(self):
+        self.assertEqual(device('1'), 1)
+        self.assertEqual(device('left.avi'), 'left.avi')
+
+    def test_synthetic(self):
+        source = SyntheticSource((64, 48))
+        ok, first = source.read()
+        first = first.copy()
+
+        self.assertTrue(ok)
+        self.assertEqual(first.shape, (48, 64, 3))
+        self.assertFalse(np.array_equal(first, source.read()[1]))
+
+        again = SyntheticSource((64, 48))
+        self.assertTrue(np.array_equal(first, again.read()[1]))
+
+    def test_synthetic_eyes_differ(self):
+        left = open_source('synthetic', None, 0, (64, 48), realtime=False)
+        right = open_source('synthetic', None, 1, (64, 48), realtime=False)
+        self.assertFalse(np.array_equal(left.read()[1], right.read()[1]))
+
+    def test_video_file_loops(self):
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'clip.avi')
+        try:
+            writer = cv2.VideoWriter(
+                path,
+                fourcc_code('MJPG'),
+                30,
+                (64, 48),
+            )
+            source = SyntheticSource((64, 48))
+            for _ in range(3):
+                writer.write(np.ascontiguousarray(source.read()[1]))
+            writer.release()
+
+            source = VideoFileSource(path, realtime=False)
+            self.assertTrue(source.isOpened())
+            for _ in range(7):
+                ok, frame = source.read()
+                self.assertTrue(ok)
+                self.assertEqual(frame.shape, (48, 64, 3))
+            source.release()
+        finally:
+            shutil.rmtree(directory)
+
+    def test_store(self):
+        directory = tempfile.mkdtemp()
+        base = os.path.join(directory, 'left')
+        try:
+            store = FrameStore(base, 4)
+            source = SyntheticSource((64, 48))
+            for index in range(3):
+                store.append(100 + index / 10.0, source.read()[1])
+            store.close()
+
+            source = open_source('store', base, realtime=False)
+            for index in range(3):
+                ok, frame = source.read()
+                self.assertTrue(ok)
+                self.assertEqual(frame.shape, (48, 64, 3))
+                self.assertAlmostEqual(
+                    source.captured() - source.started, index / 10.0, 5
+                )
+            self.assertTrue(source.finished())
+            self.assertEqual(source.read(), (False, None))
+        finally:
+            shutil.rmtree(directory)
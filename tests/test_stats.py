@@ -0,0 +1,56 @@
+from unittest import TestCase
+import json
+import os
+import tempfile
+
+from src.stats import CpuUsage, LatencyHistogram, Timings
+import time
+
+class TestStats(TestCase):
+
+    def test_histogram(self):
+        histogram = LatencyHistogram(size=100)
+        for millisecond in range(1, 201):
+            histogram.add(millisecond / 1000.0)
+
+        summary = histogram.summary()
+        self.assertEqual(summary['count'], 200)
+        self.assertAlmostEqual(summary['max'], 200)
+        self.assertAlmostEqual(summary['p50'], 151)
+        self.assertAlmostEqual(summary['p99'], 199)
+
+    def test_empty_histogram(self):
+        self.assertEqual(LatencyHistogram().summary(), dict(count=0))
+
+    def test_timings(self):
+        timings = Timings()
+        timings.add('left/capture', 0.01)
+        timings.add('display', 0.002)
+
+        report = timings.report()
+        self.assertTrue('left/capture' in report)
+        self.assertTrue('display' in report)
+
+        handle, path = tempfile.mkstemp()
+        os.close(handle)
+        try:
+            timings.dump(path)
+            with open(path) as dumped:
+                summary = json.load(dumped)
+            self.assertAlmostEqual(summary['display']['p50'], 2)
+        finally:
+            os.remove(path)
+
+    def test_cpu_usage(self):
+        usage = CpuUsage()
+        time.sleep(0.05)
+        idle = usage.summary()
+        self.assertGreater(idle['elapsed'], 0.04)
+        self.assertLess(idle['total'], 0.5)
+
+        usage.reset()
+        end = time.time() + 0.05
+        while time.time() < end:
+            pass
+        self.assertGreater(usage.summary()['total'], 0.5)
+        self.assertTrue('% of a core' in usage.report())
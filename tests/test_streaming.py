@@ -0,0 +1,218 @@
+from unittest import TestCase
+import socket
+import time
+import numpy as np
+import cv2
+from gevent import monkey
+
+from src.streaming import (
+    StreamClient, StreamServer, allocate_lock, read_frame
+)
+
+def image(value=0):
+    frame = np.zeros((48, 64, 3), dtype=np.uint8)
+    frame[:, :32] = value
+    frame[:, 32:] = 255 - value
+    return frame
+
+def connect(port, request=None):
+    client = socket.create_connection(('127.0.0.1', port), timeout=5)
+    if request is not None:
+        client.sendall(request.encode('ascii'))
+    return client
+
+def wait_for_clients(server, count):
+    deadline = time.time() + 5
+    while len(server.clients) < count and time.time() < deadline:
+        time.sleep(0.005)
+
+def show_until(server, done, frame=None, timeout=5):
+    """Show frames, as the display loop would, until `done()`"""
+    frame = image() if frame is None else frame
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        server.show(frame)
+        result = done()
+        if result:
+            return result
+        time.sleep(0.005)
+
+def show_one(server, frame=None, timeout=5):
+    """Show frames until one is streamed (i.e. a client was due one)"""
+    frame = image() if frame is None else frame
+    shown = server.shown
+    deadline = time.time() + timeout
+    while server.shown == shown and time.time() < deadline:
+        server.show(frame)
+        time.sleep(0.002)
+
+def read_until(stream, marker):
+    data = b''
+    while not data.endswith(marker):
+        byte = stream.read(1)
+        if not byte:
+            break
+        data += byte
+    return data
+
+def read_jpeg(stream):
+    """The next JPEG of an MJPEG stream"""
+    headers = read_until(stream, b'\r\n\r\n').decode('ascii')
+    length = [int(line.split(':')[1]) for line in headers.split('\r\n')
+              if line.startswith('Content-Length')][0]
+    data = stream.read(length)
+    return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+
+class TestStreaming(TestCase):
+
+    def setUp(self):
+        self.server = StreamServer(0, 0, host='127.0.0.1', fps=100)
+        self.sockets = []
+
+    def tearDown(self):
+        self.server.close()
+        for client in self.sockets:
+            client.close()
+
+    def connect(self, port, request=None):
+        client = connect(port, request)
+        self.sockets.append(client)
+        return client
+
+    def test_client_keeps_newest(self):
+        client = StreamClient(10)
+        client.offer(2.0, b'new')
+        client.offer(1.0, b'old')
+        self.assertEqual(client.next(), b'new')
+        client.close()
+        self.assertTrue(client.next() is None)
+
+    def test_no_clients(self):
+        self.server.show(image())
+        self.assertEqual(self.server.shown, 0)
+
+    def test_show_copies(self):
+        """The frame handed to the encoders is a copy, so the display
+        loop can overwrite the composite straight away"""
+        server = StreamServer(workers=1, fps=1000)
+        encoded = []
+        server.encode = lambda timestamp, frame, quality: \
+            encoded.append(frame) or b''
+        try:
+            server.add(StreamClient(1000))
+            composite = image(10)
+            show_until(server, lambda: encoded, composite)
+            self.assertFalse(np.shares_memory(encoded[0], composite))
+            composite[...] = 0
+            self.assertTrue(np.array_equal(encoded[0], image(10)))
+        finally:
+            server.close()
+
+    def test_show_drops_without_buffers(self):
+        """With every buffer waiting to be encoded, frames are dropped
+        rather than queued or allocated"""
+        server = StreamServer(workers=1, depth=2, fps=1000)
+        blocked = allocate_lock()
+        blocked.acquire()
+
+        def encode(timestamp, frame, quality):
+            with blocked:
+                return b''
+        server.encode = encode
+        try:
+            server.add(StreamClient(1000))
+            for _ in range(3):
+                server.show(image())
+                time.sleep(0.002)
+            self.assertEqual(server.shown, 2)
+            self.assertEqual(server.buffers, 2)
+            self.assertEqual(server.dropped, 1)
+        finally:
+            blocked.release()
+            server.close()
+
+    def test_raw(self):
+        client = self.connect(self.server.raw_port)
+        wait_for_clients(self.server, 1)
+        stream = client.makefile('rb')
+        show_one(self.server)
+        timestamp, frame = read_frame(stream)
+        self.assertGreater(timestamp, 0)
+        self.assertTrue(np.array_equal(frame, image()))
+
+    def test_mjpeg(self):
+        client = self.connect(
+            self.server.port, 'GET /stream.mjpg HTTP/1.0\r\n\r\n'
+        )
+        wait_for_clients(self.server, 1)
+        stream = client.makefile('rb')
+        headers = read_until(stream, b'\r\n\r\n').decode('ascii')
+        self.assertTrue(headers.startswith('HTTP/1.0 200'))
+        self.assertTrue('multipart/x-mixed-replace' in headers)
+
+        frames = []
+        for _ in range(2):
+            show_one(self.server, image(200))
+            frames.append(read_jpeg(stream))
+        self.assertEqual(frames[-1].shape, (48, 64, 3))
+        self.assertLess(np.abs(frames[-1].astype(int) - image(200)).mean(),
+                        10)
+
+    def test_snapshot_one_eye(self):
+        self.server.eye = 'right'
+        client = self.connect(
+            self.server.port, 'GET /frame.jpg?quality=50 HTTP/1.0\r\n\r\n'
+        )
+        wait_for_clients(self.server, 1)
+        show_until(self.server, lambda: not self.server.clients)
+        stream = client.makefile('rb')
+        headers = read_until(stream, b'\r\n\r\n').decode('ascii')
+        self.assertTrue('image/jpeg' in headers)
+        frame = cv2.imdecode(np.frombuffer(stream.read(), np.uint8),
+                             cv2.IMREAD_COLOR)
+        self.assertEqual(frame.shape, (48, 32, 3))
+        self.assertGreater(frame.mean(), 200)
+
+    def test_not_found(self):
+        client = self.connect(self.server.port, 'GET /other HTTP/1.0\r\n\r\n')
+        self.assertTrue(b' 404 ' in client.makefile('rb').readline())
+
+    def test_rate_cap(self):
+        self.connect(
+            self.server.port, 'GET /stream.mjpg?fps=10 HTTP/1.0\r\n\r\n'
+        )
+        wait_for_clients(self.server, 1)
+        start = time.time()
+        while time.time() - start < 0.3:
+            self.server.show(image())
+            time.sleep(0.002)
+        self.assertLessEqual(self.server.shown, 4)
+
+    def test_real_threads(self):
+        """Frames are encoded and sent while the display thread is
+        busy, even when gevent has patched threading (as it has once
+        the oculus_stream tests have run)"""
+        client = self.connect(self.server.raw_port)
+        wait_for_clients(self.server, 1)
+        self.server.show(image())
+        monkey.get_original('time', 'sleep')(0.3)
+        self.assertEqual(self.server.encoded, 1)
+        self.assertEqual(self.server.clients[0].sent, 1)
+        self.assertTrue(read_frame(client.makefile('rb')) is not None)
+
+    def test_slow_client(self):
+        """A client that never reads does not slow the display path"""
+        server = StreamServer(raw_port=0, fps=1000)
+        try:
+            self.connect(server.raw_port)
+            wait_for_clients(server, 1)
+            big = np.zeros((1080, 1920, 3), dtype=np.uint8)
+            start = time.time()
+            for _ in range(100):
+                server.show(big)
+                time.sleep(0.002)
+            self.assertLess((time.time() - start) / 100, 0.02)
+            self.assertEqual(len(server.clients), 1)
+            self.assertGreater(server.clients[0].dropped, 0)
+        finally:
+            server.close()
@@ -0,0 +1,45 @@
+from unittest import TestCase
+from mock import Mock
+import threading
+import time
+
+from src.workers import Ticker, Worker
+
+class TestWorkers(TestCase):
+
+    def test_worker(self):
+        called = threading.Event()
+        stage = Mock()
+
+        def iterate():
+            called.set()
+            time.sleep(0.001)
+        stage.iterate.side_effect = iterate
+
+        worker = Worker(stage)
+        worker.start()
+        self.assertTrue(called.wait(1))
+
+        worker.kill(timeout=1)
+        self.assertFalse(worker.is_alive())
+        self.assertTrue(stage.iterate.called)
+
+    def test_ticker(self):
+        ticker = Ticker(100)
+        start = time.time()
+        for _ in range(6):
+            ticker.wait()
+        self.assertGreater(time.time() - start, 0.045)
+        self.assertEqual(ticker.late, 0)
+        self.assertAlmostEqual(ticker.rate, 100)
+
+        time.sleep(0.05)
+        ticker.wait()
+        self.assertEqual(ticker.late, 1)
+
+    def test_ticker_unpaced(self):
+        ticker = Ticker(None)
+        start = time.time()
+        for _ in range(100):
+            ticker.wait()
+        self.assertLess(time.time() - start, 0.01)